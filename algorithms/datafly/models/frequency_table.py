@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import numpy as np
+
+from models.attribute import Attribute, HierarchicalAttribute, IntegerAttribute
+from models.config import Config
+from models.gentree import GenTree
+from models.partition import Partition
+
+
+class FrequencyTable(object):
+    """ The Datafly partitions as a table of integer codes, one column per QID, and the number of items in every row
+
+    Attributes
+        attr_names                          names of the QIDs, in the order of the columns
+        codes                               the codes of the generalized values of the partitions, one row per partition
+        counts                              the number of items per partition
+        nodes                               per hierarchical attribute, all the nodes of the hierarchy, indexed by the codes
+        parents                             per hierarchical attribute, the code of the parent of every node, the root being its own parent
+        levels                              per hierarchical attribute, the level of every node
+        lower_bounds, upper_bounds          per numerical attribute, the ranges indexed by the codes
+        present_codes                       per attribute, the sorted distinct codes in its column
+        count_below_k                       the number of items in the rows with a count below k
+    """
+
+    def __init__(self, candidates: dict[str, list[Attribute]], cell_counts: dict[tuple[int, ...], int]):
+        self.attr_names = list(candidates.keys())
+
+        self.nodes: dict[str, list[GenTree]] = {}
+        self.parents: dict[str, np.ndarray] = {}
+        self.levels: dict[str, np.ndarray] = {}
+        self.lower_bounds: dict[str, np.ndarray] = {}
+        self.upper_bounds: dict[str, np.ndarray] = {}
+
+        # The cells index the candidate values of the attributes
+        cells = np.array(list(cell_counts.keys()), dtype=np.int64).reshape(len(cell_counts), len(self.attr_names))
+        self.codes = np.empty_like(cells)
+        self.counts = np.array(list(cell_counts.values()), dtype=np.int64)
+
+        for column, (attr_name, attributes) in enumerate(candidates.items()):
+            if isinstance(attributes[0], HierarchicalAttribute):
+                nodes = list(Config.attr_metadata[attr_name].covered_nodes.values())
+                node_codes = {node.value: code for code, node in enumerate(nodes)}
+
+                self.nodes[attr_name] = nodes
+                self.parents[attr_name] = np.array([node_codes[node.ancestors[0].value] if node.ancestors else code for code, node in enumerate(nodes)], dtype=np.int64)
+                self.levels[attr_name] = np.array([node.level for node in nodes], dtype=np.int64)
+
+                candidate_codes = np.array([node_codes[attr.get_node().value] for attr in attributes], dtype=np.int64)
+            else:
+                self.lower_bounds[attr_name] = np.array([attr.get_min_value() for attr in attributes], dtype=np.int64)
+                self.upper_bounds[attr_name] = np.array([attr.get_max_value() for attr in attributes], dtype=np.int64)
+
+                candidate_codes = np.arange(len(attributes), dtype=np.int64)
+
+            self.codes[:, column] = candidate_codes[cells[:, column]]
+
+        # Merging the rows keeps every code present, only the generalized column changes its distinct codes
+        self.present_codes: dict[str, np.ndarray] = {attr_name: np.unique(self.codes[:, column]) for column, attr_name in enumerate(self.attr_names)}
+        self.count_below_k = self.sum_counts_below_k()
+
+
+    def sum_counts_below_k(self) -> int:
+        return int(self.counts[self.counts < Config.k].sum())
+
+
+    def get_count_below_k(self) -> int:
+        return self.count_below_k
+
+
+    def get_distinct_value_count(self, attr_name: str) -> int:
+        return len(self.present_codes[attr_name])
+
+
+    def merge_partitions(self):
+        """ Group the rows with the same codes, summing their counts """
+
+        self.codes, inverse = np.unique(self.codes, axis=0, return_inverse=True)
+        self.counts = np.bincount(inverse.reshape(-1), weights=self.counts, minlength=len(self.codes)).astype(np.int64)
+        self.count_below_k = self.sum_counts_below_k()
+
+
+    def generalize_numerical_attr(self, attr_name: str):
+        """ Merge adjacent ranges pairwise. If there is an odd number of ranges, leave the last one as is. """
+
+        column = self.attr_names.index(attr_name)
+        lower_bounds = self.lower_bounds[attr_name]
+        upper_bounds = self.upper_bounds[attr_name]
+
+        # The ranges are disjoint, their lower bounds order them
+        present_codes = self.present_codes[attr_name]
+        ordered_codes = present_codes[np.argsort(lower_bounds[present_codes], kind="stable")]
+
+        num_of_pairs = len(ordered_codes) // 2
+        first_of_pairs = ordered_codes[0:2 * num_of_pairs:2]
+        second_of_pairs = ordered_codes[1:2 * num_of_pairs:2]
+        leftover = ordered_codes[2 * num_of_pairs:]
+
+        old_to_new_codes = np.full(len(lower_bounds), -1, dtype=np.int64)
+        old_to_new_codes[first_of_pairs] = np.arange(num_of_pairs)
+        old_to_new_codes[second_of_pairs] = np.arange(num_of_pairs)
+        old_to_new_codes[leftover] = num_of_pairs
+
+        self.lower_bounds[attr_name] = np.concatenate([lower_bounds[first_of_pairs], lower_bounds[leftover]])
+        self.upper_bounds[attr_name] = np.concatenate([upper_bounds[second_of_pairs], upper_bounds[leftover]])
+        self.present_codes[attr_name] = np.arange(num_of_pairs + len(leftover), dtype=np.int64)
+
+        self.codes[:, column] = old_to_new_codes[self.codes[:, column]]
+        self.merge_partitions()
+
+
+    def generalize_categorical_attr(self, attr_name: str):
+        """ Step one level up in the hierarchy tree. The hierarchy trees are not necessarily balanced: to avoid generalizing one path to the root,
+        only the nodes on the deepest level present are replaced by their parents. """
+
+        column = self.attr_names.index(attr_name)
+        (levels, parents) = (self.levels[attr_name], self.parents[attr_name])
+
+        present_codes = self.present_codes[attr_name]
+        deepest_level = levels[present_codes].max()
+
+        node_codes = self.codes[:, column]
+        self.codes[:, column] = np.where(levels[node_codes] == deepest_level, parents[node_codes], node_codes)
+        self.present_codes[attr_name] = np.unique(np.where(levels[present_codes] == deepest_level, parents[present_codes], present_codes))
+        self.merge_partitions()
+
+
+    def create_attribute(self, attr_name: str, code: int) -> Attribute:
+        if attr_name in self.nodes:
+            return HierarchicalAttribute(attr_name, self.nodes[attr_name][code])
+
+        return IntegerAttribute(attr_name, self.lower_bounds[attr_name][code], self.upper_bounds[attr_name][code])
+
+
+    def to_partitions(self) -> list[Partition]:
+        attributes_per_code: dict[tuple[str, int], Attribute] = {}
+        partitions: list[Partition] = []
+
+        for row, count in zip(self.codes.tolist(), self.counts.tolist()):
+            attributes: dict[str, Attribute] = {}
+
+            for attr_name, code in zip(self.attr_names, row):
+                if (attr_name, code) not in attributes_per_code:
+                    attributes_per_code[(attr_name, code)] = self.create_attribute(attr_name, code)
+
+                attributes[attr_name] = attributes_per_code[(attr_name, code)]
+
+            partitions.append(Partition(count, attributes))
+
+        return partitions
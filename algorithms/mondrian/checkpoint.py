@@ -0,0 +1,72 @@
+import gzip
+import json
+import os
+
+from algorithms.mondrian.models.mondrian_partition import MondrianPartition
+from algorithms.mondrian.partition_tree import collect_tree_nodes
+
+from models.attribute import create_attribute
+from models.config import Config
+
+
+def save_checkpoint(file_path: str, open_partitions: list[MondrianPartition], final_partitions: list[MondrianPartition]):
+    """ Write the state of the partition tree into a gzipped JSON file: every node of the tree leading to the open and the final partitions, 
+    parents before their children, and the indices of the open and the final partitions among the nodes.
+    Every node is stored as [index of the parent or None, partition_id, path, count, [[attr_name, gen_value, split_allowed] for every changed attribute]] """
+
+    nodes = collect_tree_nodes(open_partitions + final_partitions)
+    index_of_node = {id(partition): i for i, partition in enumerate(nodes)}
+
+    checkpoint = {
+        "k": Config.k,
+        "qid_names": Config.qid_names,
+        "nodes": [_map_partition_to_entry(partition, index_of_node) for partition in nodes],
+        "open": [index_of_node[id(partition)] for partition in open_partitions],
+        "final": [index_of_node[id(partition)] for partition in final_partitions]
+    }
+
+    # Write into a temporary file first, so that a crash while writing does not destroy the previous checkpoint
+    with gzip.open(f"{file_path}.tmp", "wt") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, separators=(',', ':'))
+
+    os.replace(f"{file_path}.tmp", file_path)
+
+
+def load_checkpoint(file_path: str) -> tuple[list[MondrianPartition], list[MondrianPartition]]:
+    """ Rebuild the partition tree from a checkpoint written by save_checkpoint, and return its open and final partitions """
+
+    with gzip.open(file_path, "rt") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+
+    if checkpoint["k"] != Config.k or checkpoint["qid_names"] != Config.qid_names:
+        raise Exception(f"The checkpoint {file_path} was created with a different k or different QIDs than the current config")
+
+    nodes: list[MondrianPartition] = []
+
+    for entry in checkpoint["nodes"]:
+        nodes.append(_map_entry_to_partition(entry, nodes))
+
+    return [nodes[i] for i in checkpoint["open"]], [nodes[i] for i in checkpoint["final"]]
+
+
+def _map_partition_to_entry(partition: MondrianPartition, index_of_node: dict[int, int]) -> list:
+    return [
+        index_of_node[id(partition.parent)] if partition.parent is not None else None,
+        partition.partition_id,
+        partition.path, 
+        partition.count, 
+        [[attr.get_name(), attr.get_gen_value(), attr.get_split_allowed()] for attr in partition.changed_attributes]
+    ]
+
+
+def _map_entry_to_partition(entry: list, nodes: list[MondrianPartition]) -> MondrianPartition:
+    (parent_index, partition_id, path, count, changed_attributes) = entry
+
+    partition = MondrianPartition(count, {}, tuple(path), nodes[parent_index] if parent_index is not None else None)
+    partition.partition_id = partition_id
+
+    # A partition might change the same attribute more than once, the order of the changes is kept
+    for (attr_name, gen_value, split_allowed) in changed_attributes:
+        partition.update_attribute(create_attribute(attr_name, gen_value, split_allowed))
+
+    return partition
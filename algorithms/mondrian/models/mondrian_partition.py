@@ -6,7 +6,70 @@ from models.partition import Partition
 
 
 class MondrianPartition(Partition):
-    """ Extend the Partition class with algorithm-specific methods """
+    """ Extend the Partition class with algorithm-specific methods
+
+    The partitions form a tree sharing its structure: a subpartition only stores the attributes it changed, and points to its parent.
+    The full dict of attributes is materialized on demand, and kept only while the partition is being processed, or once it is final.
+
+    Attributes
+        parent                              the partition this one was split from, None for the root of the tree
+        changed_attributes                  the attributes changed compared to the parent, all of them for the root
+        materialized_attributes             the cached full dict of attributes, None if not materialized
+        path                                indices of the subpartitions leading from the whole dataset to this partition in the partition tree
+        partition_id                        unique id of the partition within the run, assigned by Mondrian before the partition is processed
+    """
+
+    # The attributes of the base class are replaced by the attributes property
+    __slots__ = ("parent", "changed_attributes", "materialized_attributes", "path", "partition_id")
+
+    def __init__(self, count: int, attributes: dict[str, Attribute], path: tuple[int, ...] = (), parent: MondrianPartition = None):
+        self.count = count
+        self.parent = parent
+        self.changed_attributes: tuple[Attribute, ...] = tuple(attributes.values())
+        self.materialized_attributes: dict[str, Attribute] = None
+        self.path = path
+        self.partition_id: int = None
+
+
+    @property
+    def attributes(self) -> dict[str, Attribute]:
+        """ The attributes of the root, overridden by the ones changed on the way down to this partition. 
+        A fresh dict is built on every access, unless the partition is materialized. """
+
+        if self.materialized_attributes is not None:
+            return self.materialized_attributes
+
+        changes_from_the_root: list[tuple[Attribute, ...]] = []
+        partition = self
+
+        while partition is not None:
+            changes_from_the_root.append(partition.changed_attributes)
+            partition = partition.parent
+
+        return {attr.get_name(): attr for changed_attributes in reversed(changes_from_the_root) for attr in changed_attributes}
+
+
+    def materialize_attributes(self):
+        """ Keep the full dict of attributes, while the partition is being processed """
+
+        if self.materialized_attributes is None:
+            self.materialized_attributes = self.attributes
+
+
+    def update_attribute(self, attribute: Attribute):
+        """ Replace the attribute of the same name in this partition only """
+
+        self.changed_attributes = self.changed_attributes + (attribute,)
+
+        if self.materialized_attributes is not None:
+            self.materialized_attributes[attribute.get_name()] = attribute
+
+
+    def release_attributes(self):
+        """ Drop the materialized dict, once the partition is not processed any more """
+
+        self.materialized_attributes = None
+
 
     def check_if_splittable(self) -> bool:
         if self.count >= 2 * Config.k and sum(map(lambda attr: attr.get_split_allowed(), self.attributes.values())):
@@ -35,4 +98,4 @@ class MondrianPartition(Partition):
         if chosen_attr == None:
             raise Exception("No QID was chosen in the choose_qid_name call")    
 
-        return chosen_attr  
\ No newline at end of file
+        return chosen_attr  
@@ -1,46 +1,109 @@
 import copy
+import heapq
+import itertools
+import os
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 from interfaces.abstract_algorithm import AbstractAlgorithm
+from interfaces.abstract_sink import AbstractSink
 from interfaces.mondrian_api import MondrianAPI
 
-from models.attribute import Attribute, HierarchicalAttribute, IntegerAttribute, IpAttribute, TimestampInMsAttribute
+from models.attribute import Attribute, HierarchicalAttribute, IntegerAttribute, IpAttribute, TimestampInMsAttribute, get_ip_version
 from models.config import Config
+from models.split_statistics import SplitStatistics
 
+from algorithms.mondrian.checkpoint import load_checkpoint, save_checkpoint
 from algorithms.mondrian.models.mondrian_partition import MondrianPartition
+from algorithms.mondrian.partition_tree import collect_tree_nodes, export_partition_tree
+
+from sinks.database_sink import DatabaseSink
 
 from utils.config_processor import parse_config
+from utils.tracing import trace_phase
 
 
 class Mondrian(AbstractAlgorithm):
     db_connector: MondrianAPI
     PARTITION_UNDER_PROCESSING: MondrianPartition
 
-    def __init__(self, db_connector: MondrianAPI):
+    def __init__(self, db_connector: MondrianAPI, execution: str = "depth-first", workers: int = 1, 
+                 checkpoint_path: str = None, checkpoint_interval: int = 60, resume: bool = False, sink: AbstractSink = None, partition_tree_path: str = None):
+        assert execution in ["depth-first", "breadth-first"]
+        assert workers >= 1
+
         self.db_connector = db_connector
+        self.sink = sink if sink is not None else DatabaseSink()
+        self.execution = execution
+        self.workers = workers
+
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+        self.last_checkpoint_time = time.time()
+        self.partition_tree_path = partition_tree_path
 
         self.final_partitions : list[MondrianPartition] = []
+        self.partition_ids = itertools.count()
 
 
-    def create_subpartitions_splitting_along(self, attribute: Attribute, partition: MondrianPartition) -> list[MondrianPartition]:
-        subpartitions: list[MondrianPartition] = []
+    def is_numerical(self, attribute: Attribute) -> bool:
+        return isinstance(attribute, IntegerAttribute) or isinstance(attribute, TimestampInMsAttribute)
 
-        if isinstance(attribute, IntegerAttribute) or isinstance(attribute, TimestampInMsAttribute):
-            (median, next_unique_value) = self.db_connector.get_value_to_split_at_and_next_unique_value(attribute.get_name(), partition)
-            if median is None or next_unique_value is None:
-                return []
 
-            (min_value, max_value) = self.db_connector.get_attribute_min_max(attribute.get_name(), partition.attributes)
+    def uses_split_statistics(self, attribute: Attribute) -> bool:
+        return self.is_numerical(attribute) or isinstance(attribute, IpAttribute)
 
-            attribute.set_limits([(min_value, median), (next_unique_value, max_value)])
 
-        split_attributes = attribute.split()
-        
-        for attr in split_attributes:            
-            new_partition_attributes = partition.attributes.copy()
-            new_partition_attributes[attr.get_name()] = attr
+    def fetch_split_statistics(self, attribute: Attribute, partition: MondrianPartition) -> SplitStatistics | None:
+        if isinstance(attribute, TimestampInMsAttribute):
+            return self.db_connector.get_timestamp_split_statistics(attribute.get_name(), partition)
+
+        if isinstance(attribute, IpAttribute):
+            return self.db_connector.get_ip_split_statistics(attribute.get_name(), partition)
+
+        return self.db_connector.get_split_statistics(attribute.get_name(), partition)
+
+
+    def fetch_split_statistics_batch(self, attrs_to_split: list[Attribute], partitions: list[MondrianPartition]) -> list[SplitStatistics | None]:
+        """ Same as fetch_split_statistics, for every partition of a level, with one batch per kind of attribute. None for the attributes split without statistics. """
+
+        batch_fetchers = [
+            (lambda attr: isinstance(attr, TimestampInMsAttribute), self.db_connector.get_timestamp_split_statistics_batch),
+            (lambda attr: isinstance(attr, IpAttribute), self.db_connector.get_ip_split_statistics_batch),
+            (lambda attr: isinstance(attr, IntegerAttribute), self.db_connector.get_split_statistics_batch)
+        ]
+
+        split_statistics_per_partition: list[SplitStatistics | None] = [None] * len(partitions)
 
-            subpartitions.append(MondrianPartition(self.db_connector.get_document_count(new_partition_attributes), new_partition_attributes))
+        for (is_of_kind, fetch_batch) in batch_fetchers:
+            indices = [i for i, attr in enumerate(attrs_to_split) if is_of_kind(attr)]
 
+            for i, split_statistics in zip(indices, fetch_batch([(attrs_to_split[i].get_name(), partitions[i]) for i in indices])):
+                split_statistics_per_partition[i] = split_statistics
+
+        return split_statistics_per_partition
+
+
+    def split_partition_along(self, attribute: Attribute, partition: MondrianPartition, split_statistics: SplitStatistics = None, subpartition_counts: list[int] = None) -> list[MondrianPartition]:
+        """ Create the subpartitions. Their count is None, unless the backend already provided it with the split statistics or the children counts. """
+
+        if split_statistics is not None:
+            # Other partitions, possibly under processing in other threads, might share the Attribute object
+            attribute = copy.copy(attribute)
+            attribute.set_limits(split_statistics.get_limits())
+            subpartition_counts = split_statistics.get_counts()
+
+        subpartitions: list[MondrianPartition] = []
+
+        for i, attr in enumerate(attribute.split()):            
+            subpartitions.append(MondrianPartition(subpartition_counts[i] if subpartition_counts is not None else None, {attr.get_name(): attr}, partition.path + (i,), partition))
+
+        return subpartitions
+
+
+    def validate_subpartitions(self, partition: MondrianPartition, subpartitions: list[MondrianPartition]) -> list[MondrianPartition]:
         if sum(sub_p.count for sub_p in subpartitions) != partition.count:    
             raise Exception("The number of items in the subpartitions is not equal to that of the original partition")
 
@@ -50,29 +113,204 @@ class Mondrian(AbstractAlgorithm):
 
         return subpartitions
 
-    
 
-    def anonymize(self, partition: MondrianPartition):
-        """ Main procedure of Half_MondrianPartition. Recursively partition groups until not allowable. """
-    
-        # Close the EC, if not splittable any more
-        if not partition.check_if_splittable():
-            self.final_partitions.append(partition)
-            return                
-
-        attr_to_split = partition.choose_attribute()
-        subpartitions = self.create_subpartitions_splitting_along(attr_to_split, partition)        
-                
-        if len(subpartitions) == 0:
-            # Close the attribute for this partition, as it cannot be split any more
-            # The same Attribute object should not be directly manipulated, as other MondrianPartitions might also rely on it. A fresh one must be created.   
-            copied_attr = copy.copy(attr_to_split)
-            copied_attr.split_allowed = False
-            partition.attributes[attr_to_split.get_name()] = copied_attr
-            self.anonymize(partition)
-        else:            
+    def create_subpartitions_splitting_along(self, attribute: Attribute, partition: MondrianPartition) -> list[MondrianPartition]:
+        split_statistics: SplitStatistics = None
+        subpartition_counts: list[int] = None
+
+        if self.uses_split_statistics(attribute):
+            split_statistics = self.fetch_split_statistics(attribute, partition)
+            if split_statistics is None:
+                return []
+
+        if isinstance(attribute, HierarchicalAttribute):
+            subpartition_counts = self.db_connector.get_children_counts(attribute.get_name(), partition)
+
+        subpartitions = self.split_partition_along(attribute, partition, split_statistics, subpartition_counts)
+
+        if any(sub_p.count is None for sub_p in subpartitions):
+            for sub_p, count in zip(subpartitions, self.db_connector.get_subpartition_counts(partition, attribute.get_name(), subpartitions)):
+                sub_p.count = count
+
+        return self.validate_subpartitions(partition, subpartitions)
+
+
+    def accept_splits(self, splits: list[tuple[MondrianPartition, Attribute, list[MondrianPartition]]]):
+        """ Give the subpartitions of the accepted splits their ids, and let the backend follow the splits """
+
+        for (_, _, subpartitions) in splits:
             for sub_p in subpartitions:
-                self.anonymize(sub_p)
+                sub_p.partition_id = next(self.partition_ids)
+
+        self.db_connector.apply_splits([(partition, attribute.get_name(), subpartitions) for (partition, attribute, subpartitions) in splits])
+
+
+    def close_attribute(self, partition: MondrianPartition, attribute: Attribute):
+        """ Close the attribute for this partition, as it cannot be split any more """
+
+        # The same Attribute object should not be directly manipulated, as other MondrianPartitions might also rely on it. A fresh one must be created.   
+        closed_attribute = copy.copy(attribute)
+        closed_attribute.split_allowed = False
+        partition.update_attribute(closed_attribute)
+    
+
+    def split_or_close(self, partition: MondrianPartition) -> list[MondrianPartition]:
+        """ Split the partition along the first attribute that allows it, closing the attributes that do not. Return [], if the partition is final. """
+
+        partition.materialize_attributes()
+
+        try:
+            while partition.check_if_splittable():
+                attr_to_split = partition.choose_attribute()
+                subpartitions = self.create_subpartitions_splitting_along(attr_to_split, partition)
+
+                if len(subpartitions) > 0:
+                    self.accept_splits([(partition, attr_to_split, subpartitions)])
+                    return subpartitions
+
+                self.close_attribute(partition, attr_to_split)
+
+            return []
+        finally:
+            partition.release_attributes()
+
+
+    def anonymize(self, open_partitions: list[MondrianPartition]):
+        """ Main procedure of Half_MondrianPartition. Split partitions from a work queue until not allowable.
+        The queue is ordered by the path of the partitions, so that a single worker processes the partition tree depth-first.
+        With more workers, the independent partitions are processed concurrently, while the backend answers the queries. """
+
+        work_queue = [(partition.path, partition) for partition in open_partitions]
+        heapq.heapify(work_queue)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            partition_of_future: dict[Future, MondrianPartition] = {}
+
+            while work_queue or partition_of_future:
+                while work_queue and len(partition_of_future) < self.workers:
+                    (_, partition) = heapq.heappop(work_queue)
+                    partition_of_future[executor.submit(self.split_or_close, partition)] = partition
+
+                done, _ = wait(partition_of_future.keys(), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    partition = partition_of_future.pop(future)
+                    subpartitions = future.result()
+
+                    # Close the EC, if not splittable any more
+                    if len(subpartitions) == 0:
+                        self.final_partitions.append(partition)
+
+                    for sub_p in subpartitions:
+                        heapq.heappush(work_queue, (sub_p.path, sub_p))
+
+                if self.is_checkpoint_due():
+                    self.write_checkpoint([partition for (_, partition) in work_queue] + list(partition_of_future.values()))
+
+
+    def split_level(self, partitions: list[MondrianPartition]) -> list[MondrianPartition]:
+        """ Try to split every partition of the level, sending the queries of all partitions together. Return the partitions of the next level. """
+
+        attrs_to_split = [partition.choose_attribute() for partition in partitions]
+
+        split_statistics_per_partition = self.fetch_split_statistics_batch(attrs_to_split, partitions)
+
+        hierarchical_splits = [(attr.get_name(), partition) for attr, partition in zip(attrs_to_split, partitions) if isinstance(attr, HierarchicalAttribute)]
+        children_counts_per_attr_and_partition = iter(self.db_connector.get_children_counts_batch(hierarchical_splits))
+
+        # None marks a numerical or IP attribute, along which the partition cannot be split
+        subpartitions_per_partition: list[list[MondrianPartition] | None] = []
+
+        for attr, partition, split_statistics in zip(attrs_to_split, partitions, split_statistics_per_partition):
+            subpartition_counts: list[int] = None
+
+            if self.uses_split_statistics(attr) and split_statistics is None:
+                subpartitions_per_partition.append(None)
+                continue
+
+            if isinstance(attr, HierarchicalAttribute):
+                subpartition_counts = next(children_counts_per_attr_and_partition)
+
+            subpartitions_per_partition.append(self.split_partition_along(attr, partition, split_statistics, subpartition_counts))
+
+        splits_to_count = [
+            (partition, attr.get_name(), subpartitions) 
+            for attr, partition, subpartitions in zip(attrs_to_split, partitions, subpartitions_per_partition) 
+            if subpartitions and any(sub_p.count is None for sub_p in subpartitions)
+        ]
+
+        for (_, _, subpartitions), counts in zip(splits_to_count, self.db_connector.get_subpartition_counts_batch(splits_to_count)):
+            for sub_p, count in zip(subpartitions, counts):
+                sub_p.count = count
+
+        next_level: list[MondrianPartition] = []
+        accepted_splits: list[tuple[MondrianPartition, Attribute, list[MondrianPartition]]] = []
+
+        for attr, partition, subpartitions in zip(attrs_to_split, partitions, subpartitions_per_partition):
+            valid_subpartitions = self.validate_subpartitions(partition, subpartitions) if subpartitions is not None else []
+
+            if len(valid_subpartitions) == 0:
+                # Retry the partition on the next level, along another attribute
+                self.close_attribute(partition, attr)
+                next_level.append(partition)
+            else:
+                accepted_splits.append((partition, attr, valid_subpartitions))
+                next_level += valid_subpartitions
+
+        self.accept_splits(accepted_splits)
+
+        for (partition, _, _) in accepted_splits:
+            partition.release_attributes()
+
+        return next_level
+
+
+    def anonymize_level_by_level(self, open_partitions: list[MondrianPartition]):
+        """ Breadth-first variant of anonymize: all splittable partitions of a level are processed together,
+        so the number of round trips to the backend grows with the depth of the partition tree and not with the number of partitions """
+
+        level = open_partitions
+
+        while len(level) > 0:
+            splittable_partitions: list[MondrianPartition] = []
+
+            for partition in level:
+                partition.materialize_attributes()
+
+                if partition.check_if_splittable():
+                    splittable_partitions.append(partition)
+                else:
+                    partition.release_attributes()
+                    self.final_partitions.append(partition)
+
+            level = self.split_level_in_parallel(splittable_partitions) if self.workers > 1 else self.split_level(splittable_partitions)
+
+            if self.is_checkpoint_due():
+                self.write_checkpoint(level)
+
+
+    def is_checkpoint_due(self) -> bool:
+        """ Checked after every step, before the list of the open partitions is built for the checkpoint """
+
+        return self.checkpoint_path is not None and time.time() - self.last_checkpoint_time >= self.checkpoint_interval
+
+
+    def write_checkpoint(self, open_partitions: list[MondrianPartition]):
+        if self.checkpoint_path is None:
+            return
+
+        save_checkpoint(self.checkpoint_path, open_partitions, self.final_partitions)
+        self.last_checkpoint_time = time.time()
+
+
+    def split_level_in_parallel(self, partitions: list[MondrianPartition]) -> list[MondrianPartition]:
+        """ Split the level in one chunk per worker thread, each sending its own batched queries """
+
+        chunk_size = max(1, -(-len(partitions) // self.workers))
+        chunks = [partitions[i:i + chunk_size] for i in range(0, len(partitions), chunk_size)]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return [partition for next_level_chunk in executor.map(self.split_level, chunks) for partition in next_level_chunk]
 
     
     def set_up_the_first_partition(self):
@@ -84,16 +322,16 @@ class Mondrian(AbstractAlgorithm):
             root_node_or_num_range = Config.attr_metadata[attr_name]
 
             if value["type"] == "hierarchical":
-                attributes[attr_name] = HierarchicalAttribute(attr_name, len(root_node_or_num_range), root_node_or_num_range.value)
+                attributes[attr_name] = HierarchicalAttribute(attr_name, root_node_or_num_range)
 
             if value["type"] == "numerical":
-                attributes[attr_name] = IntegerAttribute(attr_name, len(root_node_or_num_range), root_node_or_num_range.value)
+                attributes[attr_name] = IntegerAttribute(attr_name, root_node_or_num_range.min, root_node_or_num_range.max)
             
             if value["type"] == "timestamp":
-                attributes[attr_name] = TimestampInMsAttribute(attr_name, len(root_node_or_num_range), root_node_or_num_range.value)
+                attributes[attr_name] = TimestampInMsAttribute(attr_name, root_node_or_num_range.min, root_node_or_num_range.max)
             
             if value["type"] == "ip":
-                attributes[attr_name] = IpAttribute(attr_name)
+                attributes[attr_name] = IpAttribute(attr_name, version=get_ip_version(attr_name))
                         
 
         whole_partition_size = self.db_connector.get_document_count(attributes)
@@ -118,13 +356,53 @@ class Mondrian(AbstractAlgorithm):
         The final result is returned in 2-dimensional list.
         """
 
-        self.initialize(config)
+        with trace_phase("config parsing"):
+            self.initialize(config)
+
+        with trace_phase("partitioning"):
+            self.build_final_partitions()
+
+        with trace_phase("push"):
+            return self.sink.write_partitions(self.db_connector, self.final_partitions)
+
+
+    def build_final_partitions(self):
+        """ Partition the dataset from scratch, or continue from the checkpoint """
+
+        open_partitions: list[MondrianPartition]
 
-        whole_partition = self.set_up_the_first_partition()        
+        if self.resume and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            (open_partitions, self.final_partitions) = load_checkpoint(self.checkpoint_path)
+            print(f"Resuming from {self.checkpoint_path}: {len(open_partitions)} open and {len(self.final_partitions)} final partitions")
 
-        self.anonymize(whole_partition)
+            # The restored partitions keep their ids, the new ones continue after the largest of them
+            self.partition_ids = itertools.count(max(partition.partition_id for partition in collect_tree_nodes(open_partitions + self.final_partitions)) + 1)
+        else:
+            open_partitions = [self.set_up_the_first_partition()]
+            open_partitions[0].partition_id = next(self.partition_ids)
 
-        if sum(map(lambda partition: partition.count, self.final_partitions)) != whole_partition.count:        
+        dataset_count = sum(map(lambda partition: partition.count, open_partitions + self.final_partitions))
+
+        # The final partitions restored from a checkpoint are read through their labels as well, when they are pushed
+        self.db_connector.label_partitions(open_partitions + self.final_partitions)
+
+        if self.execution == "breadth-first":
+            self.anonymize_level_by_level(open_partitions)
+        else:
+            self.anonymize(open_partitions)
+
+        # The order of the final partitions does not depend on the execution order
+        self.final_partitions.sort(key=lambda partition: partition.path)
+
+        # The final partitions are leaves read many times by the NCP, the connector and the sink, only the interior nodes keep sharing
+        for partition in self.final_partitions:
+            partition.materialize_attributes()
+
+        if sum(map(lambda partition: partition.count, self.final_partitions)) != dataset_count:        
             raise Exception("Losing records during anonymization")
 
-        return self.db_connector.push_partitions(self.final_partitions)        
+        # The finished partition tree can be reused to push the partitions again, without partitioning
+        self.write_checkpoint([])
+
+        if self.partition_tree_path is not None:
+            export_partition_tree(self.partition_tree_path, self.final_partitions)
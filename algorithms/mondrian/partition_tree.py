@@ -0,0 +1,35 @@
+import json
+
+from algorithms.mondrian.models.mondrian_partition import MondrianPartition
+
+
+def collect_tree_nodes(partitions: list[MondrianPartition]) -> list[MondrianPartition]:
+    """ The partitions and all their ancestors, each once, sorted so that the parents come before their children """
+
+    nodes: dict[int, MondrianPartition] = {}
+
+    for partition in partitions:
+        while partition is not None and id(partition) not in nodes:
+            nodes[id(partition)] = partition
+            partition = partition.parent
+
+    return sorted(nodes.values(), key=lambda partition: partition.path)
+
+
+def export_partition_tree(file_path: str, final_partitions: list[MondrianPartition]):
+    """ Write every node of the partition tree leading to the final partitions into a JSONL file, parents before their children.
+    Every node is stored as {"id", "parent", "path", "count", "final", "attributes"}, where the attributes are the generalized values
+    changed by the node, all of them for the root """
+
+    final_ids = set(id(partition) for partition in final_partitions)
+
+    with open(file_path, "w") as tree_file:
+        for partition in collect_tree_nodes(final_partitions):
+            tree_file.write(json.dumps({
+                "id": partition.partition_id,
+                "parent": partition.parent.partition_id if partition.parent is not None else None,
+                "path": partition.path,
+                "count": partition.count,
+                "final": id(partition) in final_ids,
+                "attributes": {attr.get_name(): attr.get_gen_value() for attr in partition.changed_attributes}
+            }) + "\n")
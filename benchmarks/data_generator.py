@@ -0,0 +1,132 @@
+import argparse
+import csv
+import json
+
+from typing import Callable, Iterable
+
+import numpy as np
+
+from utils.gen_hierarchy_parser import read_gen_hierarchies_from_json
+
+
+# The rows are generated in chunks of this size, each from its own child of the seed, so that the output only depends on the seed and the number of rows
+CHUNK_SIZE = 1000000
+
+CONFIG_PATHS = {
+    "adults": "configs/adults_config.json",
+    "kibana": "configs/kibana_data_logs.json"
+}
+
+KIBANA_START_IN_MS = 1680000000000
+KIBANA_PERIOD_IN_MS = 30 * 24 * 60 * 60 * 1000
+KIBANA_CLIENT_NETWORKS = [(10, 0), (66, 249), (172, 16), (192, 168)]
+KIBANA_HOSTS = ["www.elastic.co", "artifacts.elastic.co", "cdn.elastic-elastic-elastic.org"]
+KIBANA_REQUESTS = ["/", "/beats", "/elasticsearch", "/kibana", "/logstash", "/enterprise", "/apm"]
+
+
+def read_config(dataset: str) -> dict:
+    with open(CONFIG_PATHS[dataset]) as config_file:
+        return json.load(config_file)
+
+
+def read_leaf_values(config: dict) -> dict[str, list[str]]:
+    """ The leaf values of the hierarchies of the config, in the order of the config file """
+
+    categorical_attr_config = {attr_name: value for attr_name, value in config["qids"].items() if "tree" in value}
+
+    return {attr_name: root.get_leaf_node_values() for attr_name, root in read_gen_hierarchies_from_json(categorical_attr_config).items()}
+
+
+def choose_skewed(rng: np.random.Generator, values: list[str], num_of_rows: int) -> np.ndarray:
+    """ Zipf-like frequencies, so that some values are rare, as in the real datasets """
+
+    weights = 1.0 / np.arange(1, len(values) + 1)
+
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=num_of_rows, p=weights / weights.sum())]
+
+
+def generate_adults_chunk(rng: np.random.Generator, num_of_rows: int, leaf_values: dict[str, list[str]]) -> dict[str, np.ndarray]:
+    columns: dict[str, np.ndarray] = {
+        "age": np.clip(np.rint(rng.gamma(2.5, 8.0, num_of_rows) + 17), 17, 90).astype(np.int64),
+        "education_num": np.clip(np.rint(rng.normal(10, 2.5, num_of_rows)), 1, 16).astype(np.int64)
+    }
+
+    for attr_name, values in leaf_values.items():
+        columns[attr_name] = choose_skewed(rng, values, num_of_rows)
+
+    columns["class"] = np.where(rng.random(num_of_rows) < 0.24, ">50K", "<=50K").astype(object)
+
+    return columns
+
+
+def generate_kibana_chunk(rng: np.random.Generator, num_of_rows: int, leaf_values: dict[str, list[str]]) -> dict[str, np.ndarray]:
+    networks = np.array(KIBANA_CLIENT_NETWORKS)[rng.integers(0, len(KIBANA_CLIENT_NETWORKS), num_of_rows)]
+    host_parts = rng.integers(0, 256, (num_of_rows, 2))
+
+    return {
+        "timestamp": KIBANA_START_IN_MS + rng.integers(0, KIBANA_PERIOD_IN_MS, num_of_rows),
+        "clientip": np.array([f"{a}.{b}.{c}.{d}" for (a, b), (c, d) in zip(networks.tolist(), host_parts.tolist())], dtype=object),
+        "bytes": np.rint(rng.lognormal(8.0, 1.2, num_of_rows)).astype(np.int64),
+        "geo.dest": choose_skewed(rng, leaf_values["geo.dest"], num_of_rows),
+        "host": choose_skewed(rng, KIBANA_HOSTS, num_of_rows),
+        "request": choose_skewed(rng, KIBANA_REQUESTS, num_of_rows)
+    }
+
+
+CHUNK_GENERATORS: dict[str, Callable[[np.random.Generator, int, dict[str, list[str]]], dict[str, np.ndarray]]] = {
+    "adults": generate_adults_chunk,
+    "kibana": generate_kibana_chunk
+}
+
+
+def generate_chunks(dataset: str, num_of_rows: int, seed: int = 0) -> Iterable[dict[str, np.ndarray]]:
+    leaf_values = read_leaf_values(read_config(dataset))
+    num_of_chunks = -(-num_of_rows // CHUNK_SIZE)
+
+    for i, chunk_seed in enumerate(np.random.SeedSequence(seed).spawn(num_of_chunks)):
+        yield CHUNK_GENERATORS[dataset](np.random.default_rng(chunk_seed), min(CHUNK_SIZE, num_of_rows - i * CHUNK_SIZE), leaf_values)
+
+
+def generate_columns(dataset: str, num_of_rows: int, seed: int = 0) -> dict[str, np.ndarray]:
+    """ The whole dataset in memory, in the dict of column name -> array accepted by the NumpyConnector. 
+    The chunks are copied into preallocated columns, so that only one chunk is held next to the dataset. """
+
+    columns: dict[str, np.ndarray] = {}
+
+    for i, chunk in enumerate(generate_chunks(dataset, num_of_rows, seed)):
+        for column_name, values in chunk.items():
+            if column_name not in columns:
+                columns[column_name] = np.empty(num_of_rows, dtype=values.dtype)
+
+            columns[column_name][i * CHUNK_SIZE:i * CHUNK_SIZE + len(values)] = values
+
+    return columns
+
+
+def write_dataset(dataset: str, num_of_rows: int, file_path: str, seed: int = 0):
+    """ Stream the dataset into a CSV (adults) or JSONL (kibana) file, one chunk at a time, as the files of the real datasets """
+
+    with open(file_path, "w", newline='') as data_file:
+        writer = csv.writer(data_file) if dataset == "adults" else None
+
+        for i, chunk in enumerate(generate_chunks(dataset, num_of_rows, seed)):
+            column_names = list(chunk.keys())
+            rows = zip(*[chunk[column_name].tolist() for column_name in column_names])
+
+            if writer is not None:
+                if i == 0:
+                    writer.writerow(column_names)
+                writer.writerows(rows)
+            else:
+                data_file.writelines(json.dumps(dict(zip(column_names, row))) + "\n" for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Synthetic dataset generator')
+    parser.add_argument('dataset', type=str, help="Kind of the dataset: adults / kibana")
+    parser.add_argument('rows', type=int, help="Number of rows: int")
+    parser.add_argument('path', type=str, help="Output file, CSV for adults and JSONL for kibana: str")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generator: int (default: 0)")
+
+    args = parser.parse_args()
+    write_dataset(args.dataset, args.rows, args.path, args.seed)
@@ -0,0 +1,98 @@
+import argparse
+import copy
+import json
+import timeit
+
+from typing import Callable
+
+from db_connectors.numpy_connector import NumpyConnector
+
+from models.attribute import Attribute, HierarchicalAttribute, IntegerAttribute, IpAttribute, TimestampInMsAttribute
+from models.config import Config
+from models.gentree import GenTree
+
+from benchmarks.data_generator import generate_columns, read_config
+
+from utils.config_processor import parse_config
+
+
+def set_up_kibana_attributes() -> dict[str, Attribute]:
+    """ Parse the kibana config over a small generated dataset, and create the attributes of the whole dataset, with the hierarchical one a level deeper """
+
+    parse_config(read_config("kibana"), NumpyConnector(generate_columns("kibana", 1000)))
+
+    geo_root: GenTree = Config.attr_metadata["geo.dest"]
+    (bytes_range, timestamp_range) = (Config.attr_metadata["bytes"], Config.attr_metadata["timestamp"])
+
+    return {
+        "hierarchical_root": HierarchicalAttribute("geo.dest", geo_root),
+        "hierarchical": HierarchicalAttribute("geo.dest", geo_root.children[0]),
+        "integer": IntegerAttribute("bytes", bytes_range.min, bytes_range.max),
+        "timestamp": TimestampInMsAttribute("timestamp", timestamp_range.min, timestamp_range.max),
+        "ip": IpAttribute("clientip")
+    }
+
+
+def with_limits(attribute: Attribute) -> Attribute:
+    """ A copy of the range attribute, with limits splitting it in the middle, as set from the split statistics """
+
+    attribute = copy.copy(attribute)
+    median = (attribute.get_min_value() + attribute.get_max_value()) // 2
+    attribute.set_limits([(attribute.get_min_value(), median), (median + 1, attribute.get_max_value())])
+
+    return attribute
+
+
+def create_micro_benchmarks() -> dict[str, Callable[[], object]]:
+    attributes = set_up_kibana_attributes()
+    geo_root: GenTree = Config.attr_metadata["geo.dest"]
+    last_leaf_value = geo_root.get_leaf_node_values()[-1]
+    (integer_with_limits, timestamp_with_limits) = (with_limits(attributes["integer"]), with_limits(attributes["timestamp"]))
+
+    benchmarks = {
+        "GenTree.node": lambda: geo_root.node(last_leaf_value),
+        "GenTree.get_leaf_node_values (root)": geo_root.get_leaf_node_values,
+        "GenTree.get_leaf_node_values (inner node)": geo_root.children[0].get_leaf_node_values,
+        "HierarchicalAttribute.split": attributes["hierarchical_root"].split,
+        "IntegerAttribute.split": integer_with_limits.split,
+        "TimestampInMsAttribute.split": timestamp_with_limits.split,
+        "IpAttribute.split": attributes["ip"].split
+    }
+
+    for attr_type, attribute in attributes.items():
+        benchmarks[f"map_to_es_query ({attr_type})"] = attribute.map_to_es_query
+        benchmarks[f"map_to_sql_query ({attr_type})"] = attribute.map_to_sql_query
+        benchmarks[f"map_to_es_attribute ({attr_type})"] = attribute.map_to_es_attribute
+        benchmarks[f"map_to_sql_attribute ({attr_type})"] = attribute.map_to_sql_attribute
+        benchmarks[f"get_gen_value ({attr_type})"] = attribute.get_gen_value
+
+    return benchmarks
+
+
+def run_micro_benchmark(function: Callable[[], object], repeat: int) -> dict:
+    """ The number of loops is chosen so that one repetition takes at least 0.2 seconds, the best repetition is reported """
+
+    timer = timeit.Timer(function)
+    (loops, _) = timer.autorange()
+    times_per_call = [total / loops for total in timer.repeat(repeat=repeat, number=loops)]
+
+    return {"loops": loops, "best_ns": min(times_per_call) * 1e9, "mean_ns": sum(times_per_call) / len(times_per_call) * 1e9}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Micro-benchmarks of the model classes')
+    parser.add_argument('--repeat', type=int, default=5, help="Number of repetitions of every micro-benchmark: int (default: 5)")
+    parser.add_argument('--output', type=str, default='micro_benchmark_results.json',
+                        help="File to write the results into: str (default: micro_benchmark_results.json)")
+
+    args = parser.parse_args()
+    results: dict[str, dict] = {}
+
+    for name, function in create_micro_benchmarks().items():
+        results[name] = run_micro_benchmark(function, args.repeat)
+        print(f"{name:<50}{results[name]['best_ns']:>14.1f} ns", flush=True)
+
+    with open(args.output, "w") as results_file:
+        json.dump(results, results_file, indent=4)
+
+    print(f"Results written to {args.output}")
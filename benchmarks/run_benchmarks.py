@@ -0,0 +1,156 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from algorithms.datafly.datafly import Datafly
+from algorithms.mondrian.mondrian import Mondrian
+
+from interfaces.abstract_algorithm import AbstractAlgorithm
+from interfaces.abstract_api import AbstractAPI
+from interfaces.abstract_sink import AbstractSink
+
+from db_connectors.numpy_connector import NumpyConnector
+from db_connectors.tracing_connector import TracingConnector
+
+from models.partition import Partition
+
+from benchmarks.data_generator import generate_columns, read_config
+
+from utils.tracing import Trace, enable_tracing, summarize_spans
+
+
+# The generated dataset, and the typed columns and codes the NumPy backend derives from it, are all held in memory
+MAX_ROWS = 10 ** 7
+
+# Datafly does not support the timestamp and IP QIDs of the kibana logs
+DATASETS_PER_ALGORITHM = {
+    "mondrian": ["adults", "kibana"],
+    "datafly": ["adults"]
+}
+
+
+class DiscardingSink(AbstractSink):
+    """ Reads the sensitive values of every partition, as the other sinks do, without writing them anywhere """
+
+    def write_partitions(self, db_connector: AbstractAPI, partitions: list[Partition]):
+        for (_, sensitive_values) in db_connector.generate_sensitive_values(partitions):
+            for _ in sensitive_values:
+                pass
+
+
+def create_algorithm(algorithm_name: str, db_connector: TracingConnector, mondrian_options: dict) -> AbstractAlgorithm:
+    if algorithm_name == "datafly":
+        return Datafly(db_connector, sink=DiscardingSink())
+
+    return Mondrian(db_connector, sink=DiscardingSink(), **mondrian_options)
+
+
+def run_algorithm(algorithm_name: str, dataset: str, num_of_rows: int, seed: int, mondrian_options: dict, trace_memory: bool = False) -> tuple[AbstractAlgorithm, float, int | None]:
+    """ One run on a freshly generated dataset, returning the algorithm, the wall time and the peak of the traced memory. 
+    The generation and the loading of the data are not part of the measurements. """
+
+    db_connector = TracingConnector(NumpyConnector(generate_columns(dataset, num_of_rows, seed)))
+    algorithm = create_algorithm(algorithm_name, db_connector, mondrian_options)
+    peak_memory: int = None
+
+    enable_tracing()
+    if trace_memory:
+        tracemalloc.start()
+
+    start_time = time.perf_counter()
+    algorithm.run(read_config(dataset))
+    wall_time = time.perf_counter() - start_time
+
+    if trace_memory:
+        (_, peak_memory) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return algorithm, wall_time, peak_memory
+
+
+def run_benchmark(algorithm_name: str, dataset: str, num_of_rows: int, seed: int, mondrian_options: dict, measure_memory: bool = True) -> dict:
+    """ Tracing the allocations slows the run down, the peak memory is measured in a second run """
+
+    (algorithm, wall_time, _) = run_algorithm(algorithm_name, dataset, num_of_rows, seed, mondrian_options)
+    operations = summarize_spans()
+
+    result = {
+        "algorithm": algorithm_name,
+        "dataset": dataset,
+        "rows": num_of_rows,
+        "seed": seed,
+        "options": mondrian_options if algorithm_name == "mondrian" else {},
+        "wall_time": wall_time,
+        "phase_times": {span["name"]: span["duration"] for span in Trace.spans if span["phase"] == "phase"},
+        "query_count": sum(row["count"] for row in operations),
+        "queries": {row["operation"]: row for row in operations},
+        "peak_memory_bytes": None,
+        "num_of_partitions": len(algorithm.final_partitions),
+        "ncp": algorithm.calculate_ncp()
+    }
+
+    if measure_memory:
+        (_, _, result["peak_memory_bytes"]) = run_algorithm(algorithm_name, dataset, num_of_rows, seed, mondrian_options, trace_memory=True)
+
+    return result
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Anonymization benchmarks')
+    parser.add_argument('--algorithms', type=str, nargs='+', default=["mondrian", "datafly"],
+                        help="Algorithms to run: mondrian / datafly (default: both)")
+    parser.add_argument('--datasets', type=str, nargs='+', default=["adults", "kibana"],
+                        help="Synthetic datasets to run on: adults / kibana (default: both)")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help="Sizes of the datasets, up to 10^7: int (default: 10000)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the data generator: int (default: 0)")
+    parser.add_argument('--execution', type=str, default='depth-first',
+                        help="Order in which Mondrian processes the partitions: depth-first / breadth-first (default: depth-first)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of threads processing Mondrian partitions concurrently: int (default: 1)")
+    parser.add_argument('--skip-memory', action='store_true',
+                        help="Do not measure the peak memory, which takes a second, slower run with tracemalloc")
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                        help="File to write the results into: str (default: benchmark_results.json)")
+
+    args = parser.parse_args()
+
+    if max(args.rows) > MAX_ROWS:
+        parser.error(f"the datasets are generated in memory, --rows is limited to {MAX_ROWS}")
+
+    mondrian_options = {"execution": args.execution, "workers": args.workers}
+
+    results: list[dict] = []
+
+    for algorithm_name in args.algorithms:
+        for dataset in filter(lambda dataset: dataset in DATASETS_PER_ALGORITHM[algorithm_name], args.datasets):
+            for num_of_rows in args.rows:
+                result = run_benchmark(algorithm_name, dataset, num_of_rows, args.seed, mondrian_options, not args.skip_memory)
+                results.append(result)
+
+                peak_memory = f"{result['peak_memory_bytes'] / 2 ** 20:.1f} MiB" if result['peak_memory_bytes'] is not None else "-"
+                print(f"{algorithm_name:<10}{dataset:<8}{num_of_rows:>11} rows{result['wall_time']:>10.2f} s{result['query_count']:>8} queries{peak_memory:>12}   NCP {result['ncp']:.2f}%", flush=True)
+
+    with open(args.output, "w") as results_file:
+        json.dump({
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results
+        }, results_file, indent=4)
+
+    print(f"Results written to {args.output}")
@@ -0,0 +1,311 @@
+import json
+import shelve
+import threading
+
+from collections import OrderedDict
+
+from typing import Callable, Iterable, Tuple
+
+from interfaces.abstract_api import AbstractAPI
+from interfaces.datafly_api import DataflyAPI
+from interfaces.mondrian_api import MondrianAPI
+
+from models.attribute import Attribute
+from models.numrange import NumRange
+from models.partition import Partition
+from models.split_statistics import SplitStatistics
+
+
+class CachingConnector(MondrianAPI, DataflyAPI):
+    """ Wraps any connector and caches the results of its queries
+
+    The results are keyed on the operation, its arguments and the constraints of the partition, encoded independently of the order of the attributes.
+    The in-memory tier evicts the least recently used results above max_size entries. The optional persistent tier keeps every result in a file,
+    so that repeated runs on the same snapshot of the data skip the database; the file must not be reused once the data changes.
+    The file records the backend and the dataset it was created for, and is refused for any other one.
+    """
+
+    # Key of the header of the persistent cache, the keys of the results are JSON arrays
+    DATASET_KEY = "dataset"
+
+    def __init__(self, db_connector: AbstractAPI, max_size: int = 100000, persistent_path: str = None):
+        self.db_connector = db_connector
+        self.max_size = max_size
+
+        self.cache: OrderedDict[str, object] = OrderedDict()
+        self.persistent_cache = self.open_persistent_cache(persistent_path) if persistent_path is not None else None
+        # Mondrian might query from several worker threads
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def __getattr__(self, name: str):
+        """ Everything that is not cached, is served by the wrapped connector """
+
+        return getattr(self.db_connector, name)
+
+
+    def open_persistent_cache(self, persistent_path: str) -> shelve.Shelf:
+        dataset_id = getattr(self.db_connector, "DATASET_ID", None)
+
+        if dataset_id is None:
+            raise Exception(f"The {type(self.db_connector).__name__} cannot identify its dataset, its results cannot be persisted")
+
+        persistent_cache = shelve.open(persistent_path)
+        cached_dataset_id = persistent_cache.setdefault(self.DATASET_KEY, dataset_id)
+
+        if cached_dataset_id != dataset_id:
+            persistent_cache.close()
+            raise Exception(f"The cache file {persistent_path} holds the results of {cached_dataset_id}, not of {dataset_id}")
+
+        return persistent_cache
+
+
+    def map_attributes_to_key(self, attributes: dict[str, Attribute] | None) -> list[list[str]] | None:
+        if attributes is None:
+            return None
+
+        return sorted([attr_name, attr.get_gen_value()] for attr_name, attr in attributes.items())
+
+
+    def create_key(self, operation: str, attributes: dict[str, Attribute] | None, *args) -> str:
+        return json.dumps([operation, self.map_attributes_to_key(attributes), *args], separators=(',', ':'))
+
+
+    def look_up(self, key: str) -> Tuple[bool, object]:
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return True, self.cache[key]
+
+            if self.persistent_cache is not None and key in self.persistent_cache:
+                value = self.persistent_cache[key]
+                self.store_in_memory(key, value)
+                self.hits += 1
+                return True, value
+
+            self.misses += 1
+            return False, None
+
+
+    def store_in_memory(self, key: str, value: object):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+
+    def store(self, key: str, value: object):
+        with self.lock:
+            self.store_in_memory(key, value)
+
+            if self.persistent_cache is not None:
+                self.persistent_cache[key] = value
+
+
+    def get_or_compute(self, key: str, compute: Callable[[], object]) -> object:
+        (found, value) = self.look_up(key)
+
+        if not found:
+            value = compute()
+            self.store(key, value)
+
+        return value
+
+
+    def get_many_or_compute(self, keys: list[str], compute_missing: Callable[[list[int]], list]) -> list:
+        """ Look up every key, and compute the missing results together, with one call of compute_missing on the indices of the missing keys """
+
+        results = []
+        missing_indices: list[int] = []
+
+        for i, key in enumerate(keys):
+            (found, value) = self.look_up(key)
+            results.append(value)
+
+            if not found:
+                missing_indices.append(i)
+
+        if missing_indices:
+            for i, value in zip(missing_indices, compute_missing(missing_indices)):
+                results[i] = value
+                self.store(keys[i], value)
+
+        return results
+
+
+    def get_cache_statistics(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache)}
+
+
+    def close(self):
+        if self.persistent_cache is not None:
+            self.persistent_cache.close()
+            self.persistent_cache = None
+
+
+    def push_partitions(self, partitions: list[Partition]):
+        return self.db_connector.push_partitions(partitions)
+
+
+    def add_ordinal_codes(self, attr_name: str, leaf_codes: dict[str, int]):
+        return self.db_connector.add_ordinal_codes(attr_name, leaf_codes)
+
+
+    def generate_sensitive_values(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[tuple]]]:
+        return self.db_connector.generate_sensitive_values(partitions)
+
+
+    def generate_sensitive_value_counts(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[Tuple[tuple, int]]]]:
+        return self.db_connector.generate_sensitive_value_counts(partitions)
+
+
+    def get_sensitive_attr_types(self) -> dict[str, str]:
+        return self.db_connector.get_sensitive_attr_types()
+
+
+    def get_document_count(self, attributes: dict[str, Attribute] = None) -> int:
+        return self.get_or_compute(self.create_key("count", attributes), lambda: self.db_connector.get_document_count(attributes))
+
+
+    def get_document_counts(self, attributes_per_partition: list[dict[str, Attribute]]) -> list[int]:
+        return self.get_many_or_compute(
+            [self.create_key("count", attributes) for attributes in attributes_per_partition],
+            lambda missing_indices: self.db_connector.get_document_counts([attributes_per_partition[i] for i in missing_indices])
+        )
+
+
+    def get_attribute_min_max(self, attr_name: str, attributes: dict[str, Attribute] = None) -> Tuple[int,int]:
+        return self.get_or_compute(self.create_key("min_max", attributes, attr_name), lambda: self.db_connector.get_attribute_min_max(attr_name, attributes))
+
+
+# ------------------------------
+# >>    Mondrian API - BEGIN
+# ------------------------------
+
+    def get_value_to_split_at_and_next_unique_value(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        return self.get_or_compute(
+            self.create_key("split_value", partition.attributes, attr_name),
+            lambda: self.db_connector.get_value_to_split_at_and_next_unique_value(attr_name, partition)
+        )
+
+
+    def get_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        return self.get_or_compute(
+            self.create_key("split_statistics", partition.attributes, attr_name),
+            lambda: self.db_connector.get_split_statistics(attr_name, partition)
+        )
+
+
+    def get_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        return self.get_many_or_compute(
+            [self.create_key("split_statistics", partition.attributes, attr_name) for (attr_name, partition) in attr_names_and_partitions],
+            lambda missing_indices: self.db_connector.get_split_statistics_batch([attr_names_and_partitions[i] for i in missing_indices])
+        )
+
+
+    def get_children_counts(self, attr_name: str, partition: Partition) -> list[int]:
+        return self.get_or_compute(
+            self.create_key("children_counts", partition.attributes, attr_name),
+            lambda: self.db_connector.get_children_counts(attr_name, partition)
+        )
+
+
+    def get_children_counts_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[list[int]]:
+        return self.get_many_or_compute(
+            [self.create_key("children_counts", partition.attributes, attr_name) for (attr_name, partition) in attr_names_and_partitions],
+            lambda missing_indices: self.db_connector.get_children_counts_batch([attr_names_and_partitions[i] for i in missing_indices])
+        )
+
+
+
+    def get_timestamp_histogram(self, attr_name: str, partition: Partition, interval: int) -> Tuple[list[Tuple[int, int]], int, int]:
+        return self.get_or_compute(
+            self.create_key("timestamp_histogram", partition.attributes, attr_name, interval),
+            lambda: self.db_connector.get_timestamp_histogram(attr_name, partition, interval)
+        )
+
+
+    def get_timestamp_histogram_batch(self, attr_names_partitions_and_intervals: list[Tuple[str, Partition, int]]) -> list[Tuple[list[Tuple[int, int]], int, int]]:
+        return self.get_many_or_compute(
+            [self.create_key("timestamp_histogram", partition.attributes, attr_name, interval) for (attr_name, partition, interval) in attr_names_partitions_and_intervals],
+            lambda missing_indices: self.db_connector.get_timestamp_histogram_batch([attr_names_partitions_and_intervals[i] for i in missing_indices])
+        )
+
+
+    def get_ip_min_max(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        return self.get_or_compute(self.create_key("ip_min_max", partition.attributes, attr_name), lambda: self.db_connector.get_ip_min_max(attr_name, partition))
+
+
+    def get_ip_split_sides(self, attr_name: str, partition: Partition, split_address: int) -> Tuple[int, int, int, int]:
+        return self.get_or_compute(
+            self.create_key("ip_split_sides", partition.attributes, attr_name, split_address),
+            lambda: self.db_connector.get_ip_split_sides(attr_name, partition, split_address)
+        )
+
+
+    def get_ip_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        return self.get_or_compute(
+            self.create_key("ip_split_statistics", partition.attributes, attr_name),
+            lambda: self.db_connector.get_ip_split_statistics(attr_name, partition)
+        )
+
+
+    def get_ip_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        return self.get_many_or_compute(
+            [self.create_key("ip_split_statistics", partition.attributes, attr_name) for (attr_name, partition) in attr_names_and_partitions],
+            lambda missing_indices: self.db_connector.get_ip_split_statistics_batch([attr_names_and_partitions[i] for i in missing_indices])
+        )
+
+
+    def get_subpartition_counts(self, partition: Partition, attr_name: str, subpartitions: list[Partition]) -> list[int]:
+        return self.get_or_compute(
+            self.create_key("subpartition_counts", partition.attributes, attr_name, [subpartition.attributes[attr_name].get_gen_value() for subpartition in subpartitions]),
+            lambda: self.db_connector.get_subpartition_counts(partition, attr_name, subpartitions)
+        )
+
+
+    def get_subpartition_counts_batch(self, splits: list[Tuple[Partition, str, list[Partition]]]) -> list[list[int]]:
+        return self.get_many_or_compute(
+            [
+                self.create_key("subpartition_counts", partition.attributes, attr_name, [subpartition.attributes[attr_name].get_gen_value() for subpartition in subpartitions]) 
+                for (partition, attr_name, subpartitions) in splits
+            ],
+            lambda missing_indices: self.db_connector.get_subpartition_counts_batch([splits[i] for i in missing_indices])
+        )
+
+
+    def label_partitions(self, partitions: list[Partition]):
+        return self.db_connector.label_partitions(partitions)
+
+
+    def apply_splits(self, splits: list[Tuple[Partition, str, list[Partition]]]):
+        return self.db_connector.apply_splits(splits)
+
+# ------------------------------
+# <<    Mondrian API - END
+# ------------------------------
+
+
+
+# ------------------------------
+# >>    DataFly API - BEGIN
+# ------------------------------
+
+    def spread_attribute_into_uniform_buckets(self, attr_name: str, num_of_buckets: int) -> list[NumRange]:
+        return self.get_or_compute(
+            self.create_key("uniform_buckets", None, attr_name, num_of_buckets),
+            lambda: self.db_connector.spread_attribute_into_uniform_buckets(attr_name, num_of_buckets)
+        )
+
+
+    def get_frequency_table(self, candidates: dict[str, list[Attribute]]) -> dict[Tuple[int, ...], int]:
+        return self.db_connector.get_frequency_table(candidates)
+
+# ------------------------------
+# <<    DataFly API - END
+# ------------------------------
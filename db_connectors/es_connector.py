@@ -2,123 +2,178 @@ from os import getenv
 
 import tqdm
 
-from typing import Tuple
+from typing import Iterable, Tuple
 
 from elasticsearch import Elasticsearch, RequestError
 from elasticsearch.helpers import streaming_bulk
 
-from models.attribute import Attribute
+from models.attribute import Attribute, DateAttribute, HierarchicalAttribute, IpAttribute, get_code_field_name, get_ip_version, map_int_to_ip, map_ip_to_int
 from models.gentree import GenTree
 from models.numrange import NumRange
 from models.partition import Partition
+from models.split_statistics import SplitStatistics, create_split_statistics_around_median, create_split_statistics_from_histogram
 from models.config import Config
 
 from interfaces.datafly_api import DataflyAPI
 from interfaces.mondrian_api import MondrianAPI
 
+from utils.batching import split_into_batches
+from utils.output_modes import generate_output_docs, get_output_size
 
-class EsConnector(MondrianAPI, DataflyAPI):
 
-    def __init__(self):        
+class EsConnector(MondrianAPI, DataflyAPI):
+    MSEARCH_BATCH_SIZE = 200
+    # Upper bound on the buckets of one _msearch request of histograms, whose searches return up to HISTOGRAM_MAX_BUCKETS buckets each
+    MSEARCH_MAX_BUCKETS = 100000
+    # Partitions with more unique values of the split attribute fall back to the approximate median
+    HISTOGRAM_MAX_BUCKETS = 10000
+    # Documents per page, when streaming the partitions into the anonymized index
+    PIT_PAGE_SIZE = 5000
+    PIT_KEEP_ALIVE = "5m"
+    # Distinct combinations of the sensitive values per page, when they are counted for the aggregated output modes
+    COMPOSITE_PAGE_SIZE = 10000
+    # Field of the working copy of the documents, that the server-side push tags with the id of their partition
+    PARTITION_ID_FIELD = "anon_partition_id"
+    # Partitions, whose generalized values are passed as script parameters to one _reindex request
+    REINDEX_BATCH_SIZE = 1000
+    # Partitions tagged by one _update_by_query, their queries are the clauses of a single bool query
+    TAG_BATCH_SIZE = 200
+    # Field types of the mapping, that are not read as strings
+    SENSITIVE_ATTR_TYPES = {
+        "long": "integer", "integer": "integer", "short": "integer", "byte": "integer",
+        "double": "float", "float": "float", "half_float": "float", "scaled_float": "float",
+        "boolean": "boolean"
+    }
+
+    def __init__(self, connections_per_node: int = 10, server_side_push: bool = False):
         ES_HOST = getenv('ES_HOST')
         API_KEY_BASE64 = getenv('API_KEY_BASE64')
         ROOT_CA_PATH = getenv('ROOT_CA_PATH')
         
         self.INDEX_NAME = getenv('INDEX_NAME')
         self.ANON_INDEX_NAME = f"{self.INDEX_NAME}_anonymized"
+        # With the server-side push, the documents are copied into the working index and tagged there, the original index is not modified
+        self.WORKING_INDEX_NAME = f"{self.INDEX_NAME}_partitions"
+        # Identifies the data behind the results of the queries, in persistent caches
+        self.DATASET_ID = f"elasticsearch:{ES_HOST}/{self.INDEX_NAME}"
+        self.server_side_push = server_side_push
 
         self.es_client = Elasticsearch(
                 hosts=[ES_HOST],
                 api_key=API_KEY_BASE64, 
-                ca_certs=ROOT_CA_PATH
+                ca_certs=ROOT_CA_PATH,
+                # The client is thread-safe, concurrent requests of the Mondrian worker threads need a connection each
+                connections_per_node=connections_per_node
         )
 
 
-    def map_docs_to_individual_anonymized_docs(self, original_docs: list, anon_doc_with_qids: dict[str, str]):
-        ''' 
-        For every original document, create an anonymized one 
-            { ...qids, "sa_1": "a", "sa_2": "b" },
-            { ...qids, "sa_1": "a", "sa_2": "d" },
-            { ...qids, "sa_1": "a", "sa_2": "d" },
-        '''
-
-        for doc in original_docs:                
-            yield anon_doc_with_qids | {sensitive_attr_name: doc[sensitive_attr_name][0] for sensitive_attr_name in Config.sensitive_attr_names}
-
-
-    def map_docs_to_array_of_unique_sa_combinations_per_partition(self, original_docs: list, anon_doc_with_qids: dict[str, str]):
-        ''' 
-        For every partition, create one document, with all sensitive attribute values mapped into one sensitive_attr_names field 
-            { 
-                ...qids,
-                "sensitive_attributes": [
-                    { "sa_1": "a", "sa_2": "b", "count": 1},
-                    { "sa_1": "a", "sa_2": "d", "count": 4}
-                    { "sa_1": "c", "sa_2": "d", "count": 23}
-                ]
-            }
-        '''
-        sensitive_attributes = {}
+    def scroll_partition_docs(self, pit: dict[str, str], partition: Partition):
+        """ Page through the documents of the partition in the point-in-time snapshot, fetching only the doc values of the sensitive attributes.
+        The memory used does not depend on the size of the partition, nor is it limited by index.max_result_window. """
 
-        for doc in original_docs:                
-            sens_attr = {sensitive_attr_name: doc[sensitive_attr_name][0] for sensitive_attr_name in Config.sensitive_attr_names}
-            if str(sens_attr) in sensitive_attributes:
-                sensitive_attributes[str(sens_attr)]["count"] += 1
-            else:
-                sensitive_attributes[str(sens_attr)] = sens_attr | {"count": 1}
-        
-        yield anon_doc_with_qids | {"sensitive_attributes": list(sensitive_attributes.values())}
+        search_after = None
 
-    
-    def map_docs_to_unique_sa_combinations_per_partition(self, original_docs: list, anon_doc_with_qids: dict[str, str]):
-        ''' 
-        For every unique sensitive attribute value combination, create a document with the count of documents with this signature
-            { ...qids, "sa_1": "a", "sa_2": "b", "count": 1 },
-            { ...qids, "sa_1": "a", "sa_2": "d", "count": 4 }, 
-            { ...qids, "sa_1": "c", "sa_2": "d", "count": 23 }
-        '''
-        sensitive_attributes = {}
-
-        for doc in original_docs:                
-            sens_attr = {sensitive_attr_name: doc[sensitive_attr_name][0] for sensitive_attr_name in Config.sensitive_attr_names}
-            if str(sens_attr) in sensitive_attributes:
-                sensitive_attributes[str(sens_attr)]["count"] += 1
-            else:
-                sensitive_attributes[str(sens_attr)] = sens_attr | {"count": 1}
+        while True:
+            res = self.es_client.search(
+                pit=pit,
+                query=self.map_attributes_to_query(partition.attributes),
+                docvalue_fields=Config.sensitive_attr_names,
+                _source=False,
+                size=self.PIT_PAGE_SIZE,
+                # The cheapest tiebreaker-free sort order, available in point-in-time searches
+                sort=["_shard_doc"],
+                search_after=search_after,
+                track_total_hits=False
+            )
+            # The id of the point in time might change between the requests
+            pit["id"] = res["pit_id"]
+            hits = res["hits"]["hits"]
 
-        for unique_sa_combination in list(sensitive_attributes.values()):
-             yield anon_doc_with_qids | unique_sa_combination                
+            for hit in hits:
+                yield hit["fields"]
 
-    
-    def map_docs_to_sa_arrays_per_partition(self, original_docs: list, anon_doc_with_qids: dict[str, str]):
-        ''' 
-        For every partition, create one document, with all sensitive values dumped into an array
-            { 
-                ...qids,
-                "sa_1": [ "a", "a", "c" ],
-                "sa_2": [ "b", "d", "d" ]
-            }
-        '''
+            if len(hits) < self.PIT_PAGE_SIZE:
+                return
+
+            search_after = hits[-1]["sort"]
 
-        sensitive_attributes = {sensitive_attr_name: [] for sensitive_attr_name in Config.sensitive_attr_names}
 
-        for doc in original_docs:
-            for sensitive_attr_name in Config.sensitive_attr_names:
-                sensitive_attributes[sensitive_attr_name].append(doc[sensitive_attr_name][0])
+    def open_point_in_time(self) -> dict[str, str]:
+        return {"id": self.es_client.open_point_in_time(index=self.INDEX_NAME, keep_alive=self.PIT_KEEP_ALIVE)["id"], "keep_alive": self.PIT_KEEP_ALIVE}
 
-        yield anon_doc_with_qids | sensitive_attributes
+
+    def map_partition_to_es_doc(self, partition: Partition) -> dict:
+        return {attr_name: attribute.map_to_es_attribute() for attr_name, attribute in partition.attributes.items()}
 
 
     def generate_anonymized_docs(self, partitions: list[Partition]):
+        return generate_output_docs(self, partitions, self.map_partition_to_es_doc)
+
+
+    def generate_sensitive_values(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[tuple]]]:
+        pit = self.open_point_in_time()
+
+        try:
+            for partition in partitions:
+                yield partition, (
+                    tuple(doc.get(sensitive_attr_name, [None])[0] for sensitive_attr_name in Config.sensitive_attr_names) 
+                    for doc in self.scroll_partition_docs(pit, partition)
+                )
+        finally:
+            self.es_client.close_point_in_time(id=pit["id"])
+
+
+    def generate_sensitive_value_counts(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[Tuple[tuple, int]]]]:
         for partition in partitions:
-            query = self.map_attributes_to_query(partition.attributes)
+            yield partition, self.fetch_sensitive_value_counts(partition)
+
+
+    def get_sensitive_attr_types(self) -> dict[str, str]:
+        """ The types of the fields in the mapping of the index, the dates and the IPs are read as strings """
+
+        res = self.es_client.indices.get_field_mapping(index=self.INDEX_NAME, fields=Config.sensitive_attr_names)
+        field_mappings = res[next(iter(res))]["mappings"]
+        sensitive_attr_types: dict[str, str] = {}
+
+        for sensitive_attr_name in Config.sensitive_attr_names:
+            mapping = field_mappings.get(sensitive_attr_name, {}).get("mapping", {})
+            field_type = next(iter(mapping.values()), {}).get("type")
+
+            sensitive_attr_types[sensitive_attr_name] = self.SENSITIVE_ATTR_TYPES.get(field_type, "string")
+
+        return sensitive_attr_types
+
+
+    def fetch_sensitive_value_counts(self, partition: Partition) -> Iterable[Tuple[tuple, int]]:
+        """ Page through the buckets of a composite aggregation over the sensitive attributes, one bucket per distinct combination of their values """
+
+        after_key = None
+
+        while True:
+            composite = {
+                "size": self.COMPOSITE_PAGE_SIZE,
+                # Items without some of the sensitive values are counted too
+                "sources": [{sensitive_attr_name: {"terms": {"field": sensitive_attr_name, "missing_bucket": True}}} for sensitive_attr_name in Config.sensitive_attr_names]
+            }
+
+            if after_key is not None:
+                composite["after"] = after_key
+
+            res = self.es_client.search(
+                index=self.INDEX_NAME, 
+                query=self.map_attributes_to_query(partition.attributes), 
+                aggs={"sa_combinations": {"composite": composite}}, 
+                size=0
+            )
+            aggregation = res["aggregations"]["sa_combinations"]
 
-            res = self.es_client.search(index=self.INDEX_NAME, query=query, fields=Config.sensitive_attr_names, _source=False, size=partition.count)
-            original_docs = list(map(lambda hit: hit["fields"], res["hits"]["hits"]))
-            
-            doc_with_qids = {attr_name: attribute.map_to_es_attribute() for attr_name, attribute in partition.attributes.items()}
-            
-            yield from self.map_docs_to_individual_anonymized_docs(original_docs, doc_with_qids)
+            for bucket in aggregation["buckets"]:
+                yield tuple(bucket["key"][sensitive_attr_name] for sensitive_attr_name in Config.sensitive_attr_names), bucket["doc_count"]
+
+            if len(aggregation["buckets"]) < self.COMPOSITE_PAGE_SIZE or "after_key" not in aggregation:
+                return
+
+            after_key = aggregation["after_key"]
 
 
     def create_index(self, attributes: dict[str, Attribute]):
@@ -134,17 +189,238 @@ class EsConnector(MondrianAPI, DataflyAPI):
                 raise exception
 
 
+    def create_working_index(self, partitions: list[Partition]):
+        """ Copy the QIDs and the sensitive attributes of the original documents into the working index with _reindex, 
+        with the mapping of the original index and the PARTITION_ID_FIELD """
+
+        self.es_client.indices.delete(index=self.WORKING_INDEX_NAME, ignore_unavailable=True)
+
+        # The index name may be an alias, the mapping is returned under the name of the concrete index
+        res = self.es_client.indices.get_mapping(index=self.INDEX_NAME)
+        mappings = res[next(iter(res))]["mappings"]
+        mappings["properties"] = {**mappings.get("properties", {}), self.PARTITION_ID_FIELD: {"type": "integer"}}
+
+        self.es_client.indices.create(index=self.WORKING_INDEX_NAME, mappings=mappings)
+
+        res = self.es_client.options(request_timeout=3600).reindex(
+            source={
+                "index": self.INDEX_NAME,
+                "_source": Config.qid_names + Config.sensitive_attr_names + ([get_code_field_name(attr_name) for attr_name in Config.gen_hiers] if Config.ordinal_encoding else [])
+            },
+            dest={"index": self.WORKING_INDEX_NAME},
+            slices="auto",
+            refresh=True,
+            wait_for_completion=True
+        )
+
+        partitioned_document_count = sum(partition.count for partition in partitions)
+        if res["failures"] or res["created"] != partitioned_document_count:
+            raise Exception(f"Copied {res['created']} documents into {self.WORKING_INDEX_NAME}, out of the {partitioned_document_count} documents of the partitions: {res['failures'][:5]}")
+
+
+    def tag_partitions(self, partitions: list[Partition]):
+        """ Write the index of its partition into the PARTITION_ID_FIELD of every document of the working index, TAG_BATCH_SIZE partitions per _update_by_query.
+        The query selects the documents of the whole batch, the script finds the partition of each document by comparing the values of its QIDs
+        with the [lo, hi] bounds of the partitions in the parameters: leaf codes for the hierarchical attributes, integers for the rest. """
+
+        qids = list(partitions[0].attributes.values())
+        # The script only parses IPv4 addresses, the partitions of IPv6 networks are tagged one by one
+        batch_size = 1 if any(isinstance(attr, IpAttribute) and attr.version == 6 for attr in qids) else self.TAG_BATCH_SIZE
+
+        tagged_document_count = 0
+
+        for batch_start in tqdm.tqdm(range(0, len(partitions), batch_size), unit="batches"):
+            batch = partitions[batch_start:batch_start + batch_size]
+
+            res = self.es_client.options(request_timeout=3600).update_by_query(
+                index=self.WORKING_INDEX_NAME,
+                query={"bool": {"should": [self.map_attributes_to_query(partition.attributes) for partition in batch], "minimum_should_match": 1}},
+                script={
+                    "lang": "painless",
+                    "source": """
+                    def lookUp(Map source, String name, List path) {
+                        def value = source.get(name);
+                        if (value == null) {
+                            value = source;
+                            for (String part : path) {
+                                value = value instanceof Map ? ((Map) value).get(part) : null;
+                            }
+                        }
+                        return value;
+                    }
+
+                    long toKey(def value, Map qid) {
+                        if (qid.kind == 'code') {
+                            def code = value == null ? null : qid.leaf_codes.get(String.valueOf(value));
+                            return code == null ? -1L : ((Number) code).longValue();
+                        }
+                        if (value instanceof Number) {
+                            return ((Number) value).longValue();
+                        }
+                        String text = value.toString();
+                        if (qid.kind == 'ipv4') {
+                            long address = 0L;
+                            for (String octet : text.splitOnToken('.')) {
+                                address = address * 256L + Long.parseLong(octet);
+                            }
+                            return address;
+                        }
+                        if (qid.kind == 'date') {
+                            return text.length() == 10 ? LocalDate.parse(text).atStartOfDay(ZoneOffset.UTC).toInstant().toEpochMilli() : ZonedDateTime.parse(text).toInstant().toEpochMilli();
+                        }
+                        return Long.parseLong(text);
+                    }
+
+                    if (params.partitions.size() == 1) {
+                        ctx._source[params.field] = params.partitions[0].id;
+                    } else {
+                        def partitionId = null;
+                        try {
+                            long[] keys = new long[params.qids.size()];
+                            for (int i = 0; i < keys.length; ++i) {
+                                keys[i] = toKey(lookUp(ctx._source, params.qids[i].name, params.qids[i].path), params.qids[i]);
+                            }
+                            for (def partition : params.partitions) {
+                                boolean inside = true;
+                                for (int i = 0; i < keys.length && inside; ++i) {
+                                    inside = partition.bounds[i][0] <= keys[i] && keys[i] <= partition.bounds[i][1];
+                                }
+                                if (inside) {
+                                    partitionId = partition.id;
+                                    break;
+                                }
+                            }
+                        } catch (Exception exception) {
+                            partitionId = null;
+                        }
+                        if (partitionId == null) { ctx.op = 'noop' } else { ctx._source[params.field] = partitionId }
+                    }
+                    """,
+                    "params": {
+                        "field": self.PARTITION_ID_FIELD,
+                        "qids": [self.map_qid_to_tag_params(attr) for attr in qids],
+                        "partitions": [
+                            {"id": batch_start + i, "bounds": [self.map_attribute_to_tag_bounds(attr) for attr in partition.attributes.values()]}
+                            for i, partition in enumerate(batch)
+                        ]
+                    }
+                },
+                conflicts="proceed",
+                slices="auto",
+                wait_for_completion=True
+            )
+
+            if res["failures"]:
+                raise Exception(f"Failed to tag the documents of partitions {batch_start}-{batch_start + len(batch) - 1}: {res['failures'][:5]}")
+
+            tagged_document_count += res["updated"]
+
+        self.es_client.indices.refresh(index=self.WORKING_INDEX_NAME)
+
+        # Documents skipped on a version conflict, or with values the script could not parse, would be missing from the anonymized index
+        partitioned_document_count = sum(partition.count for partition in partitions)
+        if tagged_document_count != partitioned_document_count:
+            raise Exception(f"Tagged {tagged_document_count} documents with their partition, out of the {partitioned_document_count} documents of the partitions")
+
+
+    def map_qid_to_tag_params(self, attribute: Attribute) -> dict:
+        """ How the script of tag_partitions maps the value of the attribute in the _source to an integer """
+
+        attr_name = attribute.get_name()
+        params = {"name": attr_name, "path": attr_name.split(".")}
+
+        if isinstance(attribute, HierarchicalAttribute):
+            return {**params, "kind": "code", "leaf_codes": Config.attr_metadata[attr_name].get_leaf_codes()}
+        if isinstance(attribute, IpAttribute):
+            return {**params, "kind": "ipv4"}
+        if isinstance(attribute, DateAttribute):
+            return {**params, "kind": "date"}
+
+        return {**params, "kind": "number"}
+
+
+    def map_attribute_to_tag_bounds(self, attribute: Attribute) -> Tuple[int, int]:
+        if isinstance(attribute, HierarchicalAttribute):
+            return attribute.get_node().leaf_code_interval
+        if isinstance(attribute, IpAttribute):
+            return (attribute.get_first_address(), attribute.get_last_address())
+
+        return (attribute.get_min_value(), attribute.get_max_value())
+
+
+    def push_partitions_with_reindex(self, partitions: list[Partition]):
+        """ Build the anonymized index inside the cluster: copy the documents into the working index and tag them with their partition, then copy them 
+        with _reindex, replacing the partition id with the generalized QID values looked up in the script parameters. The working index is deleted afterwards. """
+
+        assert Config.output_mode == "individual", "The server-side push copies every document, it only supports the individual output mode"
+
+        try:
+            self.create_working_index(partitions)
+            self.tag_partitions(partitions)
+            self.reindex_tagged_partitions(partitions)
+        finally:
+            self.es_client.indices.delete(index=self.WORKING_INDEX_NAME, ignore_unavailable=True)
+
+
+    def reindex_tagged_partitions(self, partitions: list[Partition]):
+        """ Copy the tagged documents of the working index into the anonymized index, REINDEX_BATCH_SIZE partitions per _reindex """
+
+        indexed_document_count = 0
+
+        for batch_start in tqdm.tqdm(range(0, len(partitions), self.REINDEX_BATCH_SIZE), unit="batches"):
+            batch = partitions[batch_start:batch_start + self.REINDEX_BATCH_SIZE]
+
+            res = self.es_client.reindex(
+                source={
+                    "index": self.WORKING_INDEX_NAME,
+                    "query": {"range": {self.PARTITION_ID_FIELD: {"gte": batch_start, "lt": batch_start + len(batch)}}},
+                    "_source": Config.sensitive_attr_names + [self.PARTITION_ID_FIELD]
+                },
+                dest={"index": self.ANON_INDEX_NAME},
+                script={
+                    "lang": "painless",
+                    "source": "ctx._source.putAll(params.partitions[String.valueOf(ctx._source.remove(params.field))])",
+                    "params": {
+                        "field": self.PARTITION_ID_FIELD,
+                        "partitions": {
+                            str(batch_start + i): {attr_name: attribute.map_to_es_attribute() for attr_name, attribute in partition.attributes.items()}
+                            for i, partition in enumerate(batch)
+                        }
+                    }
+                },
+                slices="auto",
+                refresh=True,
+                wait_for_completion=True
+            )
+
+            if res["failures"]:
+                raise Exception(f"Failed to index the documents of partitions {batch_start}-{batch_start + len(batch) - 1}: {res['failures'][:5]}")
+
+            # The documents keep their _id, a previous run into the same anonymized index shows up as updates
+            indexed_document_count += res["created"] + res["updated"]
+
+        print("Indexed %d/%d documents" % (indexed_document_count, Config.size_of_dataset))
+
+        partitioned_document_count = sum(partition.count for partition in partitions)
+        if indexed_document_count != partitioned_document_count:
+            raise Exception(f"Indexed {indexed_document_count} documents into {self.ANON_INDEX_NAME}, out of the {partitioned_document_count} documents of the partitions")
+
+
     def push_partitions(self, partitions: list[Partition]):
         self.create_index(partitions[0].attributes)
 
-        progress = tqdm.tqdm(unit="docs", total=Config.size_of_dataset)
+        if self.server_side_push:
+            return self.push_partitions_with_reindex(partitions)
+
+        output_size = get_output_size()
+        progress = tqdm.tqdm(unit="docs", total=output_size)
         successes = 0
 
         for ok, action in streaming_bulk(client=self.es_client, index=self.ANON_INDEX_NAME, actions=self.generate_anonymized_docs(partitions)):
             progress.update(1)
             successes += ok
 
-        print("Indexed %d/%d documents" % (successes, Config.size_of_dataset))
+        print("Indexed %d/%s documents" % (successes, output_size or "-"))
 
 
     def get_document_count(self, attributes: dict[str, Attribute] = None) -> int:    
@@ -156,6 +432,36 @@ class EsConnector(MondrianAPI, DataflyAPI):
         res = self.es_client.count(index=self.INDEX_NAME, body=query)
 
         return int(res["count"])
+
+
+    def multi_search(self, searches: list[dict], max_buckets_per_search: list[int] = None) -> list[dict]:
+        """ Send the searches in as few _msearch requests as possible, returning the responses in the same order.
+        Given the most buckets each search can return, a request also returns at most MSEARCH_MAX_BUCKETS buckets, unless one search alone exceeds it. """
+
+        responses: list[dict] = []
+
+        for batch in split_into_batches(max_buckets_per_search or [1] * len(searches), self.MSEARCH_BATCH_SIZE, self.MSEARCH_MAX_BUCKETS):
+            body = []
+            for i in batch:
+                body += [{"index": self.INDEX_NAME}, searches[i]]
+
+            res = self.es_client.msearch(searches=body)
+
+            for response in res["responses"]:
+                if "error" in response:
+                    raise Exception(f"Search in _msearch failed: {response['error']}")
+                responses.append(response)
+
+        return responses
+
+
+    def get_document_counts(self, attributes_per_partition: list[dict[str, Attribute]]) -> list[int]:
+        searches = [
+            {"query": self.map_attributes_to_query(attributes), "size": 0, "track_total_hits": True}
+            for attributes in attributes_per_partition
+        ]
+
+        return [int(res["hits"]["total"]["value"]) for res in self.multi_search(searches)]
     
     
     def get_attribute_min_max(self, attr_name: str, attributes: dict[str, Attribute] = None) -> Tuple[int,int]:
@@ -174,22 +480,52 @@ class EsConnector(MondrianAPI, DataflyAPI):
         return int(res["aggregations"][f"{attr_name}_min"]['value']), int(res["aggregations"][f"{attr_name}_max"]['value'])
 
 
+    def add_ordinal_codes(self, attr_name: str, leaf_codes: dict[str, int]):
+        """ Map the leaf values to their codes server-side with one _update_by_query, documents with values outside of the hierarchy get no code.
+        Dotted attribute names (geo.dest) are looked up as a literal key of the _source first, then as a path through its nested objects. """
+
+        code_field_name = get_code_field_name(attr_name)
+
+        self.es_client.indices.put_mapping(index=self.INDEX_NAME, properties={code_field_name: {"type": "integer"}})
+
+        self.es_client.options(request_timeout=3600).update_by_query(
+            index=self.INDEX_NAME,
+            conflicts="proceed",
+            refresh=True,
+            wait_for_completion=True,
+            script={
+                "lang": "painless",
+                "source": """
+                    def value = ctx._source.get(params.attr_name);
+                    if (value == null) {
+                        value = ctx._source;
+                        for (String part : params.attr_path) {
+                            value = value instanceof Map ? ((Map) value).get(part) : null;
+                        }
+                    }
+                    def code = value == null ? null : params.leaf_codes.get(String.valueOf(value));
+                    if (code == null) { ctx._source.remove(params.code_field_name) } else { ctx._source[params.code_field_name] = code }
+                """,
+                "params": {"attr_name": attr_name, "attr_path": attr_name.split("."), "code_field_name": code_field_name, "leaf_codes": leaf_codes}
+            }
+        )
+
+        coded_document_count = int(self.es_client.count(index=self.INDEX_NAME, query={"exists": {"field": code_field_name}})["count"])
+        document_count = self.get_document_count()
+
+        # A document without a code is left out of every filter on the attribute
+        if coded_document_count != document_count:
+            raise Exception(f"Only {coded_document_count} of the {document_count} documents got a {code_field_name}, the values of {attr_name} are missing or not in its hierarchy")
+
+
 # ------------------------------
 # >>    Mondrian API - BEGIN
 # ------------------------------
 
     def get_median(self, attr_name: str, attributes: dict[str, Attribute]) -> int:
-        query = self.map_attributes_to_query(attributes)
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_median_search(attr_name, attributes))
 
-        aggs = {            
-            f"{attr_name}_median": { "percentiles": { "field": attr_name, "percents": [ 50 ] }},            
-        }
-
-        res = self.es_client.search(index=self.INDEX_NAME, query=query, size=0, aggs=aggs)
-
-        value = list(res["aggregations"][f"{attr_name}_median"]['values'].values())[0]
-
-        return int(value)
+        return self.map_median_response(attr_name, res)
     
 
     def get_unique_next_or_prev_value(self, direction: str, attr_name: str, attributes: dict[str, Attribute], central_value: int):
@@ -224,8 +560,298 @@ class EsConnector(MondrianAPI, DataflyAPI):
             value_to_split_at = median
             next_unique_value = self.get_unique_next_or_prev_value("NEXT", attr_name, partition.attributes, median)
 
-        return value_to_split_at, next_unique_value    
-    
+        return value_to_split_at, next_unique_value
+
+
+    def build_median_search(self, attr_name: str, attributes: dict[str, Attribute]) -> dict:
+        return {
+            "query": self.map_attributes_to_query(attributes),
+            "size": 0,
+            "aggs": { f"{attr_name}_median": { "percentiles": { "field": attr_name, "percents": [ 50 ] }} }
+        }
+
+
+    def build_values_around_median_search(self, attr_name: str, attributes: dict[str, Attribute], median: int) -> dict:
+        return {
+            "query": self.map_attributes_to_query(attributes),
+            "size": 0,
+            "aggs": {
+                f"{attr_name}_min": { "min": { "field": attr_name } },
+                f"{attr_name}_max": { "max": { "field": attr_name } },
+                f"{attr_name}_around_median": {
+                    "range": {
+                        "field": attr_name,
+                        "ranges": [
+                            {"key": "below", "to": median},
+                            {"key": "at", "from": median, "to": median + 1},
+                            {"key": "above", "from": median + 1}
+                        ]
+                    },
+                    "aggs": {
+                        "min": { "min": { "field": attr_name } },
+                        "max": { "max": { "field": attr_name } }
+                    }
+                }
+            }
+        }
+
+
+    def map_median_response(self, attr_name: str, res: dict) -> int | None:
+        value = list(res["aggregations"][f"{attr_name}_median"]['values'].values())[0]
+
+        return int(value) if value is not None else None
+
+
+    def map_values_around_median_response(self, attr_name: str, median: int, res: dict) -> SplitStatistics | None:
+        (below, at, above) = res["aggregations"][f"{attr_name}_around_median"]["buckets"]
+
+        return create_split_statistics_around_median(
+            median=median,
+            min_value=int(res["aggregations"][f"{attr_name}_min"]["value"]),
+            max_value=int(res["aggregations"][f"{attr_name}_max"]["value"]),
+            below_count=below["doc_count"],
+            below_max=int(below["max"]["value"]) if below["doc_count"] else None,
+            at_count=at["doc_count"],
+            above_count=above["doc_count"],
+            above_min=int(above["min"]["value"]) if above["doc_count"] else None
+        )
+
+
+    def build_histogram_search(self, attr_name: str, attributes: dict[str, Attribute]) -> dict:
+        return {
+            "query": self.map_attributes_to_query(attributes),
+            "size": 0,
+            "aggs": { f"{attr_name}_histogram": { "terms": { "field": attr_name, "size": self.HISTOGRAM_MAX_BUCKETS, "order": { "_key": "asc" } } } }
+        }
+
+
+    def map_histogram_response(self, attr_name: str, res: dict) -> list[Tuple[int, int]] | None:
+        """ Return the (value, count) pairs of the histogram, or None if the attribute has more unique values in the partition than fit into it """
+
+        histogram = res["aggregations"][f"{attr_name}_histogram"]
+
+        if histogram["sum_other_doc_count"] > 0:
+            return None
+
+        return [(int(bucket["key"]), bucket["doc_count"]) for bucket in histogram["buckets"]]
+
+
+    def get_split_statistics_around_median(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Get the median, the limits, the next/previous unique value and both child counts in two searches instead of six:
+        the median is needed to place the range buckets, everything else comes from one range aggregation around it """
+
+        median = self.get_median(attr_name, partition.attributes)
+
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_values_around_median_search(attr_name, partition.attributes, median))
+
+        return self.map_values_around_median_response(attr_name, median, res)
+
+
+    def get_split_statistics_around_median_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Same as get_split_statistics_around_median, but for many partitions at once, with two _msearch requests in total """
+
+        medians = [
+            self.map_median_response(attr_name, res)
+            for (attr_name, _), res in zip(
+                attr_names_and_partitions,
+                self.multi_search([self.build_median_search(attr_name, partition.attributes) for (attr_name, partition) in attr_names_and_partitions])
+            )
+        ]
+
+        responses = self.multi_search([
+            self.build_values_around_median_search(attr_name, partition.attributes, median)
+            for (attr_name, partition), median in zip(attr_names_and_partitions, medians)
+        ])
+
+        return [
+            self.map_values_around_median_response(attr_name, median, res)
+            for (attr_name, _), median, res in zip(attr_names_and_partitions, medians, responses)
+        ]
+
+
+    def get_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Fetch the exact histogram of the attribute within the partition, and find the median, the next unique value and the child counts locally.
+        Only if the attribute has too many unique values in the partition, fall back to the approximate median and a range aggregation around it. """
+
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_histogram_search(attr_name, partition.attributes))
+        histogram = self.map_histogram_response(attr_name, res)
+
+        if histogram is None:
+            return self.get_split_statistics_around_median(attr_name, partition)
+
+        return create_split_statistics_from_histogram(histogram)
+
+
+    def get_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Same as get_split_statistics, but for many partitions at once, with one _msearch request for the histograms """
+
+        histograms = [
+            self.map_histogram_response(attr_name, res)
+            for (attr_name, _), res in zip(
+                attr_names_and_partitions,
+                self.multi_search(
+                    [self.build_histogram_search(attr_name, partition.attributes) for (attr_name, partition) in attr_names_and_partitions],
+                    # A partition has at most as many unique values as items
+                    [min(partition.count, self.HISTOGRAM_MAX_BUCKETS) for (_, partition) in attr_names_and_partitions]
+                )
+            )
+        ]
+
+        indices_to_fall_back = [i for i, histogram in enumerate(histograms) if histogram is None]
+        split_statistics_around_median = self.get_split_statistics_around_median_batch([attr_names_and_partitions[i] for i in indices_to_fall_back])
+
+        split_statistics = [create_split_statistics_from_histogram(histogram) if histogram is not None else None for histogram in histograms]
+
+        for i, statistics in zip(indices_to_fall_back, split_statistics_around_median):
+            split_statistics[i] = statistics
+
+        return split_statistics
+
+    def build_leaf_counts_search(self, attr_name: str, partition: Partition) -> dict:
+        node: GenTree = partition.attributes[attr_name].get_node()
+
+        return {
+            "query": self.map_attributes_to_query(partition.attributes),
+            "size": 0,
+            "aggs": { f"{attr_name}_leaf_counts": { "terms": { "field": attr_name, "size": max(1, len(node)) } } }
+        }
+
+
+    def map_leaf_counts_response(self, attr_name: str, partition: Partition, res: dict) -> list[int]:
+        node: GenTree = partition.attributes[attr_name].get_node()
+        leaf_counts = {bucket["key"]: bucket["doc_count"] for bucket in res["aggregations"][f"{attr_name}_leaf_counts"]["buckets"]}
+
+        return node.roll_up_leaf_counts_to_children(leaf_counts)
+
+
+    def get_children_counts(self, attr_name: str, partition: Partition) -> list[int]:
+        """ Count the leaf values of the partition with one terms aggregation, and roll them up to the children of the hierarchy node locally """
+
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_leaf_counts_search(attr_name, partition))
+
+        return self.map_leaf_counts_response(attr_name, partition, res)
+
+
+    def get_children_counts_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[list[int]]:
+        responses = self.multi_search([self.build_leaf_counts_search(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions])
+
+        return [self.map_leaf_counts_response(attr_name, partition, res) for (attr_name, partition), res in zip(attr_names_and_partitions, responses)]
+
+
+    def build_timestamp_histogram_search(self, attr_name: str, attributes: dict[str, Attribute], interval: int) -> dict:
+        return {
+            "query": self.map_attributes_to_query(attributes),
+            "size": 0,
+            "aggs": {
+                f"{attr_name}_min": { "min": { "field": attr_name } },
+                f"{attr_name}_max": { "max": { "field": attr_name } },
+                f"{attr_name}_date_histogram": { "date_histogram": { "field": attr_name, "fixed_interval": f"{interval}ms", "min_doc_count": 1 } }
+            }
+        }
+
+
+    def map_timestamp_histogram_response(self, attr_name: str, res: dict) -> Tuple[list[Tuple[int, int]], int, int]:
+        return (
+            [(int(bucket["key"]), bucket["doc_count"]) for bucket in res["aggregations"][f"{attr_name}_date_histogram"]["buckets"]],
+            int(res["aggregations"][f"{attr_name}_min"]["value"]),
+            int(res["aggregations"][f"{attr_name}_max"]["value"])
+        )
+
+
+    def get_timestamp_histogram(self, attr_name: str, partition: Partition, interval: int) -> Tuple[list[Tuple[int, int]], int, int]:
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_timestamp_histogram_search(attr_name, partition.attributes, interval))
+
+        return self.map_timestamp_histogram_response(attr_name, res)
+
+
+    def get_timestamp_histogram_batch(self, attr_names_partitions_and_intervals: list[Tuple[str, Partition, int]]) -> list[Tuple[list[Tuple[int, int]], int, int]]:
+        responses = self.multi_search(
+            [self.build_timestamp_histogram_search(attr_name, partition.attributes, interval) for (attr_name, partition, interval) in attr_names_partitions_and_intervals],
+            # The interval keeps the buckets of the range below the limit, one more bucket is possible at the edges
+            [min(partition.count, self.TIMESTAMP_HISTOGRAM_MAX_BUCKETS + 1) for (_, partition, _) in attr_names_partitions_and_intervals]
+        )
+
+        return [self.map_timestamp_histogram_response(attr_name, res) for (attr_name, _, _), res in zip(attr_names_partitions_and_intervals, responses)]
+
+
+    def build_ip_min_max_search(self, attr_name: str, attributes: dict[str, Attribute]) -> dict:
+        """ The min/max aggregations do not support IP fields, but the first bucket of a terms aggregation ordered by the address does """
+
+        return {
+            "query": self.map_attributes_to_query(attributes),
+            "size": 0,
+            "aggs": {
+                f"{attr_name}_min": { "terms": { "field": attr_name, "size": 1, "order": { "_key": "asc" } } },
+                f"{attr_name}_max": { "terms": { "field": attr_name, "size": 1, "order": { "_key": "desc" } } }
+            }
+        }
+
+
+    def map_ip_min_max_response(self, attr_name: str, res: dict) -> Tuple[int, int]:
+        version = get_ip_version(attr_name)
+
+        return (
+            map_ip_to_int(res["aggregations"][f"{attr_name}_min"]["buckets"][0]["key"], version), 
+            map_ip_to_int(res["aggregations"][f"{attr_name}_max"]["buckets"][0]["key"], version)
+        )
+
+
+    def get_ip_min_max(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_ip_min_max_search(attr_name, partition.attributes))
+
+        return self.map_ip_min_max_response(attr_name, res)
+
+
+    def get_ip_min_max_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[Tuple[int, int]]:
+        responses = self.multi_search([self.build_ip_min_max_search(attr_name, partition.attributes) for (attr_name, partition) in attr_names_and_partitions])
+
+        return [self.map_ip_min_max_response(attr_name, res) for (attr_name, _), res in zip(attr_names_and_partitions, responses)]
+
+
+    def build_ip_split_sides_search(self, attr_name: str, attributes: dict[str, Attribute], split_address: int) -> dict:
+        """ One filter aggregation per side of the split address, counting its documents, with the largest address on the left and the smallest on the right """
+
+        split_ip = map_int_to_ip(split_address, get_ip_version(attr_name))
+
+        return {
+            "query": self.map_attributes_to_query(attributes),
+            "size": 0,
+            "aggs": {
+                "left": {
+                    "filter": { "range": { attr_name: { "lt": split_ip } } },
+                    "aggs": { "max": { "terms": { "field": attr_name, "size": 1, "order": { "_key": "desc" } } } }
+                },
+                "right": {
+                    "filter": { "range": { attr_name: { "gte": split_ip } } },
+                    "aggs": { "min": { "terms": { "field": attr_name, "size": 1, "order": { "_key": "asc" } } } }
+                }
+            }
+        }
+
+
+    def map_ip_split_sides_response(self, attr_name: str, res: dict) -> Tuple[int, int, int, int]:
+        version = get_ip_version(attr_name)
+        (left, right) = (res["aggregations"]["left"], res["aggregations"]["right"])
+
+        return (
+            map_ip_to_int(left["max"]["buckets"][0]["key"], version), left["doc_count"],
+            map_ip_to_int(right["min"]["buckets"][0]["key"], version), right["doc_count"]
+        )
+
+
+    def get_ip_split_sides(self, attr_name: str, partition: Partition, split_address: int) -> Tuple[int, int, int, int]:
+        res = self.es_client.search(index=self.INDEX_NAME, **self.build_ip_split_sides_search(attr_name, partition.attributes, split_address))
+
+        return self.map_ip_split_sides_response(attr_name, res)
+
+
+    def get_ip_split_sides_batch(self, attr_names_partitions_and_split_addresses: list[Tuple[str, Partition, int]]) -> list[Tuple[int, int, int, int]]:
+        responses = self.multi_search([
+            self.build_ip_split_sides_search(attr_name, partition.attributes, split_address) 
+            for (attr_name, partition, split_address) in attr_names_partitions_and_split_addresses
+        ])
+
+        return [self.map_ip_split_sides_response(attr_name, res) for (attr_name, _, _), res in zip(attr_names_partitions_and_split_addresses, responses)]
 
 # ------------------------------
 # <<    Mondrian API - END
@@ -265,6 +891,68 @@ class EsConnector(MondrianAPI, DataflyAPI):
                 num_ranges.append(NumRange(bucket_upper_bounds[i-1] + 1, bound))            
 
         return num_ranges
+
+
+    def build_frequency_table_source(self, attr_name: str, attributes: list[Attribute]) -> dict:
+        """ Hierarchical attributes are aggregated on their leaf values, numerical ones on the index of the candidate range covering the value """
+
+        if isinstance(attributes[0], HierarchicalAttribute):
+            return {"terms": {"field": attr_name}}
+
+        return {
+            "terms": {
+                "script": {
+                    "lang": "painless",
+                    "source": """
+                        if (doc[params.field].size() == 0) { return -1; }
+                        long value = doc[params.field].value;
+                        for (int i = 0; i < params.lower.size(); ++i) {
+                            if (value >= ((Number) params.lower.get(i)).longValue() && value <= ((Number) params.upper.get(i)).longValue()) { return i; }
+                        }
+                        return -1;
+                    """,
+                    "params": {"field": attr_name, "lower": [attr.get_min_value() for attr in attributes], "upper": [attr.get_max_value() for attr in attributes]}
+                },
+                "value_type": "long"
+            }
+        }
+
+
+    def get_frequency_table(self, candidates: dict[str, list[Attribute]]) -> dict[Tuple[int, ...], int]:
+        """ Page through one composite aggregation, whose buckets are the occupied cells. The leaf values of the hierarchical attributes are mapped 
+        to the index of the candidate node covering them. """
+
+        if not candidates:
+            return {(): self.get_document_count()}
+
+        leaf_to_index: dict[str, dict[str, int]] = {
+            attr_name: {leaf: i for i, attr in enumerate(attributes) for leaf in attr.get_node().get_leaf_node_values()}
+            for attr_name, attributes in candidates.items() if isinstance(attributes[0], HierarchicalAttribute)
+        }
+
+        composite = {
+            "size": self.COMPOSITE_PAGE_SIZE,
+            "sources": [{attr_name: self.build_frequency_table_source(attr_name, attributes)} for attr_name, attributes in candidates.items()]
+        }
+        frequency_table: dict[Tuple[int, ...], int] = {}
+
+        while True:
+            res = self.es_client.search(index=self.INDEX_NAME, aggs={"cells": {"composite": composite}}, size=0)
+            aggregation = res["aggregations"]["cells"]
+
+            for bucket in aggregation["buckets"]:
+                cell = tuple(
+                    leaf_to_index[attr_name].get(bucket["key"][attr_name], -1) if attr_name in leaf_to_index else bucket["key"][attr_name]
+                    for attr_name in candidates.keys()
+                )
+
+                if -1 not in cell:
+                    frequency_table[cell] = frequency_table.get(cell, 0) + bucket["doc_count"]
+
+            if len(aggregation["buckets"]) < self.COMPOSITE_PAGE_SIZE or "after_key" not in aggregation:
+                return frequency_table
+
+            composite["after"] = aggregation["after_key"]
     
 
 # ------------------------------
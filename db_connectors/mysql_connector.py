@@ -1,25 +1,46 @@
+import threading
+
+from contextlib import contextmanager
 from os import getenv
 
-from typing import Tuple
+from typing import Iterable, Tuple
 
 from functools import reduce
 
 import mysql.connector
+import mysql.connector.pooling
 
 import tqdm
 
 from interfaces.datafly_api import DataflyAPI
 from interfaces.mondrian_api import MondrianAPI
 
-from models.attribute import Attribute
+from models.attribute import Attribute, get_code_field_name, get_ip_version
 from models.config import Config
+from models.gentree import GenTree
 from models.numrange import NumRange
 from models.partition import Partition
+from models.split_statistics import SplitStatistics, create_split_statistics_around_median, create_split_statistics_from_histogram
 
+from utils.batching import split_into_batches
+from utils.output_modes import generate_output_docs, get_output_size
 
-class MySQLConnector(MondrianAPI, DataflyAPI):
 
-    def __init__(self):        
+class MySQLConnector(MondrianAPI, DataflyAPI):
+    UNION_BATCH_SIZE = 200
+    # Upper bound on the rows of one UNION ALL statement of histograms, whose queries return up to HISTOGRAM_MAX_BUCKETS + 1 rows each
+    UNION_MAX_ROWS = 100000
+    # Partitions with more unique values of the split attribute fall back to the queries around the median
+    HISTOGRAM_MAX_BUCKETS = 10000
+    # Rows fetched at once, when streaming the sensitive values of a partition
+    FETCH_BATCH_SIZE = 10000
+    # Data types of the columns, that are not read as strings
+    SENSITIVE_ATTR_TYPES = {
+        "tinyint": "integer", "smallint": "integer", "mediumint": "integer", "int": "integer", "bigint": "integer",
+        "float": "float", "double": "float"
+    }
+
+    def __init__(self, pool_size: int = 1, partition_labels: bool = False):
         MYSQL_HOST = getenv('MYSQL_HOST')
         MYSQL_USER = getenv('MYSQL_USER')
         MYSQL_PASSWORD = getenv('MYSQL_PASSWORD')
@@ -27,14 +48,56 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
         
         self.TABLE_NAME = getenv('MYSQL_TABLE_NAME')
         self.ANON_TABLE_NAME = f"{self.TABLE_NAME}_anonymized"
-
-        self.mysql_client = mysql.connector.connect(
+        # Identifies the data behind the results of the queries, in persistent caches
+        self.DATASET_ID = f"mysql:{MYSQL_HOST}/{MYSQL_DATABASE}/{self.TABLE_NAME}"
+        # With partition labels, the items are copied into the working table, with the id of their partition in the partition_id column
+        self.WORKING_TABLE_NAME = f"{self.TABLE_NAME}_partitions"
+        self.partition_labels = partition_labels
+
+        # One connection per worker thread, plus one for reading the sensitive values while pushing the partitions.
+        # mysql-connector limits the size of a pool, any further threads wait for a free connection in get_cursor.
+        pool_size = min(pool_size + 1, mysql.connector.pooling.CNX_POOL_MAXSIZE)
+        # The pool raises a PoolError when it is exhausted, instead of waiting
+        self.free_connections = threading.BoundedSemaphore(pool_size)
+
+        self.connection_pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="anonymization_module",
+            pool_size=pool_size,
             host=MYSQL_HOST,
             user=MYSQL_USER,
             password=MYSQL_PASSWORD,
             database=MYSQL_DATABASE
         )
+
+        self.supports_window_functions = self.check_window_function_support()
+
+
+    @contextmanager
+    def get_cursor(self):
+        """ Borrow a connection from the pool for the duration of the block, committing at its end. Blocks until a connection is free. """
+
+        with self.free_connections:
+            connection = self.connection_pool.get_connection()
+
+            try:
+                yield connection.cursor()
+                connection.commit()
+            finally:
+                # Returns the connection to the pool
+                connection.close()
     
+    def check_window_function_support(self) -> bool:
+        """ Window functions and common table expressions are available from MySQL 8.0 and MariaDB 10.2 """
+
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT VERSION()")
+            version = cursor.fetchone()[0]
+
+        (major, minor) = [int(number) for number in version.split("-")[0].split(".")[:2]]
+
+        return (major, minor) >= ((10, 2) if "MariaDB" in version else (8, 0))
+
+
     def map_attributes_to_where_conditions(self, attributes: dict[str, Attribute]) -> str:
         if attributes is None:
             return ""
@@ -42,16 +105,50 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
         return f"WHERE {' AND '.join([attr.map_to_sql_query() for attr in attributes.values()])}"
 
 
+    def map_partition_to_source(self, partition: Partition) -> str:
+        """ The FROM and WHERE clauses selecting the items of the partition: with partition labels, the rows of the working table with its id """
+
+        # Final partitions loaded from a checkpoint have no label
+        if self.partition_labels and getattr(partition, "partition_id", None) is not None:
+            return f"FROM {self.WORKING_TABLE_NAME} WHERE partition_id = {partition.partition_id}"
+
+        return f"FROM {self.TABLE_NAME} {self.map_attributes_to_where_conditions(partition.attributes)}"
+
+
     def get_document_count(self, attributes: dict[str, Attribute] = None) -> int:                
         where = self.map_attributes_to_where_conditions(attributes)
 
-        cursor = self.mysql_client.cursor()
         query = f"SELECT COUNT(*) FROM {self.TABLE_NAME} {where}"
         
-        cursor.execute(query)
-        count = cursor.fetchone()
+        with self.get_cursor() as cursor:
+            cursor.execute(query)
+            count = cursor.fetchone()
 
         return count[0]
+
+
+    def execute_union_all(self, queries: list[str], max_rows_per_query: list[int] = None) -> list[list[tuple]]:
+        """ Run the queries in as few UNION ALL statements as possible, returning the rows of each query in the order of the queries.
+        Given the most rows each query can return, a statement also returns at most UNION_MAX_ROWS rows, unless one query alone exceeds it. """
+
+        rows_per_query: list[list[tuple]] = [[] for _ in queries]
+
+        for batch in split_into_batches(max_rows_per_query or [1] * len(queries), self.UNION_BATCH_SIZE, self.UNION_MAX_ROWS):
+            statement = " UNION ALL ".join(f"SELECT {i} AS query_index, q.* FROM ({queries[i]}) AS q" for i in batch)
+
+            with self.get_cursor() as cursor:
+                cursor.execute(statement)
+
+                for row in cursor.fetchall():
+                    rows_per_query[row[0]].append(row[1:])
+
+        return rows_per_query
+
+
+    def get_document_counts(self, attributes_per_partition: list[dict[str, Attribute]]) -> list[int]:
+        queries = [f"SELECT COUNT(*) AS count FROM {self.TABLE_NAME} {self.map_attributes_to_where_conditions(attributes)}" for attributes in attributes_per_partition]
+
+        return [rows[0][0] for rows in self.execute_union_all(queries)]
     
 
     def get_aggregate(self, aggr_func: str, attr_name: str, attributes: dict[str, Attribute]) -> Tuple[int,int]:
@@ -59,9 +156,9 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
 
         where = self.map_attributes_to_where_conditions(attributes)
 
-        cursor = self.mysql_client.cursor()
-        cursor.execute(f"SELECT {aggr_func}({attr_name}) FROM {self.TABLE_NAME} {where}")
-        aggr_value = cursor.fetchone()
+        with self.get_cursor() as cursor:
+            cursor.execute(f"SELECT {aggr_func}({attr_name}) FROM {self.TABLE_NAME} {where}")
+            aggr_value = cursor.fetchone()
 
         return int(aggr_value[0])
     
@@ -76,6 +173,25 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
 
     def get_attribute_min_max(self, attr_name: str, attributes: dict[str, Attribute] = None) -> Tuple[int,int]:
         return self.get_attribute_min(attr_name, attributes), self.get_attribute_max(attr_name, attributes)
+
+
+    def add_ordinal_codes(self, attr_name: str, leaf_codes: dict[str, int]):
+        """ Add the indexed shadow column if it is missing, and fill it with one UPDATE. The leaf values are listed in the order of their codes, 
+        so that the position returned by FIELD() is the code plus one, rows with values outside of the hierarchy get NULL. """
+
+        code_column_name = get_code_field_name(attr_name)
+        leaf_values_as_str = ",".join([f"'{value}'" for value in sorted(leaf_codes, key=leaf_codes.get)])
+
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+                (self.TABLE_NAME, code_column_name)
+            )
+
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"ALTER TABLE {self.TABLE_NAME} ADD COLUMN {code_column_name} INT, ADD INDEX ({code_column_name})")
+
+            cursor.execute(f"UPDATE {self.TABLE_NAME} SET {code_column_name} = NULLIF(FIELD({attr_name}, {leaf_values_as_str}), 0) - 1")
     
 
     def get_value_at_percentile(self, attr_name: str, attributes: dict[str, Attribute], partition_size: int, percentile: float) -> int:
@@ -87,9 +203,9 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
 
         query = f"SELECT {attr_name} FROM {self.TABLE_NAME} {where} ORDER BY {attr_name} DESC LIMIT {index},1"
 
-        cursor = self.mysql_client.cursor()
-        cursor.execute(query)
-        value_at_percentile = cursor.fetchone()
+        with self.get_cursor() as cursor:
+            cursor.execute(query)
+            value_at_percentile = cursor.fetchone()
 
         return int(value_at_percentile[0])
     
@@ -107,9 +223,9 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
 
         query = f"SELECT {func}({attr_name}) FROM {self.TABLE_NAME} {where} AND {attr_name} {operator} {central_value}"
 
-        cursor = self.mysql_client.cursor()
-        cursor.execute(query)
-        value = cursor.fetchone()
+        with self.get_cursor() as cursor:
+            cursor.execute(query)
+            value = cursor.fetchone()
 
         return int(value[0])
     
@@ -131,6 +247,375 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
         return value_to_split_at, next_unique_value
     
 
+    def build_median_query(self, attr_name: str, partition: Partition) -> str:
+        source = self.map_partition_to_source(partition)
+
+        return f"SELECT {attr_name} AS median {source} ORDER BY {attr_name} LIMIT {(partition.count - 1) // 2},1"
+
+
+    def build_values_around_median_query(self, attr_name: str, partition: Partition, median: int) -> str:
+        source = self.map_partition_to_source(partition)
+
+        return f"""SELECT 
+                MIN({attr_name}) AS min_value, 
+                MAX({attr_name}) AS max_value, 
+                SUM({attr_name} < {median}) AS below_count, 
+                MAX(CASE WHEN {attr_name} < {median} THEN {attr_name} END) AS below_max, 
+                SUM({attr_name} = {median}) AS at_count, 
+                SUM({attr_name} > {median}) AS above_count, 
+                MIN(CASE WHEN {attr_name} > {median} THEN {attr_name} END) AS above_min 
+            {source}"""
+
+
+    def build_split_statistics_window_query(self, attr_name: str, partition: Partition) -> str:
+        """ Number the rows of the partition in the order of the attribute, pick the (lower) median by its row number, 
+        and aggregate the values around it, all in one statement and one scan of the partition """
+
+        source = self.map_partition_to_source(partition)
+
+        return f"""
+            WITH ranked AS (
+                SELECT {attr_name} AS value, ROW_NUMBER() OVER (ORDER BY {attr_name}) AS row_num, COUNT(*) OVER () AS total 
+                {source}
+            ), 
+            median AS (
+                SELECT value AS median FROM ranked WHERE row_num = FLOOR((total - 1) / 2) + 1
+            )
+            SELECT 
+                median.median,
+                MIN(value) AS min_value, 
+                MAX(value) AS max_value, 
+                SUM(value < median.median) AS below_count, 
+                MAX(CASE WHEN value < median.median THEN value END) AS below_max, 
+                SUM(value = median.median) AS at_count, 
+                SUM(value > median.median) AS above_count, 
+                MIN(CASE WHEN value > median.median THEN value END) AS above_min 
+            FROM ranked CROSS JOIN median 
+            GROUP BY median.median"""
+
+
+    def map_values_around_median_row(self, median: int, row: tuple) -> SplitStatistics | None:
+        (min_value, max_value, below_count, below_max, at_count, above_count, above_min) = row
+
+        return create_split_statistics_around_median(
+            median=median,
+            min_value=int(min_value),
+            max_value=int(max_value),
+            below_count=int(below_count),
+            below_max=int(below_max) if below_max is not None else None,
+            at_count=int(at_count),
+            above_count=int(above_count),
+            above_min=int(above_min) if above_min is not None else None
+        )
+
+
+    def build_histogram_query(self, attr_name: str, partition: Partition) -> str:
+        source = self.map_partition_to_source(partition)
+
+        # One row more than the limit tells that the histogram does not fit
+        return f"SELECT {attr_name} AS value, COUNT(*) AS count {source} GROUP BY {attr_name} ORDER BY {attr_name} LIMIT {self.HISTOGRAM_MAX_BUCKETS + 1}"
+
+
+    def map_histogram_rows(self, rows: list[tuple]) -> list[Tuple[int, int]] | None:
+        """ Return the (value, count) pairs of the histogram, or None if the attribute has more unique values in the partition than fit into it """
+
+        if len(rows) > self.HISTOGRAM_MAX_BUCKETS:
+            return None
+
+        return sorted((int(value), int(count)) for (value, count) in rows)
+
+
+    def get_split_statistics_around_median(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Get the median with one query, and the limits, the next/previous unique value and both child counts with a second one.
+        With window functions, everything comes from a single statement. """
+
+        with self.get_cursor() as cursor:
+            if self.supports_window_functions:
+                cursor.execute(self.build_split_statistics_window_query(attr_name, partition))
+                row = cursor.fetchone()
+
+                return self.map_values_around_median_row(int(row[0]), row[1:])
+
+            cursor.execute(self.build_median_query(attr_name, partition))
+            median = int(cursor.fetchone()[0])
+
+            cursor.execute(self.build_values_around_median_query(attr_name, partition, median))
+            row = cursor.fetchone()
+
+        return self.map_values_around_median_row(median, row)
+
+
+    def get_split_statistics_around_median_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Same as get_split_statistics_around_median, but for many partitions at once, with two UNION ALL statements in total, or one with window functions """
+
+        if self.supports_window_functions:
+            rows_per_query = self.execute_union_all([self.build_split_statistics_window_query(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions])
+
+            return [self.map_values_around_median_row(int(rows[0][0]), rows[0][1:]) for rows in rows_per_query]
+
+        medians = [
+            int(rows[0][0]) 
+            for rows in self.execute_union_all([self.build_median_query(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions])
+        ]
+
+        rows_per_query = self.execute_union_all([
+            self.build_values_around_median_query(attr_name, partition, median) 
+            for (attr_name, partition), median in zip(attr_names_and_partitions, medians)
+        ])
+
+        return [self.map_values_around_median_row(median, rows[0]) for median, rows in zip(medians, rows_per_query)]
+
+
+    def get_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Fetch the histogram of the attribute within the partition with one GROUP BY, and find the median, the next unique value and the child counts locally.
+        Only if the attribute has too many unique values in the partition, fall back to the queries around the median. """
+
+        with self.get_cursor() as cursor:
+            cursor.execute(self.build_histogram_query(attr_name, partition))
+            histogram = self.map_histogram_rows(cursor.fetchall())
+
+        if histogram is None:
+            return self.get_split_statistics_around_median(attr_name, partition)
+
+        return create_split_statistics_from_histogram(histogram)
+
+
+    def get_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Same as get_split_statistics, but for many partitions at once, with one UNION ALL statement for the histograms """
+
+        histograms = [
+            self.map_histogram_rows(rows)
+            for rows in self.execute_union_all(
+                [self.build_histogram_query(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions],
+                # A partition has at most as many unique values as items
+                [min(partition.count, self.HISTOGRAM_MAX_BUCKETS + 1) for (_, partition) in attr_names_and_partitions]
+            )
+        ]
+
+        indices_to_fall_back = [i for i, histogram in enumerate(histograms) if histogram is None]
+        split_statistics_around_median = self.get_split_statistics_around_median_batch([attr_names_and_partitions[i] for i in indices_to_fall_back])
+
+        split_statistics = [create_split_statistics_from_histogram(histogram) if histogram is not None else None for histogram in histograms]
+
+        for i, statistics in zip(indices_to_fall_back, split_statistics_around_median):
+            split_statistics[i] = statistics
+
+        return split_statistics
+
+
+    def build_leaf_counts_query(self, attr_name: str, partition: Partition) -> str:
+        source = self.map_partition_to_source(partition)
+
+        return f"SELECT {attr_name} AS leaf_value, COUNT(*) AS count {source} GROUP BY {attr_name}"
+
+
+    def map_leaf_counts_rows(self, attr_name: str, partition: Partition, rows: list[tuple]) -> list[int]:
+        node: GenTree = partition.attributes[attr_name].get_node()
+
+        return node.roll_up_leaf_counts_to_children({leaf_value: int(count) for (leaf_value, count) in rows})
+
+
+    def get_children_counts(self, attr_name: str, partition: Partition) -> list[int]:
+        """ Count the leaf values of the partition with one GROUP BY, and roll them up to the children of the hierarchy node locally """
+
+        with self.get_cursor() as cursor:
+            cursor.execute(self.build_leaf_counts_query(attr_name, partition))
+            rows = cursor.fetchall()
+
+        return self.map_leaf_counts_rows(attr_name, partition, rows)
+
+
+    def get_children_counts_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[list[int]]:
+        rows_per_query = self.execute_union_all([self.build_leaf_counts_query(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions])
+
+        return [self.map_leaf_counts_rows(attr_name, partition, rows) for (attr_name, partition), rows in zip(attr_names_and_partitions, rows_per_query)]
+
+
+    def build_timestamp_histogram_query(self, attr_name: str, partition: Partition, interval: int) -> str:
+        source = self.map_partition_to_source(partition)
+
+        return f"""
+            SELECT FLOOR({attr_name} / {interval}) * {interval} AS bucket_start, COUNT(*) AS count, MIN({attr_name}) AS min_value, MAX({attr_name}) AS max_value 
+            {source} 
+            GROUP BY bucket_start 
+            ORDER BY bucket_start"""
+
+
+    def map_timestamp_histogram_rows(self, rows: list[tuple]) -> Tuple[list[Tuple[int, int]], int, int]:
+        """ The order of the rows is not guaranteed inside the derived tables of a UNION ALL, the buckets are sorted here """
+
+        buckets = sorted((int(bucket_start), int(count)) for (bucket_start, count, _, _) in rows)
+
+        return buckets, min(int(row[2]) for row in rows), max(int(row[3]) for row in rows)
+
+
+    def get_timestamp_histogram(self, attr_name: str, partition: Partition, interval: int) -> Tuple[list[Tuple[int, int]], int, int]:
+        with self.get_cursor() as cursor:
+            cursor.execute(self.build_timestamp_histogram_query(attr_name, partition, interval))
+            rows = cursor.fetchall()
+
+        return self.map_timestamp_histogram_rows(rows)
+
+
+    def get_timestamp_histogram_batch(self, attr_names_partitions_and_intervals: list[Tuple[str, Partition, int]]) -> list[Tuple[list[Tuple[int, int]], int, int]]:
+        rows_per_query = self.execute_union_all(
+            [self.build_timestamp_histogram_query(attr_name, partition, interval) for (attr_name, partition, interval) in attr_names_partitions_and_intervals],
+            # The interval keeps the buckets of the range below the limit, one more bucket is possible at the edges
+            [min(partition.count, self.TIMESTAMP_HISTOGRAM_MAX_BUCKETS + 1) for (_, partition, _) in attr_names_partitions_and_intervals]
+        )
+
+        return [self.map_timestamp_histogram_rows(rows) for rows in rows_per_query]
+
+
+    def build_ip_min_max_query(self, attr_name: str, partition: Partition) -> str:
+        source = self.map_partition_to_source(partition)
+
+        if get_ip_version(attr_name) == 4:
+            return f"SELECT MIN(INET_ATON({attr_name})) AS min_address, MAX(INET_ATON({attr_name})) AS max_address {source}"
+
+        # The 16-byte binary strings compare in the order of the addresses
+        return f"SELECT HEX(MIN(INET6_ATON({attr_name}))) AS min_address, HEX(MAX(INET6_ATON({attr_name}))) AS max_address {source}"
+
+
+    def map_ip_min_max_row(self, attr_name: str, row: tuple) -> Tuple[int, int]:
+        if get_ip_version(attr_name) == 4:
+            return int(row[0]), int(row[1])
+
+        return int(row[0], 16), int(row[1], 16)
+
+
+    def get_ip_min_max(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        with self.get_cursor() as cursor:
+            cursor.execute(self.build_ip_min_max_query(attr_name, partition))
+            row = cursor.fetchone()
+
+        return self.map_ip_min_max_row(attr_name, row)
+
+
+    def get_ip_min_max_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[Tuple[int, int]]:
+        rows_per_query = self.execute_union_all([self.build_ip_min_max_query(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions])
+
+        return [self.map_ip_min_max_row(attr_name, rows[0]) for (attr_name, _), rows in zip(attr_names_and_partitions, rows_per_query)]
+
+
+    def build_ip_split_sides_query(self, attr_name: str, partition: Partition, split_address: int) -> str:
+        """ One pass over the partition, the conditional aggregates only take the addresses on their side of the split address """
+
+        source = self.map_partition_to_source(partition)
+
+        if get_ip_version(attr_name) == 4:
+            (address, split) = (f"INET_ATON({attr_name})", str(split_address))
+            left_max = f"MAX(CASE WHEN {address} < {split} THEN {address} END)"
+            right_min = f"MIN(CASE WHEN {address} >= {split} THEN {address} END)"
+        else:
+            # The 16-byte binary strings compare in the order of the addresses
+            (address, split) = (f"INET6_ATON({attr_name})", f"UNHEX('{split_address:032x}')")
+            left_max = f"HEX(MAX(CASE WHEN {address} < {split} THEN {address} END))"
+            right_min = f"HEX(MIN(CASE WHEN {address} >= {split} THEN {address} END))"
+
+        return f"SELECT {left_max} AS left_max_address, SUM({address} < {split}) AS left_count, {right_min} AS right_min_address, SUM({address} >= {split}) AS right_count {source}"
+
+
+    def map_ip_split_sides_row(self, attr_name: str, row: tuple) -> Tuple[int, int, int, int]:
+        (left_max_address, left_count, right_min_address, right_count) = row
+
+        if get_ip_version(attr_name) == 4:
+            return int(left_max_address), int(left_count), int(right_min_address), int(right_count)
+
+        return int(left_max_address, 16), int(left_count), int(right_min_address, 16), int(right_count)
+
+
+    def get_ip_split_sides(self, attr_name: str, partition: Partition, split_address: int) -> Tuple[int, int, int, int]:
+        with self.get_cursor() as cursor:
+            cursor.execute(self.build_ip_split_sides_query(attr_name, partition, split_address))
+            row = cursor.fetchone()
+
+        return self.map_ip_split_sides_row(attr_name, row)
+
+
+    def get_ip_split_sides_batch(self, attr_names_partitions_and_split_addresses: list[Tuple[str, Partition, int]]) -> list[Tuple[int, int, int, int]]:
+        rows_per_query = self.execute_union_all([
+            self.build_ip_split_sides_query(attr_name, partition, split_address) 
+            for (attr_name, partition, split_address) in attr_names_partitions_and_split_addresses
+        ])
+
+        return [self.map_ip_split_sides_row(attr_name, rows[0]) for (attr_name, _, _), rows in zip(attr_names_partitions_and_split_addresses, rows_per_query)]
+
+
+    def build_subpartition_counts_query(self, partition: Partition, attr_name: str, subpartitions: list[Partition]) -> str:
+        """ Count the items of all subpartitions with one GROUP BY over the partition, the subpartitions only differ from it in the split attribute """
+
+        cases = " ".join(f"WHEN {subpartition.attributes[attr_name].map_to_sql_query()} THEN {i}" for i, subpartition in enumerate(subpartitions))
+
+        return f"SELECT CASE {cases} END AS subpartition_index, COUNT(*) AS count {self.map_partition_to_source(partition)} GROUP BY subpartition_index"
+
+
+    def map_subpartition_counts_rows(self, subpartitions: list[Partition], rows: list[tuple]) -> list[int]:
+        counts = [0] * len(subpartitions)
+
+        for (subpartition_index, count) in rows:
+            if subpartition_index is not None:
+                counts[int(subpartition_index)] = int(count)
+
+        return counts
+
+
+    def get_subpartition_counts(self, partition: Partition, attr_name: str, subpartitions: list[Partition]) -> list[int]:
+        with self.get_cursor() as cursor:
+            cursor.execute(self.build_subpartition_counts_query(partition, attr_name, subpartitions))
+            rows = cursor.fetchall()
+
+        return self.map_subpartition_counts_rows(subpartitions, rows)
+
+
+    def get_subpartition_counts_batch(self, splits: list[Tuple[Partition, str, list[Partition]]]) -> list[list[int]]:
+        rows_per_query = self.execute_union_all([self.build_subpartition_counts_query(partition, attr_name, subpartitions) for (partition, attr_name, subpartitions) in splits])
+
+        return [self.map_subpartition_counts_rows(subpartitions, rows) for (_, _, subpartitions), rows in zip(splits, rows_per_query)]
+
+
+    def label_partitions(self, partitions: list[Partition]):
+        """ Copy the QIDs and the sensitive attributes into the working table, indexed by the partition_id, and label the items with the id of their partition """
+
+        if not self.partition_labels:
+            return
+
+        columns = Config.qid_names + Config.sensitive_attr_names + ([get_code_field_name(attr_name) for attr_name in Config.gen_hiers] if Config.ordinal_encoding else [])
+
+        with self.get_cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.WORKING_TABLE_NAME}")
+            cursor.execute(f"CREATE TABLE {self.WORKING_TABLE_NAME} AS SELECT {', '.join(columns)} FROM {self.TABLE_NAME}")
+            cursor.execute(f"ALTER TABLE {self.WORKING_TABLE_NAME} ADD COLUMN partition_id INT")
+            cursor.execute(f"CREATE INDEX {self.WORKING_TABLE_NAME}_partition_id ON {self.WORKING_TABLE_NAME} (partition_id)")
+
+            for batch_start in range(0, len(partitions), self.UNION_BATCH_SIZE):
+                cases = " ".join(
+                    f"WHEN {' AND '.join(attr.map_to_sql_query() for attr in partition.attributes.values())} THEN {partition.partition_id}" 
+                    for partition in partitions[batch_start:batch_start + self.UNION_BATCH_SIZE]
+                )
+
+                cursor.execute(f"UPDATE {self.WORKING_TABLE_NAME} SET partition_id = CASE {cases} END WHERE partition_id IS NULL")
+
+
+    def apply_splits(self, splits: list[Tuple[Partition, str, list[Partition]]]):
+        """ Relabel the items of the split partitions with the ids of their subpartitions, touching only the rows of the split partitions """
+
+        if not self.partition_labels:
+            return
+
+        with self.get_cursor() as cursor:
+            for batch_start in range(0, len(splits), self.UNION_BATCH_SIZE):
+                batch = splits[batch_start:batch_start + self.UNION_BATCH_SIZE]
+
+                cases = " ".join(
+                    f"WHEN partition_id = {partition.partition_id} AND {subpartition.attributes[attr_name].map_to_sql_query()} THEN {subpartition.partition_id}"
+                    for (partition, attr_name, subpartitions) in batch for subpartition in subpartitions
+                )
+                split_partition_ids = ",".join(str(partition.partition_id) for (partition, _, _) in batch)
+
+                cursor.execute(f"UPDATE {self.WORKING_TABLE_NAME} SET partition_id = CASE {cases} END WHERE partition_id IN ({split_partition_ids})")
+
+
     def spread_attribute_into_uniform_buckets(self, attr_name: str, num_of_buckets: int) -> list[NumRange]:
         interval_size = 100 / num_of_buckets            
         percentiles = [interval_size*i for i in range(1, num_of_buckets + 1)]
@@ -153,49 +638,157 @@ class MySQLConnector(MondrianAPI, DataflyAPI):
                 num_ranges.append(NumRange(bucket_upper_bounds[i-1] + 1, bound))            
 
         return num_ranges
+
+
+    def get_frequency_table(self, candidates: dict[str, list[Attribute]]) -> dict[Tuple[int, ...], int]:
+        """ One GROUP BY over the indices of the candidate values covering the rows, so that only the non-empty cells are returned """
+
+        if not candidates:
+            return {(): self.get_document_count()}
+
+        labels = [
+            f"CASE {' '.join(f'WHEN {attr.map_to_sql_query()} THEN {i}' for i, attr in enumerate(attributes))} END AS label_{column}"
+            for column, attributes in enumerate(candidates.values())
+        ]
+        label_names = ', '.join(f"label_{column}" for column in range(len(candidates)))
+
+        with self.get_cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(labels)}, COUNT(*) FROM {self.TABLE_NAME} GROUP BY {label_names}")
+            rows = cursor.fetchall()
+
+        # Rows outside of every candidate value of some attribute are labeled with NULL
+        return {tuple(row[:-1]): row[-1] for row in rows if None not in row[:-1]}
     
 
     def map_partition_to_mysql_anon_record(self, partition: Partition) -> dict[str, dict|str]:
         return reduce(lambda acc, curr: acc | curr, [attr.map_to_sql_attribute() for attr in partition.attributes.values()])
     
 
-    def generate_anonymized_docs(self, partitions: list[Partition]):        
+    def generate_sensitive_values(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[tuple]]]:
         for partition in partitions:
-            where = self.map_attributes_to_where_conditions(partition.attributes)
+            yield partition, self.fetch_sensitive_values(partition)
 
-            query = f"SELECT {','.join(Config.sensitive_attr_names)} FROM {self.TABLE_NAME} {where}"
-            cursor = self.mysql_client.cursor()
-            cursor.execute(query)
-            sensitive_values_in_partition = cursor.fetchall()
 
+    def fetch_sensitive_values(self, partition: Partition) -> Iterable[tuple]:
+        """ Fetch the rows of the partition in chunks of FETCH_BATCH_SIZE, instead of holding all of them in memory """
+
+        with self.get_cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(Config.sensitive_attr_names)} {self.map_partition_to_source(partition)}")
+
+            while rows := cursor.fetchmany(self.FETCH_BATCH_SIZE):
+                yield from rows
+
+
+    def generate_sensitive_value_counts(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[Tuple[tuple, int]]]]:
+        for partition in partitions:
+            yield partition, self.fetch_sensitive_value_counts(partition)
+
+
+    def get_sensitive_attr_types(self) -> dict[str, str]:
+        """ The data types of the columns of the original table, the decimals and the dates are read as strings """
+
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s", 
+                (self.TABLE_NAME,)
+            )
+            data_types = {column_name: data_type.lower() for (column_name, data_type) in cursor.fetchall()}
+
+        return {sensitive_attr_name: self.SENSITIVE_ATTR_TYPES.get(data_types.get(sensitive_attr_name), "string") for sensitive_attr_name in Config.sensitive_attr_names}
+
+
+    def fetch_sensitive_value_counts(self, partition: Partition) -> Iterable[Tuple[tuple, int]]:
+        sensitive_attr_names = ', '.join(Config.sensitive_attr_names)
+
+        with self.get_cursor() as cursor:
+            cursor.execute(f"SELECT {sensitive_attr_names}, COUNT(*) {self.map_partition_to_source(partition)} GROUP BY {sensitive_attr_names}")
+
+            while rows := cursor.fetchmany(self.FETCH_BATCH_SIZE):
+                for row in rows:
+                    yield tuple(row[:-1]), row[-1]
+
+
+    def generate_anonymized_docs(self, partitions: list[Partition]):
+        return generate_output_docs(self, partitions, self.map_partition_to_mysql_anon_record)
+
+
+    def create_anon_table(self, attributes: dict[str, Attribute]):
+        """ Create the table of the anonymized records, if it is not there yet. The sensitive attributes keep their types from the original table.
+        An existing table, e.g. one created by hand, must have exactly the columns of the anonymized records. """
+
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "SELECT column_name, column_type FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s", 
+                (self.TABLE_NAME,)
+            )
+            column_types = {column_name: column_type for (column_name, column_type) in cursor.fetchall()}
+
+            anon_column_types = {column_name: column_type for attr in attributes.values() for column_name, column_type in attr.get_sql_column_types().items()}
+            anon_column_types |= {sensitive_attr_name: column_types[sensitive_attr_name] for sensitive_attr_name in Config.sensitive_attr_names}
+
+            if Config.output_mode == "unique-sa-combinations":
+                anon_column_types["count"] = "BIGINT"
+
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s", 
+                (self.ANON_TABLE_NAME,)
+            )
+            existing_column_names = {column_name.lower() for (column_name,) in cursor.fetchall()}
+
+            if not existing_column_names:
+                cursor.execute(f"CREATE TABLE {self.ANON_TABLE_NAME} ({', '.join(f'{column_name} {column_type}' for column_name, column_type in anon_column_types.items())})")
+            elif existing_column_names != {column_name.lower() for column_name in anon_column_types}:
+                raise Exception(
+                    f"The existing table {self.ANON_TABLE_NAME} has the columns {sorted(existing_column_names)} instead of {sorted(anon_column_types)}, "
+                    "drop it or align it with the QIDs, the sensitive attributes and the output mode of the run"
+                )
+
+
+    def build_insert_select_query(self, partitions: list[Partition]) -> Tuple[str, list[str]]:
+        """ Copy the sensitive values of the partitions into the anonymized table on the server, next to the generalized QID values passed as parameters.
+        In the unique-sa-combinations output mode, the server groups the rows of each partition by the sensitive values and stores their count. """
+
+        qid_column_names = list(self.map_partition_to_mysql_anon_record(partitions[0]).keys())
+        sensitive_attr_names = ', '.join(Config.sensitive_attr_names)
+        grouped = Config.output_mode == "unique-sa-combinations"
+        selects: list[str] = []
+        params: list[str] = []
+
+        for partition in partitions:
             record_with_qids = self.map_partition_to_mysql_anon_record(partition)
 
-            anon_records_in_partition = []
+            select = f"SELECT {', '.join(['%s'] * len(qid_column_names))}, {sensitive_attr_names}"
+
+            if grouped:
+                select += f", COUNT(*) {self.map_partition_to_source(partition)} GROUP BY {sensitive_attr_names}"
+            else:
+                select += f" {self.map_partition_to_source(partition)}"
 
-            for sens_values_per_record in sensitive_values_in_partition:
-                anon_record = record_with_qids | {sensitive_attr_name: sens_values_per_record[i] for i, sensitive_attr_name in enumerate(Config.sensitive_attr_names)}
-                                
-                attr_names = ",".join(anon_record.keys())
-                attr_value_placeholders =  ",".join(["%s"] * len(anon_record.values()))
+            selects.append(select)
+            params += [record_with_qids[column_name] for column_name in qid_column_names]
 
-                anon_records_in_partition.append(tuple(anon_record.values()))
+        column_names = qid_column_names + Config.sensitive_attr_names + (["count"] if grouped else [])
 
-            yield attr_names, attr_value_placeholders, anon_records_in_partition
+        return f"INSERT INTO {self.ANON_TABLE_NAME} ({', '.join(column_names)}) {' UNION ALL '.join(selects)}", params
 
 
     def push_partitions(self, partitions: list[Partition]):
-        cursor = self.mysql_client.cursor()
+        """ Write the anonymized records with one INSERT ... SELECT per batch of partitions, without moving the rows through the client """
 
-        progress = tqdm.tqdm(unit="docs", total=Config.size_of_dataset)
-        successes = 0
+        assert Config.output_mode in ["individual", "unique-sa-combinations"], f"The {Config.output_mode} output mode does not fit into the columns of a table"
+
+        self.create_anon_table(partitions[0].attributes)
 
-        for (attr_names, attr_value_placeholders, anon_records) in self.generate_anonymized_docs(partitions):
-            query = f"INSERT INTO {self.ANON_TABLE_NAME} ({attr_names}) VALUES ({attr_value_placeholders})"
-            cursor.executemany(query, anon_records)
+        output_size = get_output_size()
+        progress = tqdm.tqdm(unit="docs", total=output_size)
+        successes = 0
 
-            progress.update(cursor.rowcount)
-            successes += cursor.rowcount
+        with self.get_cursor() as cursor:
+            for batch_start in range(0, len(partitions), self.UNION_BATCH_SIZE):
+                (query, params) = self.build_insert_select_query(partitions[batch_start:batch_start + self.UNION_BATCH_SIZE])
+                cursor.execute(query, params)
 
-        self.mysql_client.commit()        
+                progress.update(cursor.rowcount)
+                successes += cursor.rowcount
 
-        print(f"Inserted {successes}/{Config.size_of_dataset} records.")
\ No newline at end of file
+        print(f"Inserted {successes}/{output_size or '-'} records.")
@@ -0,0 +1,346 @@
+import csv
+import json
+
+from datetime import datetime, timezone
+from os import getenv
+from os.path import abspath, splitext
+
+from typing import Iterable, Tuple
+
+import numpy as np
+
+import tqdm
+
+from interfaces.datafly_api import DataflyAPI
+from interfaces.mondrian_api import MondrianAPI
+
+from models.attribute import Attribute, HierarchicalAttribute, get_code_field_name, get_ip_version, map_ip_to_int
+from models.config import Config
+from models.gentree import GenTree
+from models.numrange import NumRange
+from models.partition import Partition
+from models.split_statistics import SplitStatistics, create_split_statistics_from_histogram
+
+from utils.output_modes import generate_output_docs, get_output_size
+
+
+class NumpyConnector(MondrianAPI, DataflyAPI):
+    """ In-memory backend, that keeps every column of the dataset as a NumPy array and answers the queries with vectorized masks
+
+    The dataset can be passed in as a path to a CSV/JSONL file, as a pandas DataFrame or as a dict of column name -> array.
+    If no data is passed, the file under the DATASET_PATH environment variable is loaded.
+    """
+
+    def __init__(self, data = None, column_names: list[str] = None):
+        if data is None:
+            data = getenv('DATASET_PATH')
+
+        if column_names is None and getenv('DATASET_COLUMNS'):
+            column_names = getenv('DATASET_COLUMNS').split(',')
+
+        self.DATASET_NAME = data if isinstance(data, str) else "in-memory dataset"
+        # Identifies the data behind the results of the queries, in persistent caches
+        self.DATASET_ID = f"numpy:{abspath(data)}" if isinstance(data, str) else None
+        self.ANON_DATASET_PATH = getenv('ANON_DATASET_PATH') or (f"{splitext(data)[0]}_anonymized.jsonl" if isinstance(data, str) else "anonymized.jsonl")
+
+        self.raw_columns: dict[str, np.ndarray] = self.load_columns(data, column_names)
+        self.size = len(next(iter(self.raw_columns.values()))) if self.raw_columns else 0
+
+        # Typed columns are created on first use, as the attribute types are only known after the config is parsed
+        self.columns: dict[str, np.ndarray] = {}
+        # For hierarchical attributes, the column stores codes into the sorted array of the distinct values
+        self.categories: dict[str, np.ndarray] = {}
+        self.category_codes: dict[str, dict[str, int]] = {}
+
+
+    def load_columns(self, data, column_names: list[str] = None) -> dict[str, np.ndarray]:
+        if isinstance(data, str):
+            if data.endswith(".jsonl") or data.endswith(".json"):
+                with open(data) as data_file:
+                    rows = [json.loads(line) for line in data_file if line.strip()]
+
+                return {name: np.array([row.get(name) for row in rows], dtype=object) for name in rows[0].keys()} if rows else {}
+
+            with open(data, newline='') as data_file:
+                reader = csv.reader(data_file)
+                rows = [[value.strip() for value in row] for row in reader if row]
+
+            if column_names is None:
+                column_names, rows = rows[0], rows[1:]
+
+            return {name: np.array([row[i] for row in rows], dtype=object) for i, name in enumerate(column_names)}
+
+        # pandas DataFrame
+        if hasattr(data, "columns") and hasattr(data, "to_numpy"):
+            return {str(name): data[name].to_numpy() for name in data.columns}
+
+        return {name: np.asarray(values) for name, values in data.items()}
+
+
+    def get_column(self, attr_name: str) -> np.ndarray:
+        """ Return the typed column of the attribute, converting the raw values on first access """
+
+        if attr_name in self.columns:
+            return self.columns[attr_name]
+
+        raw = self.raw_columns[attr_name]
+        attr_type = Config.qids_config[attr_name]["type"] if attr_name in Config.qids_config else None
+
+        if attr_type == "numerical":
+            column = raw.astype(np.int64)
+        elif attr_type == "timestamp":
+            column = self.map_timestamps_to_ms(raw)
+        elif attr_type == "ip":
+            version = get_ip_version(attr_name)
+            # IPv6 addresses do not fit into 64 bits, they are kept as Python integers
+            column = np.array([map_ip_to_int(value, version) for value in raw], dtype=np.int64 if version == 4 else object)
+        elif attr_type == "hierarchical":
+            categories, codes = np.unique(raw.astype(str), return_inverse=True)
+            self.categories[attr_name] = categories
+            self.category_codes[attr_name] = {value: code for code, value in enumerate(categories.tolist())}
+            column = codes.astype(np.int32)
+        else:
+            column = raw
+
+        self.columns[attr_name] = column
+
+        return column
+
+
+    def add_ordinal_codes(self, attr_name: str, leaf_codes: dict[str, int]):
+        """ Translate the category codes of the column into the DFS-order codes of the leaves, -1 for values outside of the hierarchy """
+
+        category_codes_column = self.get_column(attr_name)
+        category_to_leaf_code = np.array([leaf_codes.get(value, -1) for value in self.categories[attr_name].tolist()], dtype=np.int32)
+
+        self.columns[get_code_field_name(attr_name)] = category_to_leaf_code[category_codes_column]
+
+
+    def map_timestamps_to_ms(self, raw: np.ndarray) -> np.ndarray:
+        try:
+            return raw.astype(np.int64)
+        except (TypeError, ValueError):
+            return np.array([self.map_iso_timestamp_to_ms(value) for value in raw], dtype=np.int64)
+
+
+    def map_iso_timestamp_to_ms(self, value: str) -> int:
+        """ Timestamps without a time zone are in UTC, as in Elasticsearch, not in the local time zone of the machine """
+
+        timestamp = datetime.fromisoformat(value)
+
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+
+        return int(timestamp.timestamp() * 1000)
+
+
+    def map_attribute_to_mask(self, attr: Attribute) -> np.ndarray:
+        column = self.get_column(attr.get_name())
+
+        if isinstance(attr, HierarchicalAttribute) and Config.ordinal_encoding:
+            (lo, hi) = attr.get_node().leaf_code_interval
+            code_column = self.columns[get_code_field_name(attr.get_name())]
+
+            return (code_column >= lo) & (code_column <= hi)
+
+        if isinstance(attr, HierarchicalAttribute):
+            category_codes = self.category_codes[attr.get_name()]
+            leaf_values = attr.get_node().get_leaf_node_values()
+            codes = [category_codes[value] for value in leaf_values if value in category_codes]
+
+            return np.isin(column, codes)
+
+        if attr.get_min_value() == attr.get_max_value():
+            return column == attr.get_min_value()
+
+        return (column >= attr.get_min_value()) & (column <= attr.get_max_value())
+
+
+    def map_attributes_to_mask(self, attributes: dict[str, Attribute]) -> np.ndarray:
+        mask = np.ones(self.size, dtype=bool)
+
+        if attributes is None:
+            return mask
+
+        for attr in attributes.values():
+            mask &= self.map_attribute_to_mask(attr)
+
+        return mask
+
+
+    def get_document_count(self, attributes: dict[str, Attribute] = None) -> int:
+        if attributes is None:
+            return self.size
+
+        return int(np.count_nonzero(self.map_attributes_to_mask(attributes)))
+
+
+    def get_attribute_min_max(self, attr_name: str, attributes: dict[str, Attribute] = None) -> Tuple[int,int]:
+        values = self.get_column(attr_name)[self.map_attributes_to_mask(attributes)]
+
+        return int(values.min()), int(values.max())
+
+
+# ------------------------------
+# >>    Mondrian API - BEGIN
+# ------------------------------
+
+    def get_value_to_split_at_and_next_unique_value(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        split_statistics = self.get_split_statistics(attr_name, partition)
+
+        if split_statistics is None:
+            return None, None
+
+        return split_statistics.value_to_split_at, split_statistics.next_unique_value
+
+
+    def get_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Split at the (lower) median of the exact histogram of the partition, as the other backends do """
+
+        values = self.get_column(attr_name)[self.map_attributes_to_mask(partition.attributes)]
+        unique_values, counts = np.unique(values, return_counts=True)
+
+        return create_split_statistics_from_histogram(list(zip(unique_values.tolist(), counts.tolist())))
+
+
+    def get_children_counts(self, attr_name: str, partition: Partition) -> list[int]:
+        """ Count the codes of the leaf values in the partition, and roll them up to the children of the hierarchy node """
+
+        node: GenTree = partition.attributes[attr_name].get_node()
+
+        codes = self.get_column(attr_name)[self.map_attributes_to_mask(partition.attributes)]
+        counts_per_code = np.bincount(codes, minlength=len(self.categories[attr_name]))
+
+        return node.roll_up_leaf_counts_to_children(dict(zip(self.categories[attr_name].tolist(), counts_per_code.tolist())))
+
+
+    def get_timestamp_histogram(self, attr_name: str, partition: Partition, interval: int) -> Tuple[list[Tuple[int, int]], int, int]:
+        values = self.get_column(attr_name)[self.map_attributes_to_mask(partition.attributes)]
+        bucket_starts, counts = np.unique((values // interval) * interval, return_counts=True)
+
+        return list(zip(bucket_starts.tolist(), counts.tolist())), int(values.min()), int(values.max())
+
+
+    def get_ip_min_max(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        values = self.get_column(attr_name)[self.map_attributes_to_mask(partition.attributes)]
+
+        return int(values.min()), int(values.max())
+
+
+    def get_ip_split_sides(self, attr_name: str, partition: Partition, split_address: int) -> Tuple[int, int, int, int]:
+        values = self.get_column(attr_name)[self.map_attributes_to_mask(partition.attributes)]
+        (left, right) = (values[values < split_address], values[values >= split_address])
+
+        return int(left.max()), len(left), int(right.min()), len(right)
+
+# ------------------------------
+# <<    Mondrian API - END
+# ------------------------------
+
+
+
+# ------------------------------
+# >>    DataFly API - BEGIN
+# ------------------------------
+
+    def spread_attribute_into_uniform_buckets(self, attr_name: str, num_of_buckets: int) -> list[NumRange]:
+        values = np.sort(self.get_column(attr_name))
+
+        interval_size = 100 / num_of_buckets
+        indices = [max(int(np.ceil(len(values) * interval_size * i / 100)) - 1, 0) for i in range(1, num_of_buckets + 1)]
+
+        bucket_upper_bounds = list(set(int(values[i]) for i in indices))
+        bucket_upper_bounds.sort()
+
+        min = int(values[0])
+
+        num_ranges: list[NumRange] = []
+
+        for i, bound in enumerate(bucket_upper_bounds):
+            if i == 0:
+                num_ranges.append(NumRange(min, bound))
+                continue
+
+            num_ranges.append(NumRange(bucket_upper_bounds[i-1] + 1, bound))
+
+        return num_ranges
+
+
+    def get_frequency_table(self, candidates: dict[str, list[Attribute]]) -> dict[Tuple[int, ...], int]:
+        """ Label every item with the index of its candidate value per attribute, -1 if none covers it, and count the distinct label combinations """
+
+        labels = np.zeros((self.size, len(candidates)), dtype=np.int32)
+
+        for column, attributes in enumerate(candidates.values()):
+            labels[:, column] = -1
+
+            for i, attr in enumerate(attributes):
+                labels[self.map_attribute_to_mask(attr), column] = i
+
+        cells, counts = np.unique(labels[(labels >= 0).all(axis=1)], axis=0, return_counts=True)
+
+        return {tuple(cell): count for cell, count in zip(cells.tolist(), counts.tolist())}
+
+# ------------------------------
+# <<    DataFly API - END
+# ------------------------------
+
+
+    def map_partition_to_anon_record(self, partition: Partition) -> dict[str, str]:
+        record: dict[str, str] = {}
+
+        for attr in partition.attributes.values():
+            record |= attr.map_to_sql_attribute()
+
+        return record
+
+
+    def generate_sensitive_values(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[tuple]]]:
+        for partition in partitions:
+            mask = self.map_attributes_to_mask(partition.attributes)
+
+            yield partition, zip(*[self.raw_columns[sensitive_attr_name][mask].tolist() for sensitive_attr_name in Config.sensitive_attr_names])
+
+
+    def get_sensitive_attr_types(self) -> dict[str, str]:
+        return {sensitive_attr_name: self.map_column_to_type(self.raw_columns[sensitive_attr_name]) for sensitive_attr_name in Config.sensitive_attr_names}
+
+
+    def map_column_to_type(self, column: np.ndarray) -> str:
+        """ The type of the NumPy column, or for the columns of Python objects (loaded from JSONL), the type shared by all of their values """
+
+        if column.dtype.kind in "iu":
+            return "integer"
+        if column.dtype.kind == "f":
+            return "float"
+        if column.dtype.kind == "b":
+            return "boolean"
+
+        value_types = set(type(value) for value in column.tolist() if value is not None)
+
+        if value_types and value_types <= {bool}:
+            return "boolean"
+        if value_types and value_types <= {int}:
+            return "integer"
+        if value_types and value_types <= {int, float}:
+            return "float"
+
+        return "string"
+
+
+    def generate_anonymized_docs(self, partitions: list[Partition]):
+        return generate_output_docs(self, partitions, self.map_partition_to_anon_record)
+
+
+    def push_partitions(self, partitions: list[Partition]):
+        output_size = get_output_size()
+        progress = tqdm.tqdm(unit="docs", total=output_size)
+        successes = 0
+
+        with open(self.ANON_DATASET_PATH, "w") as anon_file:
+            for anon_record in self.generate_anonymized_docs(partitions):
+                anon_file.write(json.dumps(anon_record, default=str) + "\n")
+                progress.update(1)
+                successes += 1
+
+        print(f"Written {successes}/{output_size or '-'} records to {self.ANON_DATASET_PATH}")
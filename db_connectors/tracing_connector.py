@@ -0,0 +1,97 @@
+import inspect
+import time
+
+from typing import Callable, Iterable
+
+from interfaces.abstract_api import AbstractAPI
+from interfaces.datafly_api import DataflyAPI
+from interfaces.mondrian_api import MondrianAPI
+
+from models.partition import Partition
+
+from utils.tracing import record_span
+
+
+# The public methods of the APIs, called by the algorithms, the config processor and the sinks
+TRACED_OPERATIONS = set(
+    name for api in [AbstractAPI, MondrianAPI, DataflyAPI] for name, member in vars(api).items() if callable(member) and not name.startswith("_")
+)
+
+
+class TracingConnector(object):
+    """ Wraps any connector and records a span for every call of the APIs: its latency, the number of items in the request,
+    and the depth in the partition tree and the number of items of the partitions it served, in the current phase of the run.
+
+    The calls the connector makes to itself are part of the span of the outer call. For the generators of the anonymized documents,
+    only the time spent inside the generator is recorded, not the time of the sink consuming them.
+    """
+
+    def __init__(self, db_connector: AbstractAPI):
+        self.db_connector = db_connector
+
+
+    def __getattr__(self, name: str):
+        member = getattr(self.db_connector, name)
+
+        if name not in TRACED_OPERATIONS:
+            return member
+
+        return self.trace(name, member)
+
+
+    def trace(self, operation: str, method: Callable) -> Callable:
+        def traced_method(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+
+            if inspect.isgenerator(result):
+                return self.trace_generator(operation, result, start, time.perf_counter() - start, self.describe_request(args))
+
+            record_span(operation, start, time.perf_counter(), args=self.describe_request(args))
+
+            return result
+
+        return traced_method
+
+
+    def trace_generator(self, operation: str, generator: Iterable, start: float, duration: float, request: dict):
+        try:
+            while True:
+                resume = time.perf_counter()
+
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    duration += time.perf_counter() - resume
+
+                yield item
+        finally:
+            record_span(operation, start, start + duration, args=request)
+
+
+    def describe_request(self, args: tuple) -> dict:
+        """ The size of the request is the length of its list argument, the partitions are the ones passed directly, or else the ones in the lists """
+
+        request_size = next((len(arg) for arg in args if isinstance(arg, list)), 1)
+        partitions = [arg for arg in args if isinstance(arg, Partition)]
+
+        if not partitions:
+            for arg in args:
+                if isinstance(arg, list):
+                    partitions += [item for item in arg if isinstance(item, Partition)]
+                    partitions += [member for item in arg if isinstance(item, tuple) for member in item if isinstance(member, Partition)]
+
+        description = {"request_size": request_size}
+
+        if partitions:
+            depths = [len(partition.path) for partition in partitions if hasattr(partition, "path")]
+            counts = [partition.count for partition in partitions if partition.count is not None]
+
+            description["partitions"] = len(partitions)
+            if depths:
+                description["max_depth"] = max(depths)
+            description["items"] = sum(counts)
+
+        return description
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 
-from typing import Tuple
+from collections import Counter
+
+from typing import Iterable, Tuple
 
 from models.attribute import Attribute
 from models.partition import Partition
@@ -18,3 +20,29 @@ class AbstractAPI(ABC):
     @abstractmethod
     def get_attribute_min_max(self, attr_name: str, attributes: dict[str, Attribute]) -> Tuple[int,int]:
         pass
+
+    def get_document_counts(self, attributes_per_partition: list[dict[str, Attribute]]) -> list[int]:
+        """ Count the documents of many partitions at once. Backends override this to batch the queries into fewer round trips. """
+
+        return [self.get_document_count(attributes) for attributes in attributes_per_partition]
+
+    @abstractmethod
+    def add_ordinal_codes(self, attr_name: str, leaf_codes: dict[str, int]):
+        """ Store the DFS-order code of the leaf value of every item in the shadow <attr_name>_code field, to filter hierarchical attributes with ranges """
+        pass
+
+    @abstractmethod
+    def generate_sensitive_values(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[tuple]]]:
+        """ Stream the values of the sensitive attributes of every item, partition by partition. The values of a partition must be consumed before the next one. """
+        pass
+
+    @abstractmethod
+    def get_sensitive_attr_types(self) -> dict[str, str]:
+        """ The types of the sensitive attributes in the backend, as "integer", "float", "boolean" or "string", for the typed output formats """
+        pass
+
+    def generate_sensitive_value_counts(self, partitions: list[Partition]) -> Iterable[Tuple[Partition, Iterable[Tuple[tuple, int]]]]:
+        """ Count the distinct combinations of the sensitive values per partition. Backends override this to count them without fetching every item. """
+
+        for (partition, sensitive_values) in self.generate_sensitive_values(partitions):
+            yield partition, Counter(sensitive_values).items()
@@ -0,0 +1,12 @@
+from abc import ABC, abstractmethod
+
+from interfaces.abstract_api import AbstractAPI
+from models.partition import Partition
+
+
+class AbstractSink(ABC):
+    """ Destination of the anonymized records, written after the partitioning is finished """
+
+    @abstractmethod
+    def write_partitions(self, db_connector: AbstractAPI, partitions: list[Partition]):
+        pass
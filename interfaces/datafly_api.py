@@ -1,3 +1,5 @@
+import itertools
+
 from abc import abstractmethod
 
 from typing import Tuple
@@ -15,4 +17,15 @@ class DataflyAPI(AbstractAPI):
         
     @abstractmethod
     def spread_attribute_into_uniform_buckets(self, attr_name: str, num_of_buckets: int) -> list[NumRange]:
-        pass
\ No newline at end of file
+        pass
+
+    def get_frequency_table(self, candidates: dict[str, list[Attribute]]) -> dict[Tuple[int, ...], int]:
+        """ Count the items in every cell of the Cartesian product of the candidate values of the attributes. A cell is keyed on the indices of its
+        values in the candidate lists, only the non-empty cells are returned. Backends override this to count all the cells with one aggregation. """
+
+        cells = list(itertools.product(*[range(len(attributes)) for attributes in candidates.values()]))
+        counts = self.get_document_counts([
+            {attr_name: candidates[attr_name][i] for attr_name, i in zip(candidates.keys(), cell)} for cell in cells
+        ])
+
+        return {cell: count for cell, count in zip(cells, counts) if count != 0}
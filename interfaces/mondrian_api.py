@@ -3,14 +3,156 @@ from abc import abstractmethod
 from typing import Tuple
 
 from models.partition import Partition
+from models.split_statistics import SplitStatistics, choose_timestamp_histogram_interval, create_split_statistics_at_ip_prefix, create_split_statistics_from_buckets, find_ip_split_address
 
 from interfaces.abstract_api import AbstractAPI
 
 
 class MondrianAPI(AbstractAPI):
+    # Upper bound on the number of buckets of the histograms used to split timestamps
+    TIMESTAMP_HISTOGRAM_MAX_BUCKETS = 1000
+
     def __init__(self):
         pass
 
     @abstractmethod
     def get_value_to_split_at_and_next_unique_value(self,  attr_name: str, partition: Partition) -> Tuple[int, int]:
-        pass
\ No newline at end of file
+        pass
+
+    def get_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Collect the split value, the limits and, where the backend can provide them, the child counts of a numerical split.
+        Returns None, if the partition cannot be split along the attribute. Backends override this to save round trips. """
+
+        (value_to_split_at, next_unique_value) = self.get_value_to_split_at_and_next_unique_value(attr_name, partition)
+        if value_to_split_at is None or next_unique_value is None:
+            return None
+
+        (min_value, max_value) = self.get_attribute_min_max(attr_name, partition.attributes)
+
+        return SplitStatistics(min_value, value_to_split_at, next_unique_value, max_value)
+
+    def get_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Collect the split statistics of many partitions at once. Backends override this to batch the queries into fewer round trips. """
+
+        return [self.get_split_statistics(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions]
+
+    def get_children_counts(self, attr_name: str, partition: Partition) -> list[int]:
+        """ Count the items of the partition under each child of the hierarchy node the partition is generalized to along the attribute, 
+        in the order of the children. Backends override this to count all children with one query. """
+
+        return [self.get_document_count(partition.attributes | {attr_name: attr}) for attr in partition.attributes[attr_name].split()]
+
+    def get_children_counts_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[list[int]]:
+        """ Collect the children counts of many partitions at once. Backends override this to batch the queries into fewer round trips. """
+
+        return [self.get_children_counts(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions]
+
+    @abstractmethod
+    def get_ip_min_max(self, attr_name: str, partition: Partition) -> Tuple[int, int]:
+        """ Return the smallest and the largest address of the partition as integers """
+        pass
+
+    def get_ip_min_max_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[Tuple[int, int]]:
+        """ Fetch the smallest and the largest address of many partitions at once. Backends override this to batch the queries into fewer round trips. """
+
+        return [self.get_ip_min_max(attr_name, partition) for (attr_name, partition) in attr_names_and_partitions]
+
+    @abstractmethod
+    def get_ip_split_sides(self, attr_name: str, partition: Partition, split_address: int) -> Tuple[int, int, int, int]:
+        """ Return the largest address and the count of the items below split_address, and the smallest address and the count of the rest """
+        pass
+
+    def get_ip_split_sides_batch(self, attr_names_partitions_and_split_addresses: list[Tuple[str, Partition, int]]) -> list[Tuple[int, int, int, int]]:
+        """ Fetch the sides of the splits of many partitions at once. Backends override this to batch the queries into fewer round trips. """
+
+        return [self.get_ip_split_sides(attr_name, partition, split_address) for (attr_name, partition, split_address) in attr_names_partitions_and_split_addresses]
+
+    def get_ip_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        """ Collect the limits and the counts of the split of an IP attribute at the first bit, in which the addresses of the partition differ,
+        with a second query for the addresses and the counts on each side of that bit """
+
+        (min_address, max_address) = self.get_ip_min_max(attr_name, partition)
+        split_address = find_ip_split_address(min_address, max_address)
+
+        if split_address is None:
+            return None
+
+        return create_split_statistics_at_ip_prefix(min_address, max_address, self.get_ip_split_sides(attr_name, partition, split_address))
+
+    def get_ip_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Collect the IP split statistics of many partitions in two batches, one for the smallest and the largest addresses, and one for the sides of the splits """
+
+        min_max_per_partition = self.get_ip_min_max_batch(attr_names_and_partitions)
+        split_addresses = [find_ip_split_address(min_address, max_address) for (min_address, max_address) in min_max_per_partition]
+
+        indices = [i for i, split_address in enumerate(split_addresses) if split_address is not None]
+        sides_per_partition = self.get_ip_split_sides_batch([(*attr_names_and_partitions[i], split_addresses[i]) for i in indices])
+
+        split_statistics_per_partition: list[SplitStatistics | None] = [None] * len(attr_names_and_partitions)
+
+        for i, sides in zip(indices, sides_per_partition):
+            split_statistics_per_partition[i] = create_split_statistics_at_ip_prefix(*min_max_per_partition[i], sides)
+
+        return split_statistics_per_partition
+
+    @abstractmethod
+    def get_timestamp_histogram(self, attr_name: str, partition: Partition, interval: int) -> Tuple[list[Tuple[int, int]], int, int]:
+        """ Count the items of the partition in buckets of interval ms, aligned to the epoch. Return the (bucket start, count) pairs 
+        of the non-empty buckets sorted by the start, along with the smallest and the largest timestamp of the partition. """
+        pass
+
+    def get_timestamp_histogram_batch(self, attr_names_partitions_and_intervals: list[Tuple[str, Partition, int]]) -> list[Tuple[list[Tuple[int, int]], int, int]]:
+        """ Fetch the timestamp histograms of many partitions at once. Backends override this to batch the queries into fewer round trips. """
+
+        return [self.get_timestamp_histogram(attr_name, partition, interval) for (attr_name, partition, interval) in attr_names_partitions_and_intervals]
+
+    def get_timestamp_split_statistics(self, attr_name: str, partition: Partition) -> SplitStatistics | None:
+        return self.get_timestamp_split_statistics_batch([(attr_name, partition)])[0]
+
+    def get_timestamp_split_statistics_batch(self, attr_names_and_partitions: list[Tuple[str, Partition]]) -> list[SplitStatistics | None]:
+        """ Split timestamps at a bucket boundary of one histogram per partition, with an interval adapted to the generalized range of the partition.
+        Only if all items fall into one bucket, as the items are much closer to each other than the range, is the histogram fetched again 
+        with the interval adapted to the actual smallest and largest timestamp. """
+
+        def fetch_split_statistics(attr_names_partitions_and_ranges: list[Tuple[str, Partition, int, int]]):
+            histograms = self.get_timestamp_histogram_batch([
+                (attr_name, partition, choose_timestamp_histogram_interval(min_value, max_value, self.TIMESTAMP_HISTOGRAM_MAX_BUCKETS))
+                for (attr_name, partition, min_value, max_value) in attr_names_partitions_and_ranges
+            ])
+
+            return [(create_split_statistics_from_buckets(buckets, min_value, max_value), min_value, max_value) for (buckets, min_value, max_value) in histograms]
+
+        results = fetch_split_statistics([
+            (attr_name, partition, partition.attributes[attr_name].get_min_value(), partition.attributes[attr_name].get_max_value())
+            for (attr_name, partition) in attr_names_and_partitions
+        ])
+
+        indices_to_refine = [i for i, (split_statistics, min_value, max_value) in enumerate(results) if split_statistics is None and min_value != max_value]
+        refined_results = fetch_split_statistics([(*attr_names_and_partitions[i], results[i][1], results[i][2]) for i in indices_to_refine])
+
+        for i, result in zip(indices_to_refine, refined_results):
+            results[i] = result
+
+        return [split_statistics for (split_statistics, _, _) in results]
+
+    def get_subpartition_counts(self, partition: Partition, attr_name: str, subpartitions: list[Partition]) -> list[int]:
+        """ Count the items of the subpartitions created by splitting the partition along the attribute """
+
+        return self.get_document_counts([subpartition.attributes for subpartition in subpartitions])
+
+    def get_subpartition_counts_batch(self, splits: list[Tuple[Partition, str, list[Partition]]]) -> list[list[int]]:
+        """ Count the items of the subpartitions of many splits at once, with one get_document_counts call by default """
+
+        counts = iter(self.get_document_counts([subpartition.attributes for (_, _, subpartitions) in splits for subpartition in subpartitions]))
+
+        return [[next(counts) for _ in subpartitions] for (_, _, subpartitions) in splits]
+
+    def label_partitions(self, partitions: list[Partition]):
+        """ Called with the partitions to start from, once they have their partition_id. Backends keeping the items labeled with the id of their partition override this. """
+
+        pass
+
+    def apply_splits(self, splits: list[Tuple[Partition, str, list[Partition]]]):
+        """ Called with the (partition, attribute name, subpartitions) of the accepted splits, once the subpartitions have their partition_id """
+
+        pass
@@ -9,9 +9,18 @@ from algorithms.mondrian.mondrian import Mondrian
 
 from interfaces.abstract_algorithm import AbstractAlgorithm
 from interfaces.abstract_api import AbstractAPI
+from interfaces.abstract_sink import AbstractSink
 
+from db_connectors.caching_connector import CachingConnector
 from db_connectors.es_connector import EsConnector
 from db_connectors.mysql_connector import MySQLConnector
+from db_connectors.numpy_connector import NumpyConnector
+from db_connectors.tracing_connector import TracingConnector
+
+from sinks.database_sink import DatabaseSink
+from sinks.file_sink import FileSink
+
+from utils.tracing import enable_tracing, export_chrome_trace, print_trace_summary
 
 import argparse
 
@@ -19,9 +28,46 @@ parser = argparse.ArgumentParser('Anonymization Module')
 parser.add_argument('--algorithm', type=str, default='mondrian',
                     help="K-Anonymity algorithm: mondrian / datafly (default: mondrian)")
 parser.add_argument('--backend', type=str, default='es',
-                    help="Backend to use: es / mysql (default: es)")
+                    help="Backend to use: es / mysql / numpy (default: es)")
 parser.add_argument('--config', type=str, default='adults_config.json',
                     help="Name of the config file: str (default: adults_config.json)")
+parser.add_argument('--execution', type=str, default='depth-first',
+                    help="Order in which Mondrian processes the partitions: depth-first / breadth-first (default: depth-first)")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Number of threads processing Mondrian partitions concurrently: int (default: 1)")
+parser.add_argument('--checkpoint', type=str, default=None,
+                    help="File to periodically save the Mondrian partition tree into: str (default: no checkpoints)")
+parser.add_argument('--checkpoint-interval', type=int, default=60,
+                    help="Seconds between two Mondrian checkpoints: int (default: 60)")
+parser.add_argument('--resume', action='store_true',
+                    help="Continue Mondrian from the partition tree in the --checkpoint file; a finished tree is pushed without partitioning again")
+parser.add_argument('--partition-tree-file', type=str, default=None,
+                    help="Export the Mondrian partition tree into a JSONL file, one node per line with the attributes it changed: str (default: no export)")
+parser.add_argument('--mysql-partition-labels', action='store_true',
+                    help="MySQL: copy the data into a working table, where every row is labeled with the id of its Mondrian partition, so that queries filter by the id alone")
+parser.add_argument('--es-server-side-push', action='store_true',
+                    help="ES: build the anonymized index inside the cluster, by tagging the documents with their partition and copying them with _reindex")
+parser.add_argument('--ordinal-encoding', action='store_true',
+                    help="Filter hierarchical attributes on the DFS-order codes of their leaves, written into a shadow <attr>_code field/column")
+parser.add_argument('--output-mode', type=str, default=None,
+                    help="Shape of the anonymized output: individual / unique-sa-combinations / sa-combination-arrays / sa-arrays (default: individual)")
+parser.add_argument('--output-file', type=str, default=None,
+                    help="Write the anonymized records into a local .parquet / .arrow / .jsonl file, instead of the backend: str (default: the backend)")
+parser.add_argument('--output-row-group-size', type=int, default=100000,
+                    help="Records per row group of the output file, bounding the memory used while writing: int (default: 100000)")
+parser.add_argument('--trace', type=str, default=None,
+                    help="Record every backend call, print the per-operation counts and p50/p99 latencies, and export the spans into a Chrome trace JSON file: str (default: no tracing)")
+parser.add_argument('--cache-size', type=int, default=0,
+                    help="Number of query results kept in an in-memory LRU cache in front of the backend: int (default: 0, no cache)")
+parser.add_argument('--cache-file', type=str, default=None,
+                    help="File persisting the cached query results across runs on the same snapshot of the data: str (default: no persistent cache)")
+
+
+TARGET_DATASET_ENV_VARS = {
+    "Elasticsearch": getenv('INDEX_NAME'),
+    "MySQL": getenv('MYSQL_TABLE_NAME'),
+    "NumPy": getenv('DATASET_PATH'),
+}
 
 
 def read_config(file_name: str) -> dict[str, int|dict]:
@@ -32,32 +78,69 @@ def read_config(file_name: str) -> dict[str, int|dict]:
     return config
         
 
-def wire_up(algorithm_name: str, db_type: str) -> AbstractAlgorithm:
+def wire_up(algorithm_name: str, db_type: str, args: dict) -> AbstractAlgorithm:
     assert algorithm_name in ["Datafly", "Mondrian"]
-    assert db_type in ["Elasticsearch", "MySQL"]
+    assert db_type in ["Elasticsearch", "MySQL", "NumPy"]
+
+    db_connector: AbstractAPI
+
+    if db_type == "Elasticsearch":
+        db_connector = EsConnector(connections_per_node=max(10, args.workers), server_side_push=args.es_server_side_push)
+    elif db_type == "MySQL":
+        db_connector = MySQLConnector(pool_size=args.workers, partition_labels=args.mysql_partition_labels)
+    else:
+        db_connector = NumpyConnector()
+
+    # Inside the cache, so that only the calls reaching the backend are traced
+    if args.trace is not None:
+        db_connector = TracingConnector(db_connector)
+
+    if args.cache_size > 0 or args.cache_file is not None:
+        db_connector = CachingConnector(db_connector, max_size=max(args.cache_size, 1), persistent_path=args.cache_file)
 
-    db_connector: AbstractAPI = EsConnector() if db_type == "Elasticsearch" else MySQLConnector()
+    sink: AbstractSink = DatabaseSink()
+
+    if args.output_file is not None:
+        sink = FileSink(args.output_file, row_group_size=args.output_row_group_size)
 
     if algorithm_name == "Datafly":
-        return Datafly(db_connector)        
+        return Datafly(db_connector, sink=sink)        
 
     if algorithm_name == "Mondrian":
-        return Mondrian(db_connector)        
+        return Mondrian(
+            db_connector, 
+            execution=args.execution, 
+            workers=args.workers, 
+            checkpoint_path=args.checkpoint, 
+            checkpoint_interval=args.checkpoint_interval, 
+            resume=args.resume,
+            sink=sink,
+            partition_tree_path=args.partition_tree_file
+        )
 
 
 def main(args: dict):
     config_file_path = f"configs/{args.config}"
-    db_backend = "Elasticsearch" if args.backend == "es" else "MySQL"
+    db_backend = {"es": "Elasticsearch", "mysql": "MySQL", "numpy": "NumPy"}[args.backend]
     algorithm_name = "Mondrian" if args.algorithm == "mondrian" else "Datafly"
 
-    algorithm = wire_up(algorithm_name, db_backend)
+    if args.trace is not None:
+        enable_tracing()
+
+    algorithm = wire_up(algorithm_name, db_backend, args)
 
     config = read_config(config_file_path)
 
+    if args.ordinal_encoding:
+        config["ordinal_encoding"] = True
+
+    if args.output_mode is not None:
+        config["output_mode"] = args.output_mode
+
     start_time = time.time()
 
     print(f"""Running anonymization
-    - target dataset: {getenv('MYSQL_TABLE_NAME') if db_backend == "MySQL" else getenv('INDEX_NAME')}
+    - target dataset: {TARGET_DATASET_ENV_VARS[db_backend]}
     - database: {db_backend}
     - config file: {config_file_path}
     - algorithm: {algorithm_name}
@@ -72,6 +155,16 @@ def main(args: dict):
     print("NCP %0.2f" % ncp + "%")
     print("Run for %0.2f" % exec_time + " seconds")
 
+    if isinstance(algorithm.db_connector, CachingConnector):
+        cache_statistics = algorithm.db_connector.get_cache_statistics()
+        print(f"Cache hits {cache_statistics['hits']}, misses {cache_statistics['misses']}")
+        algorithm.db_connector.close()
+
+    if args.trace is not None:
+        print_trace_summary()
+        export_chrome_trace(args.trace)
+        print(f"Trace written to {args.trace}")
+
 
 if __name__ == '__main__':
     args = parser.parse_args()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_address, ip_network
 
 from models.config import Config
 from models.gentree import GenTree
@@ -10,28 +11,24 @@ from models.gentree import GenTree
 class Attribute(ABC):
     """ Class representing the metadata about one attribute in the partition
 
+    The subclasses store the generalized value in its compact form: the integer bounds of a range, or the node of a hierarchy.
+    The string form is only created on output, by get_gen_value.
+
     Attributes        
-        width                           for categorical attributes stores the number of leaf node, for numerical attribute stores the number range
-        gen_value                       the current state of the generalization
+        name                            the name of the attribute
         split_allowed                   0 if the partition cannot be split further along the attribute, 1 otherwise        
     """    
 
-    def __init__(self, name: str, width: int, gen_value: str, split_allowed: bool = True):        
+    __slots__ = ("name", "split_allowed")
+
+    def __init__(self, name: str, split_allowed: bool = True):        
         self.name = name
-        self.width = width
-        self.gen_value = gen_value        
         self.split_allowed = split_allowed
 
 
     def get_name(self):
         return self.name
 
-    def get_width(self):
-        return self.width
-
-    def get_gen_value(self):
-        return self.gen_value
-
     def get_split_allowed(self):
         return self.split_allowed
 
@@ -39,6 +36,16 @@ class Attribute(ABC):
         return self.get_width() * 1.0 / len(Config.attr_metadata[self.get_name()])
     
 
+    @abstractmethod
+    def get_width(self) -> int:
+        """ For categorical attributes the number of leaf nodes, for numerical attributes the number range """
+        pass
+
+    @abstractmethod
+    def get_gen_value(self) -> str:
+        """ The string form of the current state of the generalization """
+        pass
+
     @abstractmethod
     def split(self) -> list[Attribute]:
         pass
@@ -63,31 +70,57 @@ class Attribute(ABC):
     def get_es_property_mapping(self) -> dict:
         pass
 
+    @abstractmethod
+    def get_sql_column_types(self) -> dict[str, str]:
+        """ Types of the columns produced by map_to_sql_attribute """
+        pass
+
+
+class HierarchicalAttribute(Attribute):
+    """ The generalized value is a node of the hierarchy tree of the attribute """
+
+    __slots__ = ("node",)
+
+    def __init__(self, name: str, node: GenTree, split_allowed: bool = True):
+        super().__init__(name, split_allowed)
+        self.node = node
+
+
+    def get_node(self) -> GenTree:
+        return self.node
+
+    def get_width(self) -> int:
+        return len(self.node)
+
+    def get_gen_value(self) -> str:
+        return self.node.value
+
 
-class HierarchicalAttribute(Attribute):        
     def split(self) -> list[HierarchicalAttribute]:
-        node_to_split_at: GenTree = Config.attr_metadata[self.get_name()].node(self.get_gen_value())
-        
         return [
             HierarchicalAttribute(
                 name=self.get_name(),
-                width=len(child),
-                gen_value=child.value,
+                node=child,
                 split_allowed=bool(len(child.children))
                 ) 
-            for child in node_to_split_at.children
+            for child in self.node.children
         ]
 
 
     def map_to_es_query(self) -> dict:
-        current_node = Config.attr_metadata[self.get_name()].node(self.gen_value)                
+        if Config.ordinal_encoding:
+            (lo, hi) = self.node.leaf_code_interval
+            return {"range": {get_code_field_name(self.get_name()): {"gte": lo, "lte": hi}}}
 
-        return {"terms": {f"{self.get_name()}": current_node.get_leaf_node_values()}}
+        return {"terms": {f"{self.get_name()}": self.node.get_leaf_node_values()}}
 
 
     def map_to_sql_query(self) -> str:
-        current_node = Config.attr_metadata[self.get_name()].node(self.get_gen_value())
-        leaf_values_as_str = ",".join([f"'{s}'" for s in current_node.get_leaf_node_values()])
+        if Config.ordinal_encoding:
+            (lo, hi) = self.node.leaf_code_interval
+            return f"({get_code_field_name(self.get_name())} BETWEEN {lo} AND {hi})"
+
+        leaf_values_as_str = ",".join([f"'{s}'" for s in self.node.get_leaf_node_values()])
         return f"{self.get_name()} IN ({leaf_values_as_str})"
     
 
@@ -95,10 +128,12 @@ class HierarchicalAttribute(Attribute):
         return {"type": "keyword"}
     
 
-    def map_to_es_attribute(self):
-        current_node = Config.attr_metadata[self.get_name()].node(self.get_gen_value())
+    def get_sql_column_types(self) -> dict[str, str]:
+        return {self.get_name(): "VARCHAR(255)"}
+    
 
-        return current_node.get_leaf_node_values()
+    def map_to_es_attribute(self):
+        return self.node.get_leaf_node_values()
     
 
     def map_to_sql_attribute(self) -> dict:
@@ -108,146 +143,213 @@ class HierarchicalAttribute(Attribute):
 
 
 class RangeAttribute(Attribute):
-    def set_limits(self, limits: list[str]):
+    """ The generalized value is the closed range of the integers min_value and max_value """
+
+    __slots__ = ("min_value", "max_value", "limits")
+
+    def __init__(self, name: str, min_value: int, max_value: int, split_allowed: bool = True):
+        super().__init__(name, split_allowed)
+        # The backends might return NumPy or Decimal numbers
+        self.min_value = int(min_value)
+        self.max_value = int(max_value)
+        self.limits: list[tuple[int, int]] = None
+
+
+    def get_min_value(self) -> int:
+        return self.min_value
+
+    def get_max_value(self) -> int:
+        return self.max_value
+
+    def get_width(self) -> int:
+        return self.max_value - self.min_value
+
+    def get_gen_value(self) -> str:
+        # If this is not a range ('20,30') any more, but a concrete number (20), the string is simply the number
+        return f"{self.min_value},{self.max_value}" if self.min_value != self.max_value else str(self.min_value)
+
+
+    def set_limits(self, limits: list[tuple[int, int]]):
         self.limits = limits
 
     def split(self) -> list[RangeAttribute]:
-        return [
-            (
-                self.get_name(), 
-                new_max - new_min, 
-                f"{new_min},{new_max}" if new_min != new_max else str(new_min), 
-                new_min != new_max
-            ) 
-            for (new_min, new_max) in self.limits
-        ]
+        return [type(self)(self.get_name(), new_min, new_max, new_min != new_max) for (new_min, new_max) in self.limits]
     
     
     def map_to_es_query(self) -> dict:
-        range_min_and_max = self.get_gen_value().split(',')
-        # If this is not a range ('20,30') any more, but a concrete number (20), simply return the number
-        if len(range_min_and_max) <= 1:                    
-            return {"term": {self.get_name(): range_min_and_max[0]}}
+        if self.min_value == self.max_value:
+            return {"term": {self.get_name(): self.min_value}}
         else:
-            return {"range": { self.get_name(): { "gte": range_min_and_max[0], "lte": range_min_and_max[1]}}}
+            return {"range": { self.get_name(): { "gte": self.min_value, "lte": self.max_value}}}
     
 
     def map_to_sql_query(self) -> str:
-        range_min_and_max = self.get_gen_value().split(',')
-        
-        if len(range_min_and_max) <= 1:
-            return f"{self.get_name()} = {range_min_and_max[0]}"              
+        if self.min_value == self.max_value:
+            return f"{self.get_name()} = {self.min_value}"              
         else:
-            return f"({self.get_name()} >= {range_min_and_max[0]} AND {self.get_name()} <= {range_min_and_max[1]})"
+            return f"({self.get_name()} >= {self.min_value} AND {self.get_name()} <= {self.max_value})"
     
     
     def map_to_es_attribute(self):
-        min_max = self.get_gen_value().split(",")
-
-        return {
-            "gte": min_max[0],
-            "lte": min_max[1] if len(min_max) > 1 else min_max[0]
-        }
+        return {"gte": self.min_value, "lte": self.max_value}
     
 
     def map_to_sql_attribute(self) -> dict:
-        min_max = self.get_gen_value().split(",")
+        return {f"{self.get_name()}_from": self.min_value, f"{self.get_name()}_to": self.max_value}
+    
 
-        return {
-            f"{self.get_name()}_from": min_max[0],
-            f"{self.get_name()}_to": min_max[1] if len(min_max) > 1 else min_max[0]
-        }
+    def get_sql_column_types(self) -> dict[str, str]:
+        return {f"{self.get_name()}_from": "BIGINT", f"{self.get_name()}_to": "BIGINT"}
     
 
 class IntegerAttribute(RangeAttribute):
+    __slots__ = ()
+
     def get_es_property_mapping(self):
         return {"type": "integer_range"}
     
-    def split(self) -> list[IntegerAttribute]:
-        return [
-            IntegerAttribute(
-                name=attr_val_tuple[0], 
-                width=attr_val_tuple[1], 
-                gen_value=attr_val_tuple[2], 
-                split_allowed=attr_val_tuple[3]) 
-            for attr_val_tuple in super().split()]
-    
 
 class DateAttribute(RangeAttribute):
+    __slots__ = ()
+
     def get_es_property_mapping(self):
         return {"type": "date_range"}
     
-    def split(self) -> list[DateAttribute]:
-        return [
-            DateAttribute(
-                name=attr_val_tuple[0], 
-                width=attr_val_tuple[1], 
-                gen_value=attr_val_tuple[2], 
-                split_allowed=attr_val_tuple[3]) 
-            for attr_val_tuple in super().split()]
-    
 
 class TimestampInMsAttribute(DateAttribute):
-    def __init__(self, name: str, width: int, gen_value: str, split_allowed: bool = True):
-        self.num_attr = IntegerAttribute(name, width, gen_value, split_allowed)        
+    """ Dates stored as the number of milliseconds since the epoch """
 
-    def get_name(self):
-        return self.num_attr.get_name()
+    __slots__ = ()
+    
 
-    def get_width(self):
-        return self.num_attr.get_width()
 
-    def get_gen_value(self):
-        return self.num_attr.get_gen_value()
+class IpAttribute(RangeAttribute):
+    """ The generalized value is a network in CIDR notation, stored as the integers of its first and last address and the length of its prefix.
+    IPv6 networks are used, if the config of the attribute sets "ip_version": 6 """
 
-    def get_split_allowed(self):
-        return self.num_attr.get_split_allowed()
+    __slots__ = ("mask", "version")
+
+    def __init__(self, name: str, split_allowed: bool = True, network_address: int = 0, mask: int = 0, version: int = 4):
+        self.version = version
+        self.mask = mask
+
+        super().__init__(name, network_address, network_address + 2 ** (self.get_bits() - mask) - 1, split_allowed and mask < self.get_bits())
+
+
+    def get_bits(self) -> int:
+        return 32 if self.version == 4 else 128
+
+    def get_first_address(self) -> int:
+        return self.min_value
     
-    def set_limits(self, limits):
-        self.num_attr.set_limits(limits)
+    def get_last_address(self) -> int:
+        return self.max_value
 
-    def split(self) -> list[TimestampInMsAttribute]:
-        return [
-            TimestampInMsAttribute(
-                name=attr.get_name(), 
-                width=attr.get_width(), 
-                gen_value=attr.get_gen_value(), 
-                split_allowed=attr.get_split_allowed()) 
-            for attr in self.num_attr.split()]
+    def get_gen_value(self) -> str:
+        return str((IPv4Network if self.version == 4 else IPv6Network)((self.min_value, self.mask)))
     
 
+    def get_normalized_width(self) -> float:
+        # The number of IPv6 addresses does not fit into len()
+        return self.get_width() / (2 ** self.get_bits() - 1)
 
-class IpAttribute(RangeAttribute):
 
-    def __init__(self, name: str, split_allowed: bool = True, segments: list[int] = [0, 0, 0, 0], mask: int = 0):        
-        super().__init__(name, 1, f"{segments[0]}.{segments[1]}.{segments[2]}.{segments[3]}/{mask}", split_allowed)
-        self.ip_segments = segments
-        self.mask = mask
+    def split(self) -> list[IpAttribute]:
+        """ Without limits, halve the network by extending the mask with one bit. The limits set from the split statistics are the smallest and the largest 
+        address on each side of the first bit in which the addresses of the partition differ, every subpartition gets the longest prefix covering its limits. """
 
+        limits = self.limits
 
-    def split(self) -> list[Attribute]:
-        index_of_segment_change = int(self.mask / 8)
-        index_of_bit_in_segment_to_change = 7 - (self.mask % 8)
+        if limits is None:
+            half = 2 ** (self.get_bits() - self.mask - 1)
+            limits = [(self.get_first_address(), self.get_first_address() + half - 1), (self.get_first_address() + half, self.get_last_address())]
 
-        newly_split_segments = [
-            self.ip_segments.copy(),
-            [s if i != index_of_segment_change else s + pow(2, index_of_bit_in_segment_to_change) for (i, s) in enumerate(self.ip_segments)]
-        ]
+        subnets: list[IpAttribute] = []
 
-        return [
-            IpAttribute(
-                name=self.get_name(),                
-                split_allowed=(self.mask != 31),
-                segments=new_s,
-                mask = self.mask+1
-                )
-            for new_s in newly_split_segments
-        ]
+        for (first_address, last_address) in limits:
+            host_bits = (first_address ^ last_address).bit_length()
+
+            subnets.append(IpAttribute(
+                name=self.get_name(),
+                network_address=(first_address >> host_bits) << host_bits,
+                mask=self.get_bits() - host_bits,
+                version=self.version
+            ))
+
+        return subnets
+    
+
+    def map_to_es_query(self) -> dict:
+        return {"term": {self.get_name(): self.get_gen_value()}}
+    
+
+    def map_to_sql_query(self) -> str:
+        if self.version == 4:
+            return f"(INET_ATON({self.get_name()}) BETWEEN {self.get_first_address()} AND {self.get_last_address()})"
+
+        return f"(INET6_ATON({self.get_name()}) BETWEEN UNHEX('{self.get_first_address():032x}') AND UNHEX('{self.get_last_address():032x}'))"
     
 
     def get_es_property_mapping(self):
         return {"type": "ip_range"}
     
 
+    def get_sql_column_types(self) -> dict[str, str]:
+        # The network in CIDR notation
+        return {f"{self.get_name()}_from": "VARCHAR(49)", f"{self.get_name()}_to": "VARCHAR(49)"}
+    
+
     def map_to_es_attribute(self):
-        return self.get_gen_value()
\ No newline at end of file
+        return self.get_gen_value()
+
+
+    def map_to_sql_attribute(self) -> dict:
+        network = self.get_gen_value()
+
+        return {f"{self.get_name()}_from": network, f"{self.get_name()}_to": network}
+
+
+def get_ip_version(attr_name: str) -> int:
+    return Config.qids_config[attr_name].get("ip_version", 4)
+
+
+def map_ip_to_int(ip: str, version: int) -> int:
+    """ IPv4 addresses are mapped into the IPv6 space (::ffff:a.b.c.d), if the attribute holds IPv6 addresses """
+
+    address = ip_address(ip)
+
+    if version == 6 and address.version == 4:
+        address = IPv6Address(f"::ffff:{address}")
+
+    return int(address)
+
+
+def map_int_to_ip(address: int, version: int) -> str:
+    return str(IPv4Address(address) if version == 4 else IPv6Address(address))
+
+
+def get_code_field_name(attr_name: str) -> str:
+    """ Name of the shadow field/column storing the DFS-order leaf codes of a hierarchical attribute """
+
+    return f"{attr_name}_code"
+
+
+def create_attribute(attr_name: str, gen_value: str, split_allowed: bool = True) -> Attribute:
+    """ Create an attribute of the type given in the config, from the string form of its generalized value """
+
+    attr_type = Config.qids_config[attr_name]["type"]
+
+    if attr_type == "hierarchical":
+        return HierarchicalAttribute(attr_name, Config.attr_metadata[attr_name].node(gen_value), split_allowed)
+
+    if attr_type == "ip":
+        network = ip_network(gen_value)
+        return IpAttribute(attr_name, split_allowed, int(network.network_address), network.prefixlen, network.version)
+
+    range_min_and_max = gen_value.split(",")
+    (min_value, max_value) = (int(range_min_and_max[0]), int(range_min_and_max[-1]))
+
+    if attr_type == "timestamp":
+        return TimestampInMsAttribute(attr_name, min_value, max_value, split_allowed)
+
+    return IntegerAttribute(attr_name, min_value, max_value, split_allowed)
@@ -14,6 +14,8 @@ class Config(object):
         gen_hiers                           parsed generalization hierarchies
         attr_metadata                       metadata about all quasi-identifier attributes
         size_of_dataset                     size of the entire, original dataset
+        ordinal_encoding                    if True, hierarchical attributes are filtered on the DFS-order codes of their leaves, stored in a shadow <attr>_code field
+        output_mode                         shape of the anonymized output: individual / unique-sa-combinations / sa-combination-arrays / sa-arrays
     """
         
     k: int
@@ -27,4 +29,8 @@ class Config(object):
     gen_hiers: dict[str, GenTree]
     attr_metadata: dict[str, NumRange|GenTree]
 
-    size_of_dataset: int    
\ No newline at end of file
+    size_of_dataset: int
+
+    ordinal_encoding: bool = False
+    output_mode: str = "individual"
+    
\ No newline at end of file
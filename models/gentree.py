@@ -11,6 +11,8 @@ class GenTree(object):
         parent             ancestor node list
         children           direct successor node list
         covered_nodes      all nodes covered by current node
+        leaf_code_interval the [lo, hi] interval of the DFS-order codes of the leaves covered by the node, set by assign_leaf_codes
+        leaf_values        the values of the leaves covered by the node, in DFS order, set by assign_leaf_codes
     """
 
     def __init__(self, value: str = None, parent: GenTree = None, is_leaf=False):
@@ -20,6 +22,8 @@ class GenTree(object):
         self.ancestors: list[GenTree] = []
         self.children: list[GenTree] = []
         self.covered_nodes: dict[str, GenTree] = {}
+        self.leaf_code_interval: tuple[int, int] | None = None
+        self.leaf_values: list[str] | None = None
 
         if value is not None:
             self.value = value
@@ -67,8 +71,50 @@ class GenTree(object):
     
 
     def get_leaf_node_values(self):
+        if self.leaf_values is not None:
+            return self.leaf_values
+
         return [node.value for node in filter(lambda node: not node.children, self.covered_nodes.values())]        
     
 
+    def assign_leaf_codes(self, first_code: int = 0) -> int:
+        """ Number the leaves in DFS order, so that the leaves covered by any node get the contiguous interval of codes [lo, hi].
+        Called on the root, once the tree is built. Returns the code following the last leaf of the subtree. """
+
+        if not self.children:
+            self.leaf_code_interval = (first_code, first_code)
+            self.leaf_values = [self.value]
+
+            return first_code + 1
+
+        next_code = first_code
+        for child in self.children:
+            next_code = child.assign_leaf_codes(next_code)
+
+        self.leaf_code_interval = (first_code, next_code - 1)
+        self.leaf_values = [leaf_value for child in self.children for leaf_value in child.leaf_values]
+
+        return next_code
+    
+
+    def get_leaf_codes(self) -> dict[str, int]:
+        """ Map the value of every leaf covered by the node to its DFS-order code """
+
+        return {node.value: node.leaf_code_interval[0] for node in self.covered_nodes.values() if not node.children}
+    
+
+    def roll_up_leaf_counts_to_children(self, leaf_counts: dict[str, int]) -> list[int]:
+        """ Sum the counts of the leaf values under each direct child of the node, in the order of the children """
+
+        leaf_value_to_child_index = {leaf_value: i for i, child in enumerate(self.children) for leaf_value in child.get_leaf_node_values()}
+        children_counts = [0] * len(self.children)
+
+        for leaf_value, count in leaf_counts.items():
+            if leaf_value in leaf_value_to_child_index:
+                children_counts[leaf_value_to_child_index[leaf_value]] += count
+
+        return children_counts
+    
+
     def __len__(self):
         return self.num_of_leaves
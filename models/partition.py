@@ -11,6 +11,8 @@ class Partition(object):
         attributes                          key-value pair, where the key is the attribute name and the value is the state of attribute in the current anonymization process
     """            
 
+    __slots__ = ("count", "attributes")
+
     def __init__(self, count: int, attributes: dict[str, Attribute]):        
         self.count = count
         self.attributes = attributes
@@ -0,0 +1,126 @@
+import math
+
+
+# Widths of the timestamp histogram buckets, aligned to round units of time
+TIMESTAMP_HISTOGRAM_INTERVALS_IN_MS = [
+    1, 10, 100, 
+    1000, 10 * 1000, 
+    60 * 1000, 10 * 60 * 1000, 
+    60 * 60 * 1000, 6 * 60 * 60 * 1000, 
+    24 * 60 * 60 * 1000, 7 * 24 * 60 * 60 * 1000, 30 * 24 * 60 * 60 * 1000, 365 * 24 * 60 * 60 * 1000
+]
+
+
+class SplitStatistics(object):
+    """ Class storing everything needed to split a partition in two along a numerical attribute
+
+    Attributes
+        min_value                   the smallest value of the attribute in the partition
+        value_to_split_at           the largest value that goes into the left subpartition
+        next_unique_value           the smallest value that goes into the right subpartition
+        max_value                   the largest value of the attribute in the partition
+        left_count                  the number of items in the left subpartition, None if not known
+        right_count                 the number of items in the right subpartition, None if not known
+    """
+
+    def __init__(self, min_value: int, value_to_split_at: int, next_unique_value: int, max_value: int, left_count: int = None, right_count: int = None):
+        self.min_value = min_value
+        self.value_to_split_at = value_to_split_at
+        self.next_unique_value = next_unique_value
+        self.max_value = max_value
+        self.left_count = left_count
+        self.right_count = right_count
+
+    def get_limits(self) -> list[tuple[int, int]]:
+        return [(self.min_value, self.value_to_split_at), (self.next_unique_value, self.max_value)]
+
+    def get_counts(self) -> list[int] | None:
+        if self.left_count is None or self.right_count is None:
+            return None
+
+        return [self.left_count, self.right_count]
+
+
+def create_split_statistics_around_median(median: int, min_value: int, max_value: int, below_count: int, below_max: int, at_count: int, above_count: int, above_min: int) -> SplitStatistics | None:
+    """ Values equal to the median go to the left subpartition, unless nothing would remain on the right.
+    Returns None, if all values of the partition fall into the same one of the three groups. """
+
+    if sum(count > 0 for count in (below_count, at_count, above_count)) < 2:
+        return None
+
+    if above_count:
+        return SplitStatistics(min_value, median if at_count else below_max, above_min, max_value, below_count + at_count, above_count)
+
+    return SplitStatistics(min_value, below_max, median, max_value, below_count, at_count)
+
+
+def create_split_statistics_from_histogram(histogram: list[tuple[int, int]]) -> SplitStatistics | None:
+    """ Split at the exact (lower) median of a histogram of (value, count) pairs, sorted by value. The next unique value opens the right subpartition, 
+    unless the median is the largest value, in which case the split happens right before it. Returns None, if there is only one unique value. """
+
+    if len(histogram) < 2:
+        return None
+
+    total_count = sum(count for (_, count) in histogram)
+    median_position = (total_count - 1) // 2
+
+    cumulative_count = 0
+    for median_index, (_, count) in enumerate(histogram):
+        cumulative_count += count
+        if cumulative_count > median_position:
+            break
+
+    split_index = median_index if median_index < len(histogram) - 1 else median_index - 1
+    left_count = sum(count for (_, count) in histogram[:split_index + 1])
+
+    return SplitStatistics(histogram[0][0], histogram[split_index][0], histogram[split_index + 1][0], histogram[-1][0], left_count, total_count - left_count)
+
+
+def find_ip_split_address(min_address: int, max_address: int) -> int | None:
+    """ The first address of the right side of the split at the first bit, in which the smallest and the largest address of the partition differ, 
+    skipping the shorter prefixes along which one side would be empty. Returns None, if the partition has a single address. """
+
+    if min_address == max_address:
+        return None
+
+    differing_bit = (min_address ^ max_address).bit_length() - 1
+
+    return (max_address >> differing_bit) << differing_bit
+
+
+def create_split_statistics_at_ip_prefix(min_address: int, max_address: int, sides: tuple[int, int, int, int]) -> SplitStatistics:
+    """ The limits of each side are its own smallest and largest address, given the (largest address, count) of the left side 
+    and the (smallest address, count) of the right side, so that each subpartition gets the longest prefix covering its addresses """
+
+    (left_max_address, left_count, right_min_address, right_count) = sides
+
+    return SplitStatistics(min_address, left_max_address, right_min_address, max_address, left_count, right_count)
+
+
+def choose_timestamp_histogram_interval(min_value: int, max_value: int, max_buckets: int) -> int:
+    """ Return the smallest round interval in ms, with which the range is covered by at most max_buckets buckets """
+
+    for interval in TIMESTAMP_HISTOGRAM_INTERVALS_IN_MS:
+        if (max_value - min_value) // interval < max_buckets:
+            return interval
+
+    return TIMESTAMP_HISTOGRAM_INTERVALS_IN_MS[-1] * math.ceil((max_value - min_value) / (TIMESTAMP_HISTOGRAM_INTERVALS_IN_MS[-1] * max_buckets))
+
+
+def create_split_statistics_from_buckets(buckets: list[tuple[int, int]], min_value: int, max_value: int) -> SplitStatistics | None:
+    """ Split at the boundary of the bucket containing the (lower) median, given the (bucket start, count) pairs of the non-empty buckets, sorted by the start.
+    The limits keep the smallest and the largest value of the partition. Returns None, if all items fall into one bucket. """
+
+    split_at_bucket = create_split_statistics_from_histogram(buckets)
+
+    if split_at_bucket is None:
+        return None
+
+    return SplitStatistics(
+        min_value, 
+        split_at_bucket.next_unique_value - 1, 
+        split_at_bucket.next_unique_value, 
+        max_value, 
+        split_at_bucket.left_count, 
+        split_at_bucket.right_count
+    )
@@ -0,0 +1,10 @@
+from interfaces.abstract_api import AbstractAPI
+from interfaces.abstract_sink import AbstractSink
+from models.partition import Partition
+
+
+class DatabaseSink(AbstractSink):
+    """ Writes the anonymized records back into the backend: the _anonymized index, table or JSONL file next to the original data """
+
+    def write_partitions(self, db_connector: AbstractAPI, partitions: list[Partition]):
+        return db_connector.push_partitions(partitions)
@@ -0,0 +1,193 @@
+import json
+
+from os.path import splitext
+
+from typing import Iterable
+
+import tqdm
+
+from interfaces.abstract_api import AbstractAPI
+from interfaces.abstract_sink import AbstractSink
+from models.config import Config
+from models.partition import Partition
+
+from utils.output_modes import generate_output_docs, get_output_size
+
+
+class FileSink(AbstractSink):
+    """ Streams the anonymized records into a local Parquet, Arrow IPC or JSONL file
+
+    The format is chosen by the extension of the path, unless it is passed explicitly. Parquet and Arrow need pyarrow, which is only imported
+    if one of them is used. The generalized QID columns are dictionary-encoded, as all records of a partition share their values.
+    The types of the sensitive columns are the ones reported by the backend. At most row_group_size records are kept in memory, 
+    every full buffer is written as one row group (Parquet) or record batch (Arrow).
+    """
+
+    FORMATS_BY_EXTENSION = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".jsonl": "jsonl", ".json": "jsonl"}
+
+    def __init__(self, path: str, file_format: str = None, row_group_size: int = 100000):
+        self.path = path
+        self.file_format = file_format or self.FORMATS_BY_EXTENSION.get(splitext(path)[1].lower())
+        self.row_group_size = row_group_size
+
+        assert self.file_format in ["parquet", "arrow", "jsonl"], f"Unknown output format of {path}"
+
+
+    def map_partition_to_record(self, partition: Partition) -> dict[str, str | int]:
+        """ The flat record of the generalized QID values, in the columns of map_to_sql_attribute, the bounds of ranges as integers """
+
+        record: dict[str, str | int] = {}
+
+        for attr in partition.attributes.values():
+            column_types = attr.get_sql_column_types()
+
+            for column_name, value in attr.map_to_sql_attribute().items():
+                record[column_name] = int(value) if column_types[column_name] == "BIGINT" else value
+
+        return record
+
+
+    def generate_record_groups(self, db_connector: AbstractAPI, partitions: list[Partition]) -> Iterable[tuple[dict[str, str | int], Iterable[tuple]]]:
+        """ The generalized QID values of every partition, with the rows of its sensitive values; with their count in the unique-sa-combinations mode """
+
+        if Config.output_mode == "individual":
+            for (partition, sensitive_values) in db_connector.generate_sensitive_values(partitions):
+                yield self.map_partition_to_record(partition), sensitive_values
+
+            return
+
+        for (partition, value_counts) in db_connector.generate_sensitive_value_counts(partitions):
+            yield self.map_partition_to_record(partition), (values + (count,) for (values, count) in value_counts)
+
+
+    def write_partitions(self, db_connector: AbstractAPI, partitions: list[Partition]):
+        output_size = get_output_size()
+        progress = tqdm.tqdm(unit="docs", total=output_size)
+
+        if self.file_format == "jsonl":
+            successes = self.write_jsonl(generate_output_docs(db_connector, partitions, self.map_partition_to_record), progress)
+        else:
+            assert Config.output_mode in ["individual", "unique-sa-combinations"], f"The {Config.output_mode} output mode is only supported in JSONL files"
+
+            successes = self.write_arrow(partitions[0], db_connector.get_sensitive_attr_types(), self.generate_record_groups(db_connector, partitions), progress)
+
+        print(f"Written {successes}/{output_size or '-'} records to {self.path}")
+
+
+    def write_jsonl(self, anon_docs: Iterable[dict], progress: tqdm.tqdm) -> int:
+        successes = 0
+
+        with open(self.path, "w") as anon_file:
+            for anon_doc in anon_docs:
+                anon_file.write(json.dumps(anon_doc, default=str) + "\n")
+                progress.update(1)
+                successes += 1
+
+        return successes
+
+
+    def write_arrow(self, first_partition: Partition, sensitive_attr_types: dict[str, str], record_groups: Iterable[tuple[dict[str, str | int], Iterable[tuple]]], progress: tqdm.tqdm) -> int:
+        # Optional dependency, only needed for the columnar formats
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        arrow_types = {"integer": pa.int64(), "float": pa.float64(), "boolean": pa.bool_(), "string": pa.string()}
+        converters = {"integer": int, "float": float, "boolean": bool, "string": str}
+
+        qid_types = {
+            column_name: pa.int64() if column_type == "BIGINT" else pa.string()
+            for attr in first_partition.attributes.values()
+            for column_name, column_type in attr.get_sql_column_types().items()
+        }
+        # The types of the sensitive attributes come from the backend, a batch of nulls or of mixed values does not change the schema
+        value_types = {**sensitive_attr_types, **({"count": "integer"} if Config.output_mode == "unique-sa-combinations" else {})}
+        value_column_names = list(value_types.keys())
+        column_names = list(qid_types.keys()) + value_column_names
+
+        schema = pa.schema(
+            [pa.field(column_name, pa.dictionary(pa.int32(), qid_type)) for column_name, qid_type in qid_types.items()] +
+            [pa.field(column_name, arrow_types[value_type]) for column_name, value_type in value_types.items()]
+        )
+
+        columns: dict[str, list] = {column_name: [] for column_name in column_names}
+        # Parquet stores a dictionary per column chunk, the dictionaries start empty in every row group. Arrow IPC files do not allow replacing 
+        # the dictionaries between the batches, only extending them: the values new to the batch are written as a delta.
+        dictionaries: dict[str, dict[str | int, int]] = {column_name: {} for column_name in qid_types.keys()}
+        dictionary_arrays: dict[str, pa.Array] = {column_name: pa.array([], type=qid_type) for column_name, qid_type in qid_types.items()}
+        new_dictionary_values: dict[str, list] = {column_name: [] for column_name in qid_types.keys()}
+        successes = 0
+
+        writer = (
+            pa.parquet.ParquetWriter(self.path, schema, use_dictionary=list(qid_types.keys())) if self.file_format == "parquet"
+            else pa.ipc.new_file(self.path, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        )
+
+        def look_up_qid_indices(record_with_qids: dict[str, str | int]) -> dict[str, int]:
+            qid_indices: dict[str, int] = {}
+
+            for column_name, value in record_with_qids.items():
+                index = dictionaries[column_name].get(value)
+
+                if index is None:
+                    index = dictionaries[column_name][value] = len(dictionaries[column_name])
+                    new_dictionary_values[column_name].append(value)
+
+                qid_indices[column_name] = index
+
+            return qid_indices
+
+        def flush():
+            arrays = []
+
+            for column_name, qid_type in qid_types.items():
+                if new_dictionary_values[column_name]:
+                    dictionary_arrays[column_name] = pa.concat_arrays([dictionary_arrays[column_name], pa.array(new_dictionary_values[column_name], type=qid_type)])
+                    new_dictionary_values[column_name].clear()
+
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(columns[column_name], type=pa.int32()), dictionary_arrays[column_name]))
+
+            for column_name, value_type in value_types.items():
+                convert = converters[value_type]
+                arrays.append(pa.array([value if value is None else convert(value) for value in columns[column_name]], type=arrow_types[value_type]))
+
+            batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+            if self.file_format == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]), row_group_size=self.row_group_size)
+
+                for column_name, qid_type in qid_types.items():
+                    dictionaries[column_name].clear()
+                    dictionary_arrays[column_name] = pa.array([], type=qid_type)
+            else:
+                writer.write_batch(batch)
+
+            for values in columns.values():
+                values.clear()
+
+        try:
+            for (record_with_qids, sensitive_values) in record_groups:
+                qid_indices = look_up_qid_indices(record_with_qids)
+
+                for values_per_record in sensitive_values:
+                    for column_name, index in qid_indices.items():
+                        columns[column_name].append(index)
+                    for column_name, value in zip(value_column_names, values_per_record):
+                        columns[column_name].append(value)
+
+                    successes += 1
+
+                    if successes % self.row_group_size == 0:
+                        flush()
+                        progress.update(self.row_group_size)
+
+                        # The partition continues in the next row group, with its own Parquet dictionaries
+                        qid_indices = look_up_qid_indices(record_with_qids)
+
+            if successes % self.row_group_size != 0:
+                flush()
+                progress.update(successes % self.row_group_size)
+        finally:
+            writer.close()
+
+        return successes
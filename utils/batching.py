@@ -0,0 +1,18 @@
+def split_into_batches(sizes: list[int], max_batch_length: int, max_batch_size: int) -> list[range]:
+    """ Split the indices of the items into consecutive batches of at most max_batch_length items, whose sizes add up to at most max_batch_size.
+    An item larger than max_batch_size gets a batch of its own. """
+
+    batches: list[range] = []
+    (batch_start, batch_size) = (0, 0)
+
+    for i, size in enumerate(sizes):
+        if i > batch_start and (i - batch_start == max_batch_length or batch_size + size > max_batch_size):
+            batches.append(range(batch_start, i))
+            (batch_start, batch_size) = (i, 0)
+
+        batch_size += size
+
+    if batch_start < len(sizes):
+        batches.append(range(batch_start, len(sizes)))
+
+    return batches
@@ -5,6 +5,7 @@ from models.gentree import GenTree
 from models.numrange import NumRange
 
 from utils.gen_hierarchy_parser import read_gen_hierarchies_from_json
+from utils.output_modes import OUTPUT_MODES
 
 
 def parse_config(config: dict[str, int|dict], db_connector: AbstractAPI):
@@ -19,13 +20,22 @@ def parse_config(config: dict[str, int|dict], db_connector: AbstractAPI):
     
     Config.gen_hiers = read_gen_hierarchies_from_json(Config.categorical_attr_config)
 
+    Config.ordinal_encoding = config.get("ordinal_encoding", False)
+    Config.output_mode = config.get("output_mode", "individual")
+
+    assert Config.output_mode in OUTPUT_MODES, f"Unknown output mode {Config.output_mode}"
+
+    if Config.ordinal_encoding:
+        for attr_name, gen_tree in Config.gen_hiers.items():
+            db_connector.add_ordinal_codes(attr_name, gen_tree.get_leaf_codes())
+
     Config.size_of_dataset = db_connector.get_document_count()
 
     _init_partitions_metadata(db_connector)
 
 
 def _init_partitions_metadata(db_connector: AbstractAPI):    
-    gen_hiers_and_num_ranges: dict[str, NumRange|GenTree] = Config.gen_hiers
+    gen_hiers_and_num_ranges: dict[str, NumRange|GenTree] = dict(Config.gen_hiers)
 
     for attr_name, value in Config.qids_config.items():        
         if value["type"] == "numerical" or value["type"] == "timestamp":
@@ -33,6 +43,6 @@ def _init_partitions_metadata(db_connector: AbstractAPI):
             gen_hiers_and_num_ranges[attr_name] = NumRange(min, max)
         
         if value["type"] == "ip":
-            gen_hiers_and_num_ranges[attr_name] = NumRange(0, 1)
+            gen_hiers_and_num_ranges[attr_name] = NumRange(0, 2 ** (32 if value.get("ip_version", 4) == 4 else 128) - 1)
                         
     Config.attr_metadata = gen_hiers_and_num_ranges
\ No newline at end of file
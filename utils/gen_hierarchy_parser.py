@@ -41,6 +41,8 @@ def _create_gen_tree_for_attribute(treename: str) -> dict[str, GenTree]:
 
     tree_file.close()
 
+    root.assign_leaf_codes()
+
     return root
 
 
@@ -51,6 +53,7 @@ def read_gen_hierarchies_from_json(gen_hierarchies: dict) -> dict[str, GenTree]:
 
     for hier_name, value in gen_hierarchies.items():                
         root = _get_child_nodes(value["tree"], None)
+        root.assign_leaf_codes()
         qid_dict[hier_name] = root
 
     return qid_dict
@@ -0,0 +1,95 @@
+from typing import Callable, Iterable, Tuple
+
+from interfaces.abstract_api import AbstractAPI
+
+from models.config import Config
+from models.partition import Partition
+
+
+OUTPUT_MODES = ["individual", "unique-sa-combinations", "sa-combination-arrays", "sa-arrays"]
+
+
+def map_values_to_individual_anonymized_docs(sensitive_values: Iterable[tuple], anon_doc_with_qids: dict):
+    ''' 
+    For every original document, create an anonymized one 
+        { ...qids, "sa_1": "a", "sa_2": "b" },
+        { ...qids, "sa_1": "a", "sa_2": "d" },
+        { ...qids, "sa_1": "a", "sa_2": "d" },
+    '''
+
+    for values in sensitive_values:
+        yield anon_doc_with_qids | dict(zip(Config.sensitive_attr_names, values))
+
+
+def map_value_counts_to_unique_sa_combinations_per_partition(value_counts: Iterable[Tuple[tuple, int]], anon_doc_with_qids: dict):
+    ''' 
+    For every unique sensitive attribute value combination, create a document with the count of documents with this signature
+        { ...qids, "sa_1": "a", "sa_2": "b", "count": 1 },
+        { ...qids, "sa_1": "a", "sa_2": "d", "count": 4 }, 
+        { ...qids, "sa_1": "c", "sa_2": "d", "count": 23 }
+    '''
+
+    for (values, count) in value_counts:
+        yield anon_doc_with_qids | dict(zip(Config.sensitive_attr_names, values)) | {"count": count}
+
+
+def map_value_counts_to_array_of_unique_sa_combinations_per_partition(value_counts: Iterable[Tuple[tuple, int]], anon_doc_with_qids: dict):
+    ''' 
+    For every partition, create one document, with all sensitive attribute values mapped into one sensitive_attr_names field 
+        { 
+            ...qids,
+            "sensitive_attributes": [
+                { "sa_1": "a", "sa_2": "b", "count": 1},
+                { "sa_1": "a", "sa_2": "d", "count": 4}
+                { "sa_1": "c", "sa_2": "d", "count": 23}
+            ]
+        }
+    '''
+
+    yield anon_doc_with_qids | {"sensitive_attributes": [dict(zip(Config.sensitive_attr_names, values)) | {"count": count} for (values, count) in value_counts]}
+
+
+def map_value_counts_to_sa_arrays_per_partition(value_counts: Iterable[Tuple[tuple, int]], anon_doc_with_qids: dict):
+    ''' 
+    For every partition, create one document, with all sensitive values dumped into an array
+        { 
+            ...qids,
+            "sa_1": [ "a", "a", "c" ],
+            "sa_2": [ "b", "d", "d" ]
+        }
+    '''
+
+    sensitive_attributes = {sensitive_attr_name: [] for sensitive_attr_name in Config.sensitive_attr_names}
+
+    for (values, count) in value_counts:
+        for sensitive_attr_name, value in zip(Config.sensitive_attr_names, values):
+            sensitive_attributes[sensitive_attr_name] += [value] * count
+
+    yield anon_doc_with_qids | sensitive_attributes
+
+
+def get_output_size() -> int | None:
+    """ The number of anonymized documents is known up front only if there is one for every original document """
+
+    return Config.size_of_dataset if Config.output_mode == "individual" else None
+
+
+VALUE_COUNT_MAPPERS = {
+    "unique-sa-combinations": map_value_counts_to_unique_sa_combinations_per_partition,
+    "sa-combination-arrays": map_value_counts_to_array_of_unique_sa_combinations_per_partition,
+    "sa-arrays": map_value_counts_to_sa_arrays_per_partition
+}
+
+
+def generate_output_docs(db_connector: AbstractAPI, partitions: list[Partition], map_partition_to_doc: Callable[[Partition], dict]):
+    """ Create the anonymized documents in the shape of Config.output_mode. Except for the individual documents, the combinations of the sensitive
+    values are counted by the backend, so only one row per distinct combination and partition is fetched. """
+
+    if Config.output_mode == "individual":
+        for (partition, sensitive_values) in db_connector.generate_sensitive_values(partitions):
+            yield from map_values_to_individual_anonymized_docs(sensitive_values, map_partition_to_doc(partition))
+
+        return
+
+    for (partition, value_counts) in db_connector.generate_sensitive_value_counts(partitions):
+        yield from VALUE_COUNT_MAPPERS[Config.output_mode](value_counts, map_partition_to_doc(partition))
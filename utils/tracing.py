@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Trace(object):
+    """ Global collector of the timed spans of a run
+
+    Attributes
+        enabled                             the spans of the backend calls are only recorded, if tracing was switched on
+        phase                               the phase of the run the calls are made in: setup / config parsing / partitioning / push
+        spans                               the recorded spans, with their start and duration in seconds since the origin
+        origin                              the perf_counter value the spans are relative to
+    """
+
+    enabled: bool = False
+    phase: str = "setup"
+    spans: list[dict] = []
+    origin: float = time.perf_counter()
+    lock = threading.Lock()
+
+
+def enable_tracing():
+    Trace.enabled = True
+    Trace.spans = []
+    Trace.origin = time.perf_counter()
+
+
+def record_span(name: str, start: float, end: float, phase: str = None, args: dict = None):
+    """ The start and end are perf_counter values """
+
+    if not Trace.enabled:
+        return
+
+    span = {
+        "name": name,
+        "phase": phase if phase is not None else Trace.phase,
+        "start": start - Trace.origin,
+        "duration": end - start,
+        "thread": threading.get_ident(),
+        "args": args or {}
+    }
+
+    with Trace.lock:
+        Trace.spans.append(span)
+
+
+@contextmanager
+def trace_phase(phase: str):
+    """ Attribute the backend calls to the phase, recorded itself as an enclosing span """
+
+    previous_phase = Trace.phase
+    Trace.phase = phase
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record_span(phase, start, time.perf_counter(), phase="phase")
+        Trace.phase = previous_phase
+
+
+def export_chrome_trace(file_path: str):
+    """ Write the spans as complete events of the Chrome trace event format, to be opened in chrome://tracing or Perfetto """
+
+    thread_ids: dict[int, int] = {}
+
+    events = [
+        {
+            "name": span["name"],
+            "cat": span["phase"],
+            "ph": "X",
+            "ts": round(span["start"] * 1e6, 3),
+            "dur": round(span["duration"] * 1e6, 3),
+            "pid": 0,
+            "tid": thread_ids.setdefault(span["thread"], len(thread_ids)),
+            "args": span["args"]
+        }
+        for span in Trace.spans
+    ]
+
+    with open(file_path, "w") as trace_file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+
+def summarize_spans() -> list[dict]:
+    """ Per operation: the number of calls, the total time and the p50/p99 latency, the most time consuming first """
+
+    durations_per_operation: dict[str, list[float]] = {}
+
+    for span in Trace.spans:
+        if span["phase"] != "phase":
+            durations_per_operation.setdefault(span["name"], []).append(span["duration"])
+
+    summary = [
+        {
+            "operation": operation,
+            "count": len(durations),
+            "total": float(np.sum(durations)),
+            "p50": float(np.percentile(durations, 50)),
+            "p99": float(np.percentile(durations, 99))
+        }
+        for operation, durations in durations_per_operation.items()
+    ]
+
+    return sorted(summary, key=lambda row: row["total"], reverse=True)
+
+
+def print_trace_summary():
+    phases = [span for span in Trace.spans if span["phase"] == "phase"]
+    summary = summarize_spans()
+
+    print(f"\n{'phase':<45}{'seconds':>10}")
+    for span in phases:
+        print(f"{span['name']:<45}{span['duration']:>10.3f}")
+
+    print(f"\n{'operation':<45}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for row in summary:
+        print(f"{row['operation']:<45}{row['count']:>8}{row['total']:>10.3f}{row['p50'] * 1000:>10.2f}{row['p99'] * 1000:>10.2f}")